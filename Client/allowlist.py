@@ -0,0 +1,303 @@
+# Sorted, block-structured allow-list stored in flash
+#
+# File layout (all integers little endian):
+#   header (16 bytes): magic "RFAL", version, key size, keys per block,
+#                      block count, build fill
+#   blocks (BLOCK_SIZE bytes each): fence key, key count, sorted keys
+#
+# A key is one length byte followed by the UID bytes, zero padded to
+# KEY_SIZE. The fence key of a block is <= every key stored in it and
+# > every key stored in the previous block, so a lookup is a binary search
+# over the fences followed by a binary search inside a single block. Only
+# one block is ever held in RAM.
+
+import os
+import struct
+
+MAGIC = b"RFAL"
+VERSION = 1
+KEY_SIZE = 8  # 1 length byte + up to 7 UID bytes (4 and 7 byte UIDs)
+BLOCK_SIZE = 512
+BLOCK_HEADER = 16  # fence key + count, padded
+KEYS_PER_BLOCK = (BLOCK_SIZE - BLOCK_HEADER) // KEY_SIZE
+BUILD_FILL = 48  # keys written per block by build(), leaves room for inserts
+HEADER_FMT = "<4sBBHIH2x"
+HEADER_SIZE = 16
+
+
+def encode_uid(uid, key=None):
+    """
+    Encode a UID into a fixed width key.
+
+    ## Parameters:
+        - uid (list or bytes): The UID bytes as returned by `SelectTagSN`.
+        - key (bytearray): Optional buffer of KEY_SIZE bytes to fill in place.
+
+    ## Returns:
+        - bytearray: The encoded key.
+
+    ## Raises:
+        - ValueError: If the UID does not fit in a key.
+    """
+    if len(uid) > KEY_SIZE - 1:
+        raise ValueError("UID too long")
+    if key is None:
+        key = bytearray(KEY_SIZE)
+    key[0] = len(uid)
+    for i in range(1, KEY_SIZE):
+        key[i] = uid[i - 1] if i <= len(uid) else 0
+    return key
+
+
+def _cmp(buf, off, key):
+    # Compare buf[off:off + KEY_SIZE] with key without slicing
+    for i in range(KEY_SIZE):
+        a = buf[off + i]
+        b = key[i]
+        if a != b:
+            return -1 if a < b else 1
+    return 0
+
+
+def _write_header(f, blocks):
+    f.write(
+        struct.pack(
+            HEADER_FMT, MAGIC, VERSION, KEY_SIZE, KEYS_PER_BLOCK, blocks, BUILD_FILL
+        )
+    )
+
+
+def _flush_block(f, block, count):
+    struct.pack_into("<H", block, KEY_SIZE, count)
+    f.write(block)
+
+
+def _write_blocks(f, keys):
+    # Stream sorted keys into blocks of BUILD_FILL keys, returns block count
+    block = bytearray(BLOCK_SIZE)
+    blocks = count = 0
+    prev = None
+    for key in keys:
+        key = bytes(key)
+        if prev is not None and key <= prev:
+            raise ValueError("keys must be sorted and unique")
+        prev = key
+        if count == BUILD_FILL:
+            _flush_block(f, block, count)
+            blocks += 1
+            count = 0
+        if count == 0:
+            for i in range(BLOCK_SIZE):
+                block[i] = 0
+            block[0:KEY_SIZE] = key
+        off = BLOCK_HEADER + count * KEY_SIZE
+        block[off : off + KEY_SIZE] = key
+        count += 1
+    if count or not blocks:
+        _flush_block(f, block, count)
+        blocks += 1
+    return blocks
+
+
+def build(path, keys):
+    """
+    Write a new allow-list file from sorted keys.
+
+    The file is written next to `path` and renamed over it, so a power loss
+    during a full download never leaves a half written list behind.
+
+    ## Parameters:
+        - path (str): Destination file.
+        - keys (iterable): Encoded keys (see `encode_uid`) in ascending order.
+
+    ## Raises:
+        - ValueError: If the keys are not sorted or contain duplicates.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        _write_header(f, 0)
+        blocks = _write_blocks(f, keys)
+        f.seek(0)
+        _write_header(f, blocks)
+    os.rename(tmp, path)
+
+
+class AllowList:
+    """
+    Read and update an allow-list file without loading it onto the heap.
+
+    ## Parameters:
+        - path (str): The allow-list file created by `build`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.block = bytearray(BLOCK_SIZE)
+        self.block_mv = memoryview(self.block)
+        self.fence = bytearray(KEY_SIZE)
+        self.key = bytearray(KEY_SIZE)
+        self.f = None
+        self._open()
+
+    def _open(self):
+        self.f = open(self.path, "r+b")
+        magic, version, key_size, per_block, blocks, _ = struct.unpack(
+            HEADER_FMT, self.f.read(HEADER_SIZE)
+        )
+        if magic != MAGIC or version != VERSION or key_size != KEY_SIZE:
+            self.f.close()
+            raise ValueError("bad allow-list file")
+        self.blocks = blocks
+
+    def close(self):
+        if self.f:
+            self.f.close()
+            self.f = None
+
+    def _find_block(self, key):
+        # Last block whose fence is <= key (block 0 if key is below every fence)
+        lo, hi = 0, self.blocks - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            self.f.seek(HEADER_SIZE + mid * BLOCK_SIZE)
+            self.f.readinto(self.fence)
+            if _cmp(self.fence, 0, key) <= 0:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _load(self, index):
+        self.f.seek(HEADER_SIZE + index * BLOCK_SIZE)
+        self.f.readinto(self.block_mv)
+        return struct.unpack_from("<H", self.block, KEY_SIZE)[0]
+
+    def _store(self, index, count):
+        struct.pack_into("<H", self.block, KEY_SIZE, count)
+        self.f.seek(HEADER_SIZE + index * BLOCK_SIZE)
+        self.f.write(self.block_mv)
+        self.f.flush()
+
+    def _search(self, count, key):
+        # Returns (found, position) inside the loaded block
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            c = _cmp(self.block, BLOCK_HEADER + mid * KEY_SIZE, key)
+            if c == 0:
+                return True, mid
+            if c < 0:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False, lo
+
+    def contains(self, uid):
+        """
+        Check whether a UID is on the allow-list.
+
+        ## Parameters:
+            - uid (list or bytes): The UID bytes read from the tag.
+
+        ## Returns:
+            - bool: True if the UID is allowed.
+        """
+        key = encode_uid(uid, self.key)
+        count = self._load(self._find_block(key))
+        return self._search(count, key)[0]
+
+    def add(self, uid):
+        """
+        Insert a UID, rewriting the single block it belongs to.
+
+        When that block is full the file is rebuilt once with fresh slack in
+        every block.
+
+        ## Parameters:
+            - uid (list or bytes): The UID bytes to allow.
+
+        ## Returns:
+            - bool: True if the UID was added, False if it was already present.
+        """
+        key = encode_uid(uid, self.key)
+        index = self._find_block(key)
+        count = self._load(index)
+        found, pos = self._search(count, key)
+        if found:
+            return False
+        if count == KEYS_PER_BLOCK:
+            self._rebuild(bytes(key))
+            return True
+        off = BLOCK_HEADER + pos * KEY_SIZE
+        end = BLOCK_HEADER + count * KEY_SIZE
+        self.block[off + KEY_SIZE : end + KEY_SIZE] = self.block_mv[off:end]
+        self.block[off : off + KEY_SIZE] = key
+        if _cmp(self.block, 0, key) > 0:
+            self.block[0:KEY_SIZE] = key
+        self._store(index, count + 1)
+        return True
+
+    def remove(self, uid):
+        """
+        Delete a UID, rewriting the single block it belongs to.
+
+        The fence key is kept so an emptied block still orders correctly.
+
+        ## Parameters:
+            - uid (list or bytes): The UID bytes to revoke.
+
+        ## Returns:
+            - bool: True if the UID was removed, False if it was not present.
+        """
+        key = encode_uid(uid, self.key)
+        index = self._find_block(key)
+        count = self._load(index)
+        found, pos = self._search(count, key)
+        if not found:
+            return False
+        off = BLOCK_HEADER + pos * KEY_SIZE
+        end = BLOCK_HEADER + count * KEY_SIZE
+        self.block[off : end - KEY_SIZE] = self.block_mv[off + KEY_SIZE : end]
+        for i in range(end - KEY_SIZE, end):
+            self.block[i] = 0
+        self._store(index, count - 1)
+        return True
+
+    def apply(self, inserts=(), deletes=()):
+        """
+        Apply a server supplied delta.
+
+        ## Parameters:
+            - inserts (iterable): UIDs to allow.
+            - deletes (iterable): UIDs to revoke.
+        """
+        for uid in deletes:
+            self.remove(uid)
+        for uid in inserts:
+            self.add(uid)
+
+    def _keys(self, extra):
+        # Stream every stored key in order, merging in `extra`
+        pending = extra
+        for index in range(self.blocks):
+            count = self._load(index)
+            for i in range(count):
+                off = BLOCK_HEADER + i * KEY_SIZE
+                key = self.block_mv[off : off + KEY_SIZE]
+                if pending is not None and _cmp(self.block, off, pending) > 0:
+                    yield pending
+                    pending = None
+                yield key
+        if pending is not None:
+            yield pending
+
+    def _rebuild(self, extra):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            _write_header(f, 0)
+            blocks = _write_blocks(f, self._keys(extra))
+            f.seek(0)
+            _write_header(f, blocks)
+        self.close()
+        os.rename(tmp, self.path)
+        self._open()
@@ -1,39 +1,164 @@
-import math
+import time
+
+
+def ticks_ms():
+    # time.ticks_ms only exists on MicroPython
+    if hasattr(time, "ticks_ms"):
+        return time.ticks_ms()
+    return int(time.time() * 1000)
+
+
+def ticks_since(start):
+    # ticks_ms wraps around on MicroPython, time.ticks_diff handles it
+    if hasattr(time, "ticks_diff"):
+        return time.ticks_diff(ticks_ms(), start)
+    return ticks_ms() - start
+
+
+BOOT_TICKS = ticks_ms()
+
+import binascii
+import framebuf
+import gc
 import network
-import urequests as requests
+import os
+import socket
 import ujson as json
-import time
-from machine import Pin, SPI, I2C, Timer
-import _thread
+from machine import Pin, I2C
 from mfrc522 import MFRC522
 from ssd1306 import SSD1306_I2C
-from env import DOOR_ID, WLAN_SSID, WLAN_SSID, WLAN_PASS, SERVER_IP, SERVER_PORT
+from env import DOOR_ID, WLAN_SSID, WLAN_PASS, SERVER_IP, SERVER_PORT
+
+try:
+    from env import WLAN_IFCONFIG  # Optional static (ip, netmask, gateway, dns)
+except ImportError:
+    WLAN_IFCONFIG = None
+
+try:
+    from env import ACCESS_PROTOCOL  # "http" (default) or "udp" for the compact protocol
+except ImportError:
+    ACCESS_PROTOCOL = "http"
+
+try:
+    from env import SERVER_UDP_PORT
+except ImportError:
+    SERVER_UDP_PORT = 5001
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+boot_timings = []
+
+
+def boot_phase(name):
+    """
+    Record and log how long after power-up a boot phase completed.
+
+    ## Parameters:
+        - name (str): The phase that just completed.
+    """
+    elapsed = ticks_ms() - BOOT_TICKS
+    boot_timings.append((name, elapsed))
+    print("boot:", name, elapsed, "ms")
 
 
 # Initialize RFID reader
-reader = MFRC522(spi_id=0, sck=6, miso=4, mosi=7, cs=5, rst=22)
+READER_IRQ_PIN = None  # GPIO wired to the RC522 IRQ pin, None to poll the chip instead
+reader = MFRC522(spi_id=0, sck=6, miso=4, mosi=7, cs=5, rst=22, irq=READER_IRQ_PIN)
 
 # Initialize I2C for the OLED display
 i2c = I2C(id=0, scl=Pin(1), sda=Pin(0), freq=200000)
 oled = None
 
-# Initialize greenLED
+# Initialize LEDs
 greenled = Pin(16, Pin.OUT)
-greenled.on()
-time.sleep(0.5)
-greenled.off()
-# Initialize redLED
 redled = Pin(21, Pin.OUT)
-redled.on()
-time.sleep(0.5)
-redled.off()
+
+boot_phase("drivers")
+
+FIRMWARE_VERSION = "1.1.0"
+
+# Timings (seconds)
+SCREEN_TIMEOUT = 20
+POLL_INTERVAL = 0.05  # Delay between two RFID polls right after activity
+POLL_INTERVAL_IDLE = 0.3  # The delay doubles up to this while no card is present
+LED_TIME = 2  # How long the green/red LED stays on after a scan
+REPEAT_DELAY = 2  # Ignore the same tag for this long while it stays in the field
+HTTP_TIMEOUT = 5
+UDP_TIMEOUT = 0.5  # Resend a compact access request after this long without a reply
+UDP_RETRIES = 3
+UDP_POLL = 0.005
+MAX_PENDING_SCANS = 4  # Oldest scans are dropped while the server is unreachable
+SCAN_MAX_AGE = 3  # Queued scans older than this are dropped, the person has likely left
+MAX_PENDING_MESSAGES = 4
+HEARTBEAT_INTERVAL = 60  # The server shows the reader offline after three missed heartbeats
+FAST_CONNECT_TIMEOUT = 5  # Give up on the cached network settings after this long
+NET_CACHE_FILE = "netcache.json"
+SCREENSAVER_FPS = 10  # Frame rate cap for the screensaver animation
+SCREENSAVER_STEP = 1  # Radius step between frames
+SCREENSAVER_MIN_RADIUS = 36
+SCREENSAVER_MAX_RADIUS = 64
+SCREENSAVER_FRAMES = (SCREENSAVER_MAX_RADIUS - SCREENSAVER_MIN_RADIUS) // SCREENSAVER_STEP + 1
+SCREEN_CENTER_X = 64
+SCREEN_CENTER_Y = 32
 
 # Global variables
+ip_address = ""
 last_activity_time = time.time()
 screensaver_active = False
-screensaver_thread_running = False
-inactivity_timer = Timer(-1)
-SCREEN_TIMEOUT = 20
+led_off_time = 0
+pending_messages = []
+screensaver_circles = []  # Start of each radius in screensaver_points, and the end
+screensaver_points = None  # Quadrant offsets of the screensaver circles, see build_screensaver_circles
+frame_ip = None  # IP shown in the static header/footer, None when they must be redrawn
+lease_from_cache = False  # True while the reader runs on the IP configuration of netcache.json
+checking = False  # True while an access request is in flight
+first_scan = True
+display_event = asyncio.Event()
+scan_event = asyncio.Event()
+network_ready = asyncio.Event()
+boot_time = time.time()
+mem_low = 0  # Lowest gc.mem_free() seen since boot
+
+# Preallocated buffers for the scan path, so a scan does not allocate on the heap
+UID_SIZE = 10
+tag_uid = bytearray(UID_SIZE)
+last_uid = bytearray(UID_SIZE)
+scan_uids = [bytearray(UID_SIZE) for _ in range(MAX_PENDING_SCANS)]  # Ring of queued scans
+scan_lens = bytearray(MAX_PENDING_SCANS)
+scan_ticks = [0] * MAX_PENDING_SCANS  # ticks_ms() of each queued scan
+send_uid = bytearray(UID_SIZE)  # UID being sent, copied out of the ring before any await
+scan_head = 0
+scan_count = 0
+
+ACCESS_HEAD = (
+    "POST /access HTTP/1.0\r\nHost: %s\r\n"
+    "Content-Type: application/json\r\nContent-Length: " % SERVER_IP
+).encode()
+ACCESS_BODY_UID = b'{"rfid_uid": "'
+ACCESS_BODY_DOOR = ('", "door_id": %s}' % json.dumps(DOOR_ID)).encode()
+request_buf = bytearray(256)
+request_buf[: len(ACCESS_HEAD)] = ACCESS_HEAD
+request_mv = memoryview(request_buf)
+response_buf = bytearray(512)
+response_mv = memoryview(response_buf)
+response_lock = asyncio.Lock()  # Held from sending a request until its reply is decoded
+drain_buf = bytearray(64)
+
+# Compact access protocol (see Server/Program/accessProtocol.py): 22 byte request with the
+# magic, version, UID length, door id, nonce and UID; 32 byte reply with the grant flag, the
+# nonce and a display name
+UDP_REQUEST_SIZE = 22
+UDP_REPLY_SIZE = 32
+udp_request = bytearray(UDP_REQUEST_SIZE)
+udp_request[0:4] = b"RA\x01\x00"
+for i in range(4):
+    udp_request[4 + i] = (int(DOOR_ID) >> (24 - 8 * i)) & 0xFF
+udp_nonce = ticks_ms() & 0xFFFFFFFF
+udp_socket = None
+udp_address = None
 
 
 def init_oled():
@@ -46,7 +171,8 @@ def init_oled():
     ## Raises:
     - Exception: If there's an error initializing the OLED display.
     """
-    global oled
+    global oled, frame_ip
+    frame_ip = None
     try:
         oled = SSD1306_I2C(128, 64, i2c)
         oled.fill(0)
@@ -59,9 +185,29 @@ def init_oled():
 
 def display_message(message, ip_address):
     """
-    Display a message on the OLED screen.
+    Queue a message for the OLED screen.
 
-    This function displays a message on the OLED screen along with the IP address.
+    The message is drawn by `display_task`, so callers never wait on the I2C bus. Messages are
+    drawn in order; only the latest few are kept if the display falls behind.
+
+    ## Parameters:
+        - message (str): The message to be displayed.
+        - ip_address (str): The IP address to be displayed.
+    """
+    reset_inactivity_timer()
+    if len(pending_messages) >= MAX_PENDING_MESSAGES:
+        pending_messages.pop(0)
+    pending_messages.append((message, ip_address))
+    display_event.set()
+
+
+def render_message(message, ip_address):
+    """
+    Draw a message on the OLED screen along with the door ID and the IP address.
+
+    The door ID and IP address only change on boot or reconnection, so when they are already
+    on screen only the message area is cleared and redrawn, and the display driver sends just
+    those pages.
 
     ## Parameters:
         - message (str): The message to be displayed.
@@ -70,20 +216,21 @@ def display_message(message, ip_address):
     ## Raises:
         - Exception: If there's an error displaying the message on the OLED screen.
     """
-    global last_activity_time, screensaver_active, screensaver_thread_running
-    last_activity_time = time.time()
-    screensaver_active = False
-    screensaver_thread_running = False
+    global frame_ip
     try:
-        oled.fill(0)
-        oled.text(f"Door ID: {DOOR_ID}", 0, 0)  # Display Door ID at the top
-        oled.text("___________________", 0, 3)
+        if frame_ip != ip_address:
+            oled.fill(0)
+            oled.text(f"Door ID: {DOOR_ID}", 0, 0)  # Display Door ID at the top
+            oled.text("___________________", 0, 3)
+            oled.text("__________________", 0, 47)
+            oled.text(ip_address, 0, 57)  # Display IP address at the bottom
+            frame_ip = ip_address
+        else:
+            oled.fill_rect(0, 16, 128, 31, 0)  # Clear the message area only
 
         lines = message.split("\n")
         for i, line in enumerate(lines):
             oled.text(line, 0, 20 + i * 10)  # Adjust the y position for each line
-        oled.text("__________________", 0, 47)
-        oled.text(ip_address, 0, 57)  # Display IP address at the bottom
         oled.show()
     except Exception as e:
         greenled.off()
@@ -92,21 +239,13 @@ def display_message(message, ip_address):
         init_oled()
 
 
-# Function to draw a circle
-def draw_circle(oled, x0, y0, radius, color):
+def circle_octant(radius):
+    # Midpoint circle algorithm, the points of one octant as offsets from the center
     x = radius
     y = 0
     err = 0
-
     while x >= y:
-        oled.pixel(x0 + x, y0 + y, color)
-        oled.pixel(x0 + y, y0 + x, color)
-        oled.pixel(x0 - y, y0 + x, color)
-        oled.pixel(x0 - x, y0 + y, color)
-        oled.pixel(x0 - x, y0 - y, color)
-        oled.pixel(x0 - y, y0 - x, color)
-        oled.pixel(x0 + y, y0 - x, color)
-        oled.pixel(x0 + x, y0 - y, color)
+        yield x, y
         y += 1
         err += 1 + 2 * y
         if 2 * (err - x) + 1 > 0:
@@ -114,203 +253,769 @@ def draw_circle(oled, x0, y0, radius, color):
             err += 1 - 2 * x
 
 
-# Screensaver function with circular wave animation
-def screensaver():
+async def build_screensaver_circles():
     """
-    Activate the screensaver with RF-AD animation.
+    Precompute the circles of the RF-AD screensaver animation.
 
-    This function activates the screensaver by displaying an RF-AD animation moving across the screen.
+    One quadrant of every circle is stored as (x, y) offset byte pairs from the center, keeping
+    only the rows that fall on the screen: about 2 KB for all the radii in a single bytearray,
+    instead of a framebuffer per frame. `screensaver_frame` mirrors them into the display
+    buffer. The event loop is yielded between radii so tag polling is not delayed at boot.
+    """
+    global screensaver_points
+    radii = range(SCREENSAVER_MIN_RADIUS, SCREENSAVER_MAX_RADIUS)
+    size = 0
+    for radius in radii:
+        for x, y in circle_octant(radius):
+            size += (y <= SCREEN_CENTER_Y) + (x <= SCREEN_CENTER_Y)
+    points = bytearray(2 * size)
+    pos = 0
+    for radius in radii:
+        screensaver_circles.append(pos)
+        for x, y in circle_octant(radius):
+            if y <= SCREEN_CENTER_Y:
+                points[pos] = x
+                points[pos + 1] = y
+                pos += 2
+            if x <= SCREEN_CENTER_Y:
+                points[pos] = y
+                points[pos + 1] = x
+                pos += 2
+        await asyncio.sleep(0)
+    screensaver_circles.append(pos)
+    screensaver_points = points
+
+
+def screensaver_frame(index):
+    """
+    Draw one frame of the RF-AD screensaver animation into the display buffer and show it.
 
-    ## Global Variables:
-        - screensaver_active (bool): Flag indicating if the screensaver is active.
-        - screensaver_thread_running (bool): Flag indicating if the screensaver thread is running.
-        - last_activity_time (float): Timestamp of the last activity.
+    ## Parameters:
+        - index (int): The frame to show.
 
+    ## Returns:
+        - int: The index of the next frame.
     """
-    global screensaver_active, screensaver_thread_running
-    text = "RF-AD"
-    center_x = 64  # Center horizontally
-    center_y = 32  # Center vertically
-    radius = 36
-    max_radius = 64  # Maximum radius for the animation
-    while screensaver_active:
-        try:
-            oled.fill(0)
-            oled.text(text, 44, 28)
+    global frame_ip
+    points = screensaver_points
+    if points is None:
+        return index
+    frame_ip = None
+    oled.fill(0)
+    oled.text("RF-AD", 44, 28)
+    pixel = oled.pixel
+    cx = SCREEN_CENTER_X
+    cy = SCREEN_CENTER_Y
+    # Draw expanding circles
+    for radius in range(SCREENSAVER_MIN_RADIUS + index * SCREENSAVER_STEP, SCREENSAVER_MAX_RADIUS, 5):
+        circle = radius - SCREENSAVER_MIN_RADIUS
+        for i in range(screensaver_circles[circle], screensaver_circles[circle + 1], 2):
+            x = points[i]
+            y = points[i + 1]
+            pixel(cx + x, cy + y, 1)
+            pixel(cx - x, cy + y, 1)
+            pixel(cx + x, cy - y, 1)
+            pixel(cx - x, cy - y, 1)
+    oled.show()
+    return (index + 1) % SCREENSAVER_FRAMES
 
-            # Draw expanding circles
-            for r in range(radius, max_radius, 5):
-                draw_circle(oled, center_x, center_y, r, 1)
 
-            oled.show()
-            radius += 1
-            if radius > max_radius:
-                radius = 36
+def reset_inactivity_timer():
+    """
+    Reset the inactivity timer.
+
+    This function resets the last activity time to the current time, effectively restarting the
+    inactivity timer.
+    """
+    global last_activity_time
+    last_activity_time = time.time()
 
-            time.sleep(0.01)
-        except Exception as e:
-            break
-        # Check for activity
-        if time.time() - last_activity_time <= SCREEN_TIMEOUT:
-            #oled.fill(0)
-            screensaver_active = False
-            screensaver_thread_running = False
-            break
 
+def mem_free():
+    """
+    Return the free heap (gc.mem_free only exists on MicroPython) and update the low-water mark.
 
-def start_screensaver_thread():
+    ## Returns:
+        - int: Free heap in bytes, 0 when not available.
     """
-    Start the screensaver thread if it's not already running.
+    global mem_low
+    if not hasattr(gc, "mem_free"):
+        return 0
+    free = gc.mem_free()
+    if not mem_low or free < mem_low:
+        mem_low = free
+    return free
+
+
+def put_bytes(buf, pos, data):
+    """Copy `data` into `buf` at `pos` and return the position after it."""
+    end = pos + len(data)
+    buf[pos:end] = data
+    return end
+
+
+def put_decimal(buf, pos, value):
+    """Write `value` (0-999) in decimal into `buf` at `pos` and return the position after it."""
+    if value >= 100:
+        buf[pos] = 48 + value // 100
+        pos += 1
+    if value >= 10:
+        buf[pos] = 48 + value // 10 % 10
+        pos += 1
+    buf[pos] = 48 + value % 10
+    return pos + 1
 
-    This function starts the screensaver thread if it's not already running. It sets flags to indicate
-    the screensaver is active and the thread is running.
+
+def decimal_length(value):
+    return 3 if value >= 100 else 2 if value >= 10 else 1
+
+
+async def display_task():
+    """
+    Draw queued messages and run the screensaver when the reader is idle.
+
+    Messages queued with `display_message` are drawn as soon as they arrive. After
+    SCREEN_TIMEOUT seconds without activity, the screensaver frames are drawn at
+    no more than SCREENSAVER_FPS frames per second, and are paused while a tag is being checked.
 
     ## Global Variables:
         - screensaver_active (bool): Flag indicating if the screensaver is active.
-        - screensaver_thread_running (bool): Flag indicating if the screensaver thread is running.
+        - pending_messages (list): Messages queued for the screen.
     """
-    global screensaver_active, screensaver_thread_running
-    if not screensaver_thread_running:
-        screensaver_active = True
-        screensaver_thread_running = True
-        _thread.start_new_thread(screensaver, ())
+    global screensaver_active
+    frame = 0
+    while True:
+        if screensaver_active:
+            timeout = 1 / SCREENSAVER_FPS
+        else:
+            timeout = max(0, SCREEN_TIMEOUT - (time.time() - last_activity_time))
+        try:
+            await asyncio.wait_for(display_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        if display_event.is_set():
+            display_event.clear()
+            screensaver_active = False
+            while pending_messages:
+                message, ip = pending_messages.pop(0)
+                render_message(message, ip)
+        elif time.time() - last_activity_time > SCREEN_TIMEOUT and not checking:
+            screensaver_active = True
+            try:
+                frame = screensaver_frame(frame)
+            except Exception as e:
+                print("display error:", e)
 
 
-def handle_inactivity(timer):
+def signal_access(granted):
+    """
+    Turn on the green or red LED; `led_task` turns it off after LED_TIME seconds.
+
+    ## Parameters:
+        - granted (bool): True to light the green LED, False for the red one.
     """
-    Handle user inactivity by starting the screensaver if necessary.
+    global led_off_time
+    greenled.value(1 if granted else 0)
+    redled.value(0 if granted else 1)
+    # Add code here to open the door (e.g., trigger a relay)
+    led_off_time = time.time() + LED_TIME
 
-    This function is called by a timer to check for user inactivity. If the specified time period
-    has passed since the last activity, it starts the screensaver thread.
 
+async def led_task():
     """
-    if time.time() - last_activity_time > SCREEN_TIMEOUT:
-        start_screensaver_thread()
+    Turn the LEDs off and go back to the idle message once LED_TIME has elapsed.
 
+    ## Global Variables:
+        - led_off_time (float): When the LEDs must be turned off, 0 if they are off.
+    """
+    global led_off_time
+    while True:
+        if led_off_time and time.time() >= led_off_time:
+            led_off_time = 0
+            greenled.off()
+            redled.off()  # Turn off the LED
+            if not scan_count and not checking:
+                display_message("Scan your tag", ip_address)
+                gc.collect()  # Idle point: the reader is back to waiting for a tag
+        await asyncio.sleep(0.1)
 
-def reset_inactivity_timer():
+
+async def read_into(stream_reader, buf):
+    # uasyncio streams read straight into the buffer, CPython ones return bytes
+    if hasattr(stream_reader, "readinto"):
+        return await stream_reader.readinto(buf)
+    chunk = await stream_reader.read(len(buf))
+    buf[: len(chunk)] = chunk
+    return len(chunk)
+
+
+async def http_exchange(request):
     """
-    Reset the inactivity timer.
+    Send a raw HTTP request and read the answer into `response_buf`.
 
-    This function resets the last activity time to the current time, effectively restarting the
-    inactivity timer.
+    Only the first len(response_buf) bytes of the answer are kept, the rest is read and dropped.
+    The heartbeat, the server check and the access requests share `response_buf`: callers hold
+    `response_lock` until they are done reading it.
+
+    ## Parameters:
+        - request (bytes-like): The complete request, headers and body.
+
+    ## Returns:
+        - tuple: The status code, the offset of the body and the number of bytes kept.
+
+    ## Raises:
+        - Exception: If the connection fails or times out, or the answer has no status line.
     """
-    global last_activity_time
-    last_activity_time = time.time()
+    stream_reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(SERVER_IP, SERVER_PORT), HTTP_TIMEOUT
+    )
+    size = len(response_buf)
+    length = 0
+    try:
+        writer.write(request)
+        await writer.drain()
+        while True:
+            if length < size:
+                n = await asyncio.wait_for(
+                    read_into(stream_reader, response_mv[length:]), HTTP_TIMEOUT
+                )
+                length += n
+            else:
+                n = await asyncio.wait_for(read_into(stream_reader, drain_buf), HTTP_TIMEOUT)
+            if not n:
+                break
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+    # "HTTP/1.x NNN ..." then the headers, the body starts after the first empty line
+    # A reply too short for a status line would otherwise be parsed from stale bytes
+    if length < 12:
+        raise OSError("invalid HTTP reply")
+    status = 0
+    for i in range(9, 12):
+        digit = response_buf[i] - 48
+        if not 0 <= digit <= 9:
+            raise OSError("invalid HTTP reply")
+        status = status * 10 + digit
+    start = length
+    for i in range(12, length - 3):
+        if response_buf[i] == 13 and response_buf[i + 1] == 10 and response_buf[i + 2] == 13:
+            start = i + 4
+            break
+    return status, start, length
+
+
+async def http_request(method, path, body=None):
+    """
+    Send an HTTP request to the server without blocking the event loop.
+
+    ## Parameters:
+        - method (str): The HTTP method.
+        - path (str): The request path.
+        - body (str): Optional JSON body.
 
+    ## Returns:
+        - tuple: The status code and the response body (bytes).
 
-def test_server_connection(ip_address):
+    ## Raises:
+        - Exception: If the connection fails or times out.
+    """
+    request = f"{method} {path} HTTP/1.0\r\nHost: {SERVER_IP}\r\n"
+    if body is not None:
+        request += f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+    request += "\r\n"
+    if body is not None:
+        request += body
+    async with response_lock:
+        status, start, length = await http_exchange(request.encode())
+        return status, bytes(response_mv[start:length])
+
+
+async def send_heartbeat():
+    """
+    Report the reader to the server health endpoint.
+
+    The server keeps readers in memory and answers without a database query, so this is also
+    the server liveness check.
+
+    ## Returns:
+        - int: The HTTP status code.
+
+    ## Raises:
+        - Exception: If the connection fails or times out.
+    """
+    body = json.dumps(
+        {
+            "door_id": DOOR_ID,
+            "firmware": FIRMWARE_VERSION,
+            "uptime": time.time() - boot_time,
+            "mem_free": mem_free(),
+            "mem_low": mem_low,
+        }
+    )
+    status, _ = await http_request("POST", "/health", body)
+    return status
+
+
+async def test_server_connection(ip_address):
     """
     Test the connection to the server and handle connection errors.
 
-    This function tests the connection to the server by sending an HTTP GET request to the server
-    endpoint. It handles connection errors and displays appropriate messages on the OLED screen.
+    This function sends a heartbeat to the server health endpoint and retries until it succeeds.
+    It displays appropriate messages on the OLED screen.
 
     ## Parameters:
-        - ip_address (str): The IP address of the server.
+        - ip_address (str): The IP address of the reader.
 
     ## Global Variables:
         - SERVER_IP (str): The IP address of the server.
         - SERVER_PORT (int): The port number of the server.
     """
+    first_try = True
     while True:
         try:
-            response = requests.get(f"http://{SERVER_IP}:{SERVER_PORT}/")
-            if response.status_code == 200:
-                print("Server connection successful")
-                # display_message(f"Server Connected\nIP: {ip_address}", ip_address)
+            status = await send_heartbeat()
+            if status == 200:
+                if first_try:
+                    print("Server connection successful")
+                else:
+                    print("Reconnected successfully")
+                    display_message(f"Server Reconnected\nIP: {ip_address}", ip_address)
                 return
-            else:
-                print("Server connection failed")
-                display_message(f"Server Fail\nIP: {ip_address}", ip_address)
+            print("Server connection failed")
+            display_message(f"Server Fail\nIP: {ip_address}", ip_address)
+            delay = 1
         except Exception as e:
             print("Server connection error:", e)
             display_message(f"Server Error\n{e}\nIP: {ip_address}", ip_address)
+            delay = 5
+        first_try = False
+        await asyncio.sleep(delay)
 
-        # Reconnection loop
-        while True:
-            try:
-                response = requests.get(f"http://{SERVER_IP}:{SERVER_PORT}/")
-                if response.status_code == 200:
-                    print("Reconnected successfully")
-                    display_message(f"Server Reconnected\nIP: {ip_address}", ip_address)
-                    time.sleep(1)
-                    return
-                display_message(f"Reconnecting...\nIP: {ip_address}", ip_address)
-                time.sleep(1)
-            except Exception as e:
-                display_message(f"Reconnect Error\n{e}\nIP: {ip_address}", ip_address)
-                time.sleep(5)
 
+def load_net_cache():
+    """
+    Read the network settings saved by the last successful connection.
 
-# Connect to WiFi
-def connect_wifi(ssid, password):
+    ## Returns:
+        - dict: The cached settings, or None if there are none.
     """
-    Connect to a WiFi network.
+    try:
+        with open(NET_CACHE_FILE) as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def save_net_cache(wlan, cache):
+    """
+    Save the current IP configuration, BSSID and channel to flash if they changed.
+
+    ## Parameters:
+        - wlan (network.WLAN): The connected interface.
+        - cache (dict): The settings used for this connection, or None.
+    """
+    new = {"ifconfig": list(wlan.ifconfig())}
+    for key in ("bssid", "channel"):
+        try:
+            value = wlan.config(key)
+        except Exception:
+            continue  # Not every port can report it
+        if isinstance(value, bytes):
+            value = binascii.hexlify(value).decode()
+        new[key] = value
+    if new == cache:
+        return
+    try:
+        with open(NET_CACHE_FILE, "w") as f:
+            json.dump(new, f)
+    except Exception as e:
+        print("Network cache error:", e)
 
-    This function connects the device to the specified WiFi network using the provided SSID and password.
-    It waits until the connection is established and then displays a message on the OLED screen indicating
-    successful connection.
+
+def start_wifi(ssid, password):
+    """
+    Start associating with the WiFi network without waiting for it.
+
+    A static configuration (WLAN_IFCONFIG in env.py) or the cached last lease is applied first so
+    DHCP is skipped, and the cached BSSID is used to skip the scan when the port supports it.
 
     ## Parameters:
         - ssid (str): The SSID of the WiFi network.
         - password (str): The password of the WiFi network.
 
-    ## Global Variables:
-        - SERVER_IP (str): The IP address of the server.
-        - SERVER_PORT (int): The port number of the server.
+    ## Returns:
+        - tuple: The WLAN interface and the cached settings used (None if none were).
     """
     wlan = network.WLAN(network.STA_IF)
     wlan.active(True)
-    wlan.connect(ssid, password)
+    cache = load_net_cache()
+    if WLAN_IFCONFIG:
+        wlan.ifconfig(WLAN_IFCONFIG)
+    elif cache:
+        wlan.ifconfig(tuple(cache["ifconfig"]))
+    bssid = cache.get("bssid") if cache else None
+    try:
+        if bssid:
+            wlan.connect(ssid, password, bssid=binascii.unhexlify(bssid))
+        else:
+            wlan.connect(ssid, password)
+    except TypeError:
+        wlan.connect(ssid, password)
+    return wlan, cache
+
+
+# Connect to WiFi
+async def connect_wifi(wlan, ssid, password, cache):
+    """
+    Wait for the WiFi connection started by `start_wifi`.
+
+    If the cached settings do not give a connection within FAST_CONNECT_TIMEOUT seconds, the
+    connection is restarted with DHCP and a normal scan. The settings that worked are cached.
+
+    ## Parameters:
+        - wlan (network.WLAN): The interface returned by `start_wifi`.
+        - ssid (str): The SSID of the WiFi network.
+        - password (str): The password of the WiFi network.
+        - cache (dict): The cached settings used by `start_wifi`, or None.
+
+    ## Returns:
+        - str: The IP address of the reader.
+    """
+    global lease_from_cache
+    start = time.time()
     while not wlan.isconnected():
-        time.sleep(0.5)
-        print("Connecting to WiFi...")
+        await asyncio.sleep(0.1)
+        if cache and time.time() - start > FAST_CONNECT_TIMEOUT:
+            print("Cached network settings failed, using DHCP")
+            wlan.disconnect()
+            if not WLAN_IFCONFIG:
+                wlan.ifconfig("dhcp")
+            wlan.connect(ssid, password)
+            cache = None
+    lease_from_cache = bool(cache) and not WLAN_IFCONFIG
     ip_address = wlan.ifconfig()[0]
     print("Connected to WiFi:", ip_address)
-    display_message("WiFi Connected", ip_address)
-    test_server_connection(ip_address)
-    display_message(f"Server Connected\nIP: {ip_address}", ip_address)
-    time.sleep(1)
+    save_net_cache(wlan, cache)
+    return ip_address
+
+
+async def check_server_first(wlan, ssid, password):
+    """
+    Check the server once connected, renewing a cached lease that does not work.
+
+    A cached lease still associates after it expired or was given to another host, and then
+    the server cannot be reached. So if the first heartbeat on a cached lease fails, the
+    cache is deleted and a new lease is taken with DHCP before the usual server check.
+
+    ## Parameters:
+        - wlan (network.WLAN): The connected interface.
+        - ssid (str): The SSID of the WiFi network.
+        - password (str): The password of the WiFi network.
+    """
+    global ip_address
+    if lease_from_cache:
+        try:
+            reachable = await send_heartbeat() == 200
+        except Exception as e:
+            print("Server check error:", e)
+            reachable = False
+        if not reachable:
+            print("Server unreachable with the cached network settings, using DHCP")
+            try:
+                os.remove(NET_CACHE_FILE)
+            except OSError:
+                pass
+            wlan.disconnect()
+            wlan.ifconfig("dhcp")
+            wlan.connect(ssid, password)
+            ip_address = await connect_wifi(wlan, ssid, password, None)
+            display_message("Scan your tag", ip_address)
+    await test_server_connection(ip_address)
+
+
+def format_access_request(uid, length):
+    """
+    Write the /access request for a UID into `request_buf`.
+
+    The UID is sent as the decimal values of its bytes concatenated, like the server expects.
+
+    ## Parameters:
+        - uid (bytearray): The UID bytes.
+        - length (int): The UID length.
+
+    ## Returns:
+        - int: The request length.
+    """
+    body_length = len(ACCESS_BODY_UID) + len(ACCESS_BODY_DOOR)
+    for i in range(length):
+        body_length += decimal_length(uid[i])
+    pos = put_decimal(request_buf, len(ACCESS_HEAD), body_length)
+    pos = put_bytes(request_buf, pos, b"\r\n\r\n")
+    pos = put_bytes(request_buf, pos, ACCESS_BODY_UID)
+    for i in range(length):
+        pos = put_decimal(request_buf, pos, uid[i])
+    return put_bytes(request_buf, pos, ACCESS_BODY_DOOR)
+
+
+async def send_rfid_udp(uid, length):
+    """
+    Ask the server for an access decision with the compact UDP protocol.
+
+    The request is resent with the same nonce up to UDP_RETRIES times, the server answers a
+    resent request from its cache so the scan is logged once. Replies to older requests are
+    ignored.
+
+    ## Parameters:
+        - uid (bytearray): The UID bytes read from the tag.
+        - length (int): The UID length.
+
+    ## Returns:
+        - dict: The decision, in the same form as the JSON answer of /access.
+
+    ## Raises:
+        - OSError: If the server does not answer.
+    """
+    global udp_nonce, udp_socket, udp_address
+    if udp_socket is None:
+        udp_address = socket.getaddrinfo(SERVER_IP, SERVER_UDP_PORT)[0][-1]
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.setblocking(False)
+    udp_nonce = (udp_nonce + 1) & 0xFFFFFFFF
+    udp_request[3] = length
+    for i in range(4):
+        udp_request[8 + i] = (udp_nonce >> (24 - 8 * i)) & 0xFF
+    for i in range(10):
+        udp_request[12 + i] = uid[i] if i < length else 0
+
+    for _ in range(UDP_RETRIES):
+        udp_socket.sendto(udp_request, udp_address)
+        for _ in range(int(UDP_TIMEOUT / UDP_POLL)):
+            try:
+                reply = udp_socket.recv(UDP_REPLY_SIZE)
+            except OSError:
+                await asyncio.sleep(UDP_POLL)
+                continue
+            if (
+                len(reply) == UDP_REPLY_SIZE
+                and reply[0:3] == udp_request[0:3]
+                and reply[4:8] == udp_request[8:12]
+            ):
+                name = reply[8:].rstrip(b"\x00").decode()
+                return {"access_granted": bool(reply[3] & 0x01), "upn": name}
+    raise OSError("no UDP reply")
 
 
 # Function to send RFID UID to the server
-def send_rfid_to_server(rfid_uid):
+async def send_rfid_to_server(uid, length, queued):
     """
     Send RFID UID to the server for access verification.
 
-    This function constructs a JSON payload containing the RFID UID and the door ID, and sends it to the server
-    for access verification. It expects a JSON response from the server indicating whether access is granted.
+    The request is formatted into the preallocated `request_buf` and the answer is read into
+    `response_buf`; only the small JSON decision is decoded. With ACCESS_PROTOCOL = "udp" in
+    env.py the compact protocol is used instead (`send_rfid_udp`). A scan that became older
+    than SCAN_MAX_AGE while waiting for the reply buffer is not sent.
 
     ## Parameters:
-        - rfid_uid (str): The RFID UID to be sent to the server.
+        - uid (bytearray): The UID bytes read from the tag.
+        - length (int): The UID length.
+        - queued (int): The ticks_ms() of the scan.
 
     ## Returns:
-        - dict: A dictionary containing the response from the server, indicating whether access is granted.
+        - dict: A dictionary containing the response from the server, indicating whether access is granted,
+          or None if the scan expired.
     """
     try:
-        url = f"http://{SERVER_IP}:{SERVER_PORT}/access"
-        headers = {"Content-Type": "application/json"}
-        data = {"rfid_uid": rfid_uid, "door_id": DOOR_ID}
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        #  print(response.json())
-        return response.json()
+        if ACCESS_PROTOCOL == "udp":
+            return await send_rfid_udp(uid, length)
+        async with response_lock:
+            if ticks_since(queued) > SCAN_MAX_AGE * 1000:
+                return None
+            size = format_access_request(uid, length)
+            _, start, end = await http_exchange(request_mv[:size])
+            return json.loads(bytes(response_mv[start:end]))
     except Exception as e:
-        test_server_connection(ip_address=network.WLAN(network.STA_IF).ifconfig()[0])
+        print("Access request error:", e)
+        await test_server_connection(ip_address)
         return {"access_granted": False}
 
 
-# Main loop to scan RFID tags
-def main():
+def same_uid(a, b, length):
+    for i in range(length):
+        if a[i] != b[i]:
+            return False
+    return True
+
+
+def queue_scan(uid, length):
+    """
+    Copy a UID into the ring of pending scans with its time, dropping the oldest one when it
+    is full.
+
+    ## Parameters:
+        - uid (bytearray): The UID bytes.
+        - length (int): The UID length.
+    """
+    global scan_head, scan_count, first_scan
+    if first_scan:
+        first_scan = False
+        boot_phase("first scan")
+    if scan_count == MAX_PENDING_SCANS:
+        scan_head = (scan_head + 1) % MAX_PENDING_SCANS
+        scan_count -= 1
+    slot = (scan_head + scan_count) % MAX_PENDING_SCANS
+    scan_uids[slot][:length] = uid[:length]
+    scan_lens[slot] = length
+    scan_ticks[slot] = ticks_ms()
+    scan_count += 1
+    scan_event.set()
+
+
+async def poll_tags():
+    """
+    Watch the RFID reader and queue every new tag for `network_task`.
+
+    Each poll only sends a REQA (`arm_card_detect`) and checks whether a card answered, the full
+    request/anticollision/select sequence runs only when one did. The delay between polls doubles
+    up to POLL_INTERVAL_IDLE while the field is empty; with an IRQ pin the task wakes as soon as
+    a card answers the REQA of the current poll instead of reading the chip.
+
+    The loop never waits on the network or the display, so a second person can badge while the
+    previous request is still in flight. A tag left in the field is only queued again after
+    REPEAT_DELAY seconds. UIDs are read and compared in preallocated buffers.
+    """
+    last_len = 0
+    last_time = 0
+    interval = POLL_INTERVAL
+    card_flag = None
+    if reader.irq is not None and hasattr(asyncio, "ThreadSafeFlag"):
+        card_flag = asyncio.ThreadSafeFlag()
+        reader.irq_callback = card_flag.set
+    reader.arm_card_detect()
+    while True:
+        if card_flag is not None:
+            try:
+                await asyncio.wait_for(card_flag.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            await asyncio.sleep(interval)
+
+        if not reader.card_present():
+            interval = min(interval * 2, POLL_INTERVAL_IDLE)
+            reader.arm_card_detect()
+            continue
+        interval = POLL_INTERVAL
+
+        (status, tag_type) = reader.request(reader.REQIDL)
+        if status == reader.OK:
+            length = reader.read_uid(tag_uid)
+            if length:
+                now = time.time()
+                if (
+                    length != last_len
+                    or not same_uid(tag_uid, last_uid, length)
+                    or now - last_time >= REPEAT_DELAY
+                ):
+                    last_uid[:length] = tag_uid[:length]
+                    last_len = length
+                    queue_scan(tag_uid, length)
+                    reset_inactivity_timer()
+                last_time = now
+        reader.arm_card_detect()
+
+
+async def network_task():
+    """
+    Send queued tags to the server and show the decision.
+
+    Scans older than SCAN_MAX_AGE, queued while the network or the server was down, are
+    dropped: a late grant would open the door for someone who has already left. The UID is
+    copied out of the ring before the request, `queue_scan` may reuse its slot meanwhile.
+    """
+    global checking, scan_head, scan_count
+    await network_ready.wait()
+    while True:
+        await scan_event.wait()
+        scan_event.clear()
+        while scan_count:
+            slot = scan_head
+            length = scan_lens[slot]
+            queued = scan_ticks[slot]
+            uid = scan_uids[slot]
+            for i in range(length):
+                send_uid[i] = uid[i]
+            scan_head = (scan_head + 1) % MAX_PENDING_SCANS
+            scan_count -= 1
+            if ticks_since(queued) > SCAN_MAX_AGE * 1000:
+                print("Dropped stale scan")
+                continue
+            checking = True
+            display_message("Checking...", ip_address)
+            mem_free()
+
+            response = await send_rfid_to_server(send_uid, length, queued)
+            checking = False
+
+            if response is None:
+                print("Dropped stale scan")
+                display_message("Scan your tag", ip_address)
+            elif response.get("access_granted"):
+                user_upn = response.get("upn")
+                print("Access Granted:", user_upn)
+                display_message(f"Access Granted\n{user_upn}", ip_address)
+                signal_access(True)
+            else:
+                print("Access Denied")
+                display_message("Access Denied", ip_address)
+                signal_access(False)
+
+
+async def heartbeat_task():
+    """
+    Collect garbage while idle and send a heartbeat every HEARTBEAT_INTERVAL seconds.
+
+    The heartbeat carries the uptime, the free heap and its low-water mark, which show heap
+    fragmentation building up over months.
     """
-    Main loop to scan RFID tags and handle access control.
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if not checking and not scan_count:
+            gc.collect()
+        free = mem_free()
+        print("heartbeat: uptime", time.time() - boot_time, "mem_free", free, "mem_low", mem_low)
+        if not network_ready.is_set():
+            continue
+        try:
+            await send_heartbeat()
+        except Exception as e:
+            print("Heartbeat error:", e)
+
 
-    This function initializes the OLED display, connects to WiFi, and starts a loop to scan RFID tags.
-    It handles user authentication by sending the RFID UID to the server and displaying access status on the OLED.
+async def led_self_test():
+    for led in (greenled, redled):
+        led.on()
+        await asyncio.sleep(0.5)
+        led.off()
 
-    The function also sets up an inactivity timer to activate a screensaver after 1 minute of inactivity.
 
+# Main entry point
+async def main():
     """
+    Start the reader tasks.
+
+    WiFi association is started first and the display and tag polling are brought up while it
+    runs, so tags can be read before the network is ready; they are sent once it is, unless they
+    are older than SCAN_MAX_AGE by then (see `network_task`). The server check runs in the
+    background instead of delaying the first scan. Each boot phase is logged with its time since
+    power-up.
+    """
+    global ip_address
+    wlan, cache = start_wifi(WLAN_SSID, WLAN_PASS)
+    boot_phase("wifi started")
+
     # Retry mechanism for OLED initialization
     for _ in range(3):
         try:
@@ -318,43 +1023,25 @@ def main():
             break
         except Exception as e:
             print("OLED init error:", e)
-            time.sleep(1)
+            await asyncio.sleep(1)
+    boot_phase("oled")
 
-    connect_wifi(WLAN_SSID, WLAN_PASS)
-    ip_address = network.WLAN(network.STA_IF).ifconfig()[0]
-    display_message("Scan your tag", ip_address)
-    inactivity_timer.init(period=1000, mode=Timer.PERIODIC, callback=handle_inactivity)
+    asyncio.create_task(display_task())
+    asyncio.create_task(led_self_test())
+    asyncio.create_task(network_task())
+    asyncio.create_task(poll_tags())
+    boot_phase("polling")
 
-    while True:
-        (status, tag_type) = reader.request(reader.REQIDL)
-        if status == reader.OK:
-            (status, uid) = reader.SelectTagSN()
-            if status == reader.OK:
-                reset_inactivity_timer()
-
-                rfid_uid_decimal = "".join([str(i) for i in uid])
-                print("RFID UID:", rfid_uid_decimal)
-                display_message("Checking...", ip_address)
-
-                response = send_rfid_to_server(rfid_uid_decimal)
-
-                if response.get("access_granted"):
-                    user_upn = response.get("upn")
-                    print("Access Granted:", user_upn)
-                    display_message(f"Access Granted\n{user_upn}", ip_address)
-                    # Turn on the LED to indicate door open
-                    greenled.on()
-                    # Add code here to open the door (e.g., trigger a relay)
-                else:
-                    print("Access Denied")
-                    display_message("Access Denied", ip_address)
-                    redled.on()
+    ip_address = await connect_wifi(wlan, WLAN_SSID, WLAN_PASS, cache)
+    boot_phase("wifi connected")
+    display_message("Scan your tag", ip_address)
+    network_ready.set()
 
-                time.sleep(2)  # Delay to avoid rapid repeated reads
-                greenled.off()
-                redled.off()  # Turn off the LED
-                display_message("Scan your tag", ip_address)
+    asyncio.create_task(check_server_first(wlan, WLAN_SSID, WLAN_PASS))
+    asyncio.create_task(build_screensaver_circles())
+    asyncio.create_task(led_task())
+    await heartbeat_task()
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
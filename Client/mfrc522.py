@@ -17,7 +17,11 @@ class MFRC522:
     PICC_ANTICOLL2 = 0x95
     PICC_ANTICOLL3 = 0x97
 
-    def __init__(self, sck, mosi, miso, rst, cs, baudrate=1000000, spi_id=0):
+    # Default SPI clock per board, the RC522 itself accepts up to 10 MHz
+    BAUDRATES = {"esp8266": 100000, "esp32": 100000}
+    DEFAULT_BAUDRATE = 1000000
+
+    def __init__(self, sck, mosi, miso, rst, cs, baudrate=None, spi_id=0, irq=None):
         self.sck = Pin(sck, Pin.OUT)
         self.mosi = Pin(mosi, Pin.OUT)
         self.miso = Pin(miso)
@@ -28,15 +32,17 @@ class MFRC522:
         self.cs.value(1)
 
         board = uname()[0]
+        if baudrate is None:
+            baudrate = self.BAUDRATES.get(board, self.DEFAULT_BAUDRATE)
 
         if board == "WiPy" or board == "LoPy" or board == "FiPy":
             self.spi = SPI(0)
             self.spi.init(
-                SPI.MASTER, baudrate=1000000, pins=(self.sck, self.mosi, self.miso)
+                SPI.MASTER, baudrate=baudrate, pins=(self.sck, self.mosi, self.miso)
             )
         elif (board == "esp8266") or (board == "esp32"):
             self.spi = SPI(
-                baudrate=100000,
+                baudrate=baudrate,
                 polarity=0,
                 phase=0,
                 sck=self.sck,
@@ -51,22 +57,73 @@ class MFRC522:
         else:
             raise RuntimeError("Unsupported platform")
 
+        # Preallocated SPI buffers: one register access, or a whole FIFO burst
+        # (64 bytes + address), per chip select frame
+        self._reg_out = bytearray(2)
+        self._reg_in = bytearray(2)
+        self._fifo_out = bytearray(65)
+        self._fifo_in = bytearray(65)
+        self._fifo_out_mv = memoryview(self._fifo_out)
+        self._fifo_in_mv = memoryview(self._fifo_in)
+        self._bit_framing = 0
+        self._select_buf = bytearray(9)
+
+        # Card detection interrupt (optional, see arm_card_detect)
+        self.card_flag = False
+        self.irq_callback = None
+        self.irq = None
+        if irq is not None:
+            self.irq = Pin(irq, Pin.IN, Pin.PULL_UP)
+            self.irq.irq(trigger=Pin.IRQ_FALLING, handler=self._irq_handler)
+
         self.rst.value(1)
         self.init()
 
     def _wreg(self, reg, val):
+        buf = self._reg_out
+        buf[0] = (reg << 1) & 0x7E
+        buf[1] = val & 0xFF
         self.cs.value(0)
-        self.spi.write(b"%c" % int(0xFF & ((reg << 1) & 0x7E)))
-        self.spi.write(b"%c" % int(0xFF & val))
+        self.spi.write(buf)
         self.cs.value(1)
 
     def _rreg(self, reg):
+        buf = self._reg_out
+        buf[0] = ((reg << 1) & 0x7E) | 0x80
+        buf[1] = 0
+        self.cs.value(0)
+        self.spi.write_readinto(buf, self._reg_in)
+        self.cs.value(1)
+
+        return self._reg_in[1]
+
+    def _wfifo(self, data, n=None):
+        # Write all bytes to FIFODataReg in a single chip select frame
+        if n is None:
+            n = len(data)
+        out = self._fifo_out
+        out[0] = 0x09 << 1
+        for i in range(n):
+            out[i + 1] = data[i]
         self.cs.value(0)
-        self.spi.write(b"%c" % int(0xFF & (((reg << 1) & 0x7E) | 0x80)))
-        val = self.spi.read(1)
+        self.spi.write(self._fifo_out_mv[: n + 1])
         self.cs.value(1)
 
-        return val[0]
+    def _rfifo_into(self, n):
+        # Read n bytes from FIFODataReg in a single chip select frame: the address
+        # is repeated for every byte and the data comes back one byte later, so the
+        # bytes end up in self._fifo_in[1 : n + 1]
+        out = self._fifo_out
+        for i in range(n):
+            out[i] = (0x09 << 1) | 0x80
+        out[n] = 0
+        self.cs.value(0)
+        self.spi.write_readinto(self._fifo_out_mv[: n + 1], self._fifo_in_mv[: n + 1])
+        self.cs.value(1)
+
+    def _set_bit_framing(self, val):
+        self._bit_framing = val
+        self._wreg(0x0D, val)
 
     def _sflags(self, reg, mask):
         self._wreg(reg, self._rreg(reg) | mask)
@@ -75,8 +132,14 @@ class MFRC522:
         self._wreg(reg, self._rreg(reg) & (~mask))
 
     def _tocard(self, cmd, send):
-        recv = []
-        bits = irq_en = wait_irq = n = 0
+        (stat, count, bits) = self._tocard_into(cmd, send, len(send))
+        recv = list(self._fifo_in_mv[1 : count + 1]) if count else []
+        return stat, recv, bits
+
+    def _tocard_into(self, cmd, send, length):
+        # Run a command on the first `length` bytes of `send`; the answer is left
+        # in self._fifo_in[1 : count + 1] and (stat, count, bits) is returned
+        count = bits = irq_en = wait_irq = n = 0
         stat = self.ERR
 
         if cmd == 0x0E:
@@ -86,26 +149,29 @@ class MFRC522:
             irq_en = 0x77
             wait_irq = 0x30
 
-        self._wreg(0x02, irq_en | 0x80)
-        self._cflags(0x04, 0x80)
-        self._sflags(0x0A, 0x80)
+        # The flag registers are written directly instead of read-modify-write:
+        # the bits being set or cleared are the only writable ones. ComIRqReg is
+        # polled below, so no source drives the IRQ pin while the command runs;
+        # arm_card_detect enables it again
+        self._wreg(0x02, 0x80)
+        self._wreg(0x04, 0x7F)  # Clear all interrupt request bits
+        self._wreg(0x0A, 0x80)  # Flush FIFO
         self._wreg(0x01, 0x00)
 
-        for c in send:
-            self._wreg(0x09, c)
+        self._wfifo(send, length)
         self._wreg(0x01, cmd)
 
         if cmd == 0x0C:
-            self._sflags(0x0D, 0x80)
+            self._wreg(0x0D, self._bit_framing | 0x80)  # StartSend
 
         i = 2000
         while True:
             n = self._rreg(0x04)
             i -= 1
-            if ~((i != 0) and ~(n & 0x01) and ~(n & wait_irq)):
+            if i == 0 or n & 0x01 or n & wait_irq:
                 break
 
-        self._cflags(0x0D, 0x80)
+        self._wreg(0x0D, self._bit_framing)
 
         if i:
             if (self._rreg(0x06) & 0x1B) == 0x00:
@@ -126,19 +192,23 @@ class MFRC522:
                     elif n > 16:
                         n = 16
 
-                    for _ in range(n):
-                        recv.append(self._rreg(0x09))
+                    self._rfifo_into(n)
+                    count = n
             else:
                 stat = self.ERR
 
-        return stat, recv, bits
+        return stat, count, bits
 
     def _crc(self, data):
-        self._cflags(0x05, 0x04)
-        self._sflags(0x0A, 0x80)
+        self._calc_crc(data, len(data))
+        return [self._rreg(0x22), self._rreg(0x21)]
 
-        for c in data:
-            self._wreg(0x09, c)
+    def _calc_crc(self, data, length):
+        # The result is left in CRCResultReg (0x22 low byte, 0x21 high byte)
+        self._wreg(0x05, 0x04)  # Clear CRCIRq
+        self._wreg(0x0A, 0x80)  # Flush FIFO
+
+        self._wfifo(data, length)
 
         self._wreg(0x01, 0x03)
 
@@ -149,8 +219,6 @@ class MFRC522:
             if not ((i != 0) and not (n & 0x04)):
                 break
 
-        return [self._rreg(0x22), self._rreg(0x21)]
-
     def init(self):
         self.reset()
         self._wreg(0x2A, 0x8D)
@@ -159,8 +227,55 @@ class MFRC522:
         self._wreg(0x2C, 0)
         self._wreg(0x15, 0x40)
         self._wreg(0x11, 0x3D)
+        if self.irq is not None:
+            self._wreg(0x03, 0x80)  # DivIEnReg: IRQ pin is push-pull
         self.antenna_on()
 
+    def _irq_handler(self, pin):
+        self.card_flag = True
+        if self.irq_callback:
+            self.irq_callback()
+
+    def arm_card_detect(self):
+        """Send one REQA and return without waiting for the answer.
+
+        Only the receive interrupt is enabled, so if a card answers the chip pulls the IRQ
+        pin low (and sets RxIRq); with no card nothing happens. A card present in the field
+        is then reported by `card_present`, and `request` / `SelectTagSN` are used as usual.
+        This replaces a full `request` on every poll with a few register writes.
+
+        The RC522 cannot see a card without sending a REQA, so this is still one poll: the
+        IRQ only reports the answer to this REQA and saves reading ComIrqReg. Commands run
+        with the IRQ sources disabled, call this again after them to re-arm it.
+        """
+        self.card_flag = False
+        self._wreg(0x01, 0x00)  # Idle, stops any running command
+        self._wreg(0x02, 0xA0)  # ComIEnReg: IRQ inverted (active low), RxIEn only
+        self._wreg(0x04, 0x7F)  # Clear all interrupt request bits
+        self._wreg(0x0A, 0x80)  # Flush FIFO
+        self._wreg(0x09, self.REQIDL)
+        self._wreg(0x01, 0x0C)  # Transceive
+        self._wreg(0x0D, 0x87)  # StartSend, 7 bit short frame
+        self._bit_framing = 0x07
+
+    def card_present(self):
+        """Tell whether a card answered the last `arm_card_detect`.
+
+        With an IRQ pin this only reads a flag set by the interrupt handler; otherwise it
+        reads ComIrqReg once. The chip is put back to idle when a card is found.
+
+        ## Returns:
+            - bool: True if a card answered.
+        """
+        if self.irq is not None:
+            found = self.card_flag
+        else:
+            found = bool(self._rreg(0x04) & 0x20)  # RxIRq
+        if found:
+            self.card_flag = False
+            self._wreg(0x01, 0x00)
+        return found
+
     def reset(self):
         self._wreg(0x01, 0x0F)
 
@@ -171,7 +286,7 @@ class MFRC522:
             self._cflags(0x14, 0x03)
 
     def request(self, mode):
-        self._wreg(0x0D, 0x07)
+        self._set_bit_framing(0x07)
         (stat, recv, bits) = self._tocard(0x0C, [mode])
 
         if (stat != self.OK) | (bits != 0x10):
@@ -183,7 +298,7 @@ class MFRC522:
         ser_chk = 0
         ser = [anticolN, 0x20]
 
-        self._wreg(0x0D, 0x00)
+        self._set_bit_framing(0x00)
         (stat, recv, bits) = self._tocard(0x0C, ser)
 
         if stat == self.OK:
@@ -291,6 +406,51 @@ class MFRC522:
         return (self.OK, valid_uid[: len(valid_uid) - 1])
         # return (self.OK , valid_uid)
 
+    def read_uid(self, uid):
+        """Run the anticollision/select cascade without allocating.
+
+        Same result as `SelectTagSN`, but the UID bytes are written into the caller's
+        buffer and all SPI traffic goes through the driver's preallocated buffers.
+
+        ## Parameters:
+            - uid (bytearray): Buffer of at least 10 bytes receiving the UID.
+
+        ## Returns:
+            - int: The UID length, 0 if no tag could be selected.
+        """
+        cmd = self._select_buf
+        data = self._fifo_in
+        length = 0
+        for level in (self.PICC_ANTICOLL1, self.PICC_ANTICOLL2, self.PICC_ANTICOLL3):
+            self._set_bit_framing(0x00)
+            cmd[0] = level
+            cmd[1] = 0x20
+            (stat, count, bits) = self._tocard_into(0x0C, cmd, 2)
+            if stat != self.OK or count != 5:
+                return 0
+            if data[1] ^ data[2] ^ data[3] ^ data[4] != data[5]:
+                return 0
+
+            cmd[1] = 0x70
+            for i in range(5):
+                cmd[2 + i] = data[1 + i]
+            self._calc_crc(cmd, 7)
+            cmd[7] = self._rreg(0x22)
+            cmd[8] = self._rreg(0x21)
+            (stat, count, bits) = self._tocard_into(0x0C, cmd, 9)
+            if stat != self.OK or bits != 0x18:
+                return 0
+
+            if cmd[2] != 0x88:
+                for i in range(4):
+                    uid[length + i] = cmd[2 + i]
+                return length + 4
+            # cascade tag, 3 more UID bytes at the next level
+            for i in range(3):
+                uid[length + i] = cmd[3 + i]
+            length += 3
+        return 0
+
     def auth(self, mode, addr, sect, ser):
         return self._tocard(0x0E, [mode, addr] + sect + ser[:4])[0]
 
@@ -34,6 +34,10 @@ class SSD1306(framebuf.FrameBuffer):
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        self.buffer_mv = memoryview(self.buffer)
+        # dirty column range per page, x0 > x1 means the page is clean
+        self.dirty_x0 = bytearray(b"\xff" * self.pages)
+        self.dirty_x1 = bytearray(self.pages)
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
@@ -93,21 +97,112 @@ class SSD1306(framebuf.FrameBuffer):
         self.write_cmd(SET_COM_OUT_DIR | ((rotate & 1) << 3))
         self.write_cmd(SET_SEG_REMAP | (rotate & 1))
 
+    def mark_dirty(self, x, y, w, h):
+        """Mark the pages and columns covered by a rectangle as needing a refresh."""
+        x0 = max(x, 0)
+        x1 = min(x + w, self.width) - 1
+        y0 = max(y, 0)
+        y1 = min(y + h, self.height) - 1
+        if x0 > x1 or y0 > y1:
+            return
+        for page in range(y0 >> 3, (y1 >> 3) + 1):
+            if self.dirty_x0[page] > self.dirty_x1[page]:
+                self.dirty_x0[page] = x0
+                self.dirty_x1[page] = x1
+            else:
+                if x0 < self.dirty_x0[page]:
+                    self.dirty_x0[page] = x0
+                if x1 > self.dirty_x1[page]:
+                    self.dirty_x1[page] = x1
+
+    def mark_all_dirty(self):
+        self.mark_dirty(0, 0, self.width, self.height)
+
+    # Drawing primitives, wrapped to record the area they touch
+
+    def fill(self, c):
+        super().fill(c)
+        self.mark_all_dirty()
+
+    def pixel(self, x, y, *c):
+        if not c:
+            return super().pixel(x, y)
+        super().pixel(x, y, c[0])
+        self.mark_dirty(x, y, 1, 1)
+
+    def hline(self, x, y, w, c):
+        super().hline(x, y, w, c)
+        self.mark_dirty(x, y, w, 1)
+
+    def vline(self, x, y, h, c):
+        super().vline(x, y, h, c)
+        self.mark_dirty(x, y, 1, h)
+
+    def line(self, x1, y1, x2, y2, c):
+        super().line(x1, y1, x2, y2, c)
+        self.mark_dirty(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1)
+
+    def rect(self, x, y, w, h, c, *f):
+        super().rect(x, y, w, h, c, *f)
+        self.mark_dirty(x, y, w, h)
+
+    def fill_rect(self, x, y, w, h, c):
+        super().fill_rect(x, y, w, h, c)
+        self.mark_dirty(x, y, w, h)
+
+    def ellipse(self, x, y, xr, yr, c, *args):
+        super().ellipse(x, y, xr, yr, c, *args)
+        self.mark_dirty(x - xr, y - yr, 2 * xr + 1, 2 * yr + 1)
+
+    def text(self, s, x, y, c=1):
+        super().text(s, x, y, c)
+        self.mark_dirty(x, y, 8 * len(s), 8)
+
+    def blit(self, fbuf, x, y, *args):
+        # the source size is not exposed by FrameBuffer, assume it covers the screen
+        super().blit(fbuf, x, y, *args)
+        self.mark_all_dirty()
+
+    def scroll(self, xstep, ystep):
+        super().scroll(xstep, ystep)
+        self.mark_all_dirty()
+
     def show(self):
-        x0 = 0
-        x1 = self.width - 1
-        if self.width != 128:
-            # narrow displays use centred columns
-            col_offset = (128 - self.width) // 2
-            x0 += col_offset
-            x1 += col_offset
-        self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
-        self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        """Send the pages changed since the last call.
+
+        Consecutive dirty pages are sent in one column/page window, each page as a
+        memoryview slice of the framebuffer so nothing is copied.
+        """
+        col_offset = (128 - self.width) // 2 if self.width != 128 else 0
+        page = 0
+        while page < self.pages:
+            if self.dirty_x0[page] > self.dirty_x1[page]:
+                page += 1
+                continue
+            # extend the run over the following dirty pages
+            first = page
+            x0 = self.dirty_x0[page]
+            x1 = self.dirty_x1[page]
+            while page + 1 < self.pages and self.dirty_x0[page + 1] <= self.dirty_x1[page + 1]:
+                page += 1
+                x0 = min(x0, self.dirty_x0[page])
+                x1 = max(x1, self.dirty_x1[page])
+            self.write_cmd(SET_COL_ADDR)
+            self.write_cmd(x0 + col_offset)
+            self.write_cmd(x1 + col_offset)
+            self.write_cmd(SET_PAGE_ADDR)
+            self.write_cmd(first)
+            self.write_cmd(page)
+            if x0 == 0 and x1 == self.width - 1:
+                self.write_data(self.buffer_mv[first * self.width : (page + 1) * self.width])
+            else:
+                for p in range(first, page + 1):
+                    start = p * self.width
+                    self.write_data(self.buffer_mv[start + x0 : start + x1 + 1])
+            for p in range(first, page + 1):
+                self.dirty_x0[p] = 0xFF
+                self.dirty_x1[p] = 0
+            page += 1
 
 
 class SSD1306_I2C(SSD1306):
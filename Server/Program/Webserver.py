@@ -1,45 +1,166 @@
 import io
+import json
+import logging
+from datetime import date, timedelta
 from threading import Thread
 
+import serverLog
+from accessDecision import decide_access
+from accessEvents import latest_events, stream, subscribe
+from aclSnapshot import publish_snapshot
+from admission import admission_stats
 from database import (
     add_door_to_database,
-    check_access,
     delete_group_from_database,
+    delete_schedule,
     get_doors,
     get_existing_groups,
-    get_latest_logs,
     get_logs,
-    get_users,
-    log_access_attempt,
+    get_schedules,
+    save_schedule,
+    search_users,
+    set_door_schedule,
 )
+from doorSchedules import compile_schedule, load_door_schedules
 from env import DBFILE, WebServerPORT
 from flask import (
     Flask,
     Response,
     jsonify,
+    make_response,
     redirect,
     render_template,
     request,
+    send_from_directory,
+    stream_with_context,
 )
 from ldapSync import sync_ldap_to_database
+from logExport import FORMATS, export_available, stream_logs
+from pageCache import cached_fragment, data_version
+from profiling import (
+    PROFILE_DIR,
+    ProfileSAMPLE,
+    SlowRequestMS,
+    install_profiling,
+    profiling_enabled,
+    slow_requests,
+)
+from readers import get_readers, record_heartbeat, registry_version
+
+log = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 
+def conditional_page(etag, render):
+    """Answer 304 Not Modified when the client already has this version of the page.
+
+    ## Parameters:
+    - etag (str): The version of the page.
+    - render (callable): Renders the page, only called when the client is out of date.
+
+    ## Returns:
+    - flask.Response: The page or an empty 304 response, with its ETag.
+    """
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def configured_doors():
+    """Return the ids of the doors in the database, as strings, cached until Doors changes."""
+    return cached_fragment(
+        ("door_ids", data_version("doors")), lambda: frozenset(str(door[0]) for door in get_doors())
+    )
+
+
 # Route to the home
 @app.route("/")
 def index():
-    existing_groups = get_existing_groups(DBFILE)  # Update with your database file path
-    logs = get_latest_logs(DBFILE, 5)
-    # print(logs[0])
-    return render_template("./index.html", existing_groups=existing_groups, logs=logs)
+    # Only the reader table changes without a database write, it is built from memory. The
+    # ETag follows the readers' status (online, reboots, firmware, address), not every
+    # heartbeat, so the uptime, memory and last seen figures are refreshed with the next change
+    readers = get_readers(configured_doors())
+    online = "".join("1" if reader["online"] else "0" for reader in readers)
+    etag = f"{data_version('logs', 'groups', 'doors')}-{registry_version()}-{online}"
+
+    def render():
+        logs_table = cached_fragment(
+            ("latest_logs", data_version("logs")),
+            lambda: render_template("latest_logs.html", logs=latest_events(5)),
+        )
+        existing_groups = cached_fragment(
+            ("existing_groups", data_version("groups")), lambda: get_existing_groups(DBFILE)
+        )
+        return render_template(
+            "./index.html", existing_groups=existing_groups, logs_table=logs_table, readers=readers
+        )
+
+    return conditional_page(etag, render)
+
+
+USERS_PER_PAGE = 50
+MAX_USERS_PER_PAGE = 500
+
+
+def user_search_args():
+    """Read the search and paging arguments shared by /UserDB and /api/users.
+
+    ## Returns:
+    - tuple: The query, the field, the page and the page size.
+    """
+    query = request.args.get("q", "").strip()
+    field = request.args.get("field", "all")
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = request.args.get("per_page", USERS_PER_PAGE, type=int)
+    per_page = min(max(per_page, 1), MAX_USERS_PER_PAGE)
+    return query, field, page, per_page
 
 
 # Route to display the fuser db
 @app.route("/UserDB")
 def usersdb():
-    users = get_users()
-    return render_template("userdb.html", users=users)
+    args = user_search_args()
+    version = data_version("users")
+
+    def render():
+        query, field, page, per_page = args
+        users, total = search_users(query, field, page, per_page)
+        return render_template(
+            "userdb.html",
+            users=users,
+            total=total,
+            query=query,
+            field=field,
+            page=page,
+            per_page=per_page,
+            pages=max((total + per_page - 1) // per_page, 1),
+        )
+
+    # The ETag is per URL, so the search arguments only need to be part of the cache key
+    return conditional_page(version, lambda: cached_fragment(("userdb", version, args), render))
+
+
+# JSON version of the user directory for helpdesk tools
+@app.route("/api/users")
+def api_users():
+    query, field, page, per_page = user_search_args()
+    users, total = search_users(query, field, page, per_page)
+    return jsonify(
+        {
+            "users": [
+                {"upn": upn, "rfid_uid": rfid_uid, "member_of": member_of}
+                for upn, rfid_uid, member_of in users
+            ],
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+        }
+    )
 
 
 # Route to display the fuser db
@@ -55,10 +176,10 @@ def export_logs():
 
     # Create a file-like string to write logs
     log_output = io.StringIO()
-    log_line = "TimeStamp,User,Tag UID,Door ID,Granted,\n"
+    log_line = "TimeStamp,User,Tag UID,Door ID,Granted,Repeats,Last Seen,\n"
     log_output.write(log_line)
     for log in logs:
-        log_line = f"{log[0]},{log[1]},{log[2]},{log[4]},{'Yes' if log[3] else 'No'},\n"
+        log_line = f"{log[0]},{log[1]},{log[2]},{log[4]},{'Yes' if log[3] else 'No'},{log[5]},{log[6] or ''},\n"
         log_output.write(log_line)
 
     # Set the position to the beginning of the stream
@@ -72,16 +193,48 @@ def export_logs():
     )
 
 
+# Route to export the logs as Parquet or Arrow IPC, streamed batch by batch
+@app.route("/export_logs/<fmt>")
+def export_logs_columnar(fmt):
+    if fmt not in FORMATS:
+        return jsonify({"error": f"Unknown format, expected one of {sorted(FORMATS)}"}), 404
+    if not export_available():
+        return jsonify({"error": "pyarrow is not installed on the server"}), 501
+
+    until = request.args.get("until", type=date.fromisoformat)
+    mimetype, extension = FORMATS[fmt]
+    return Response(
+        stream_logs(
+            fmt,
+            db_file=DBFILE,
+            since=request.args.get("since", type=date.fromisoformat),
+            until=until + timedelta(days=1) if until else None,
+            door_id=request.args.get("door", type=int),
+        ),
+        mimetype=mimetype,
+        headers={"Content-disposition": f"attachment; filename=logs.{extension}"},
+    )
+
+
 @app.route("/GroupsDB")
 def groupsdb():
-    doors = get_doors()
-    groups = get_existing_groups(DBFILE)
-    return render_template("groupsdb.html", doors=doors, groups=groups)
+    version = data_version("doors", "groups")
+    return conditional_page(
+        version,
+        lambda: cached_fragment(
+            ("groupsdb", version),
+            lambda: render_template(
+                "groupsdb.html", doors=get_doors(), groups=get_existing_groups(DBFILE)
+            ),
+        ),
+    )
 
 
 @app.route("/delete_group/<group_cn>", methods=["POST"])
 def delete_group(group_cn):
     delete_group_from_database(group_cn)
+    publish_snapshot(DBFILE)
+    load_door_schedules(DBFILE)
     return render_template("./index.html")
 
 
@@ -93,10 +246,56 @@ def add_door():
 
     # Update with your database file path
     if add_door_to_database(DBFILE, group_cn, Door_id):
+        publish_snapshot(DBFILE)
         return redirect("/")
     return "Failed to add door to the database."
 
 
+# Route to display and edit the door schedules
+@app.route("/Schedules")
+def schedules(error=None, form=None):
+    return render_template(
+        "schedules.html",
+        schedules=get_schedules(DBFILE),
+        doors=get_doors(),
+        error=error,
+        form=form or {},
+    )
+
+
+@app.route("/Schedules/save", methods=["POST"])
+def save_door_schedule():
+    name = request.form["name"].strip()
+    rules = request.form.get("rules", "")
+    exceptions = request.form.get("exceptions", "")
+    try:
+        if not name:
+            raise ValueError("A schedule needs a name")
+        compiled = compile_schedule(rules, exceptions)
+    except ValueError as e:
+        return schedules(error=str(e), form=request.form), 400
+
+    if not save_schedule(DBFILE, name, rules, exceptions, json.dumps(compiled)):
+        return "Failed to save the schedule."
+    load_door_schedules(DBFILE)
+    return redirect("/Schedules")
+
+
+@app.route("/Schedules/delete/<name>", methods=["POST"])
+def delete_door_schedule(name):
+    delete_schedule(DBFILE, name)
+    load_door_schedules(DBFILE)
+    return redirect("/Schedules")
+
+
+@app.route("/Schedules/door", methods=["POST"])
+def assign_door_schedule():
+    if not set_door_schedule(DBFILE, request.form["door_id"], request.form.get("schedule") or None):
+        return "Failed to set the door schedule."
+    load_door_schedules(DBFILE)
+    return redirect("/Schedules")
+
+
 # Route to handle sync button click
 @app.route("/sync")
 def sync():
@@ -114,15 +313,77 @@ def door_access():
     if rfid_uid is None or door_id is None:
         return jsonify({"error": "RFID UID and door ID are required"}), 400
 
-    access_granted, upn = check_access(rfid_uid, door_id)
+    access_granted, upn, rejected = decide_access(rfid_uid, door_id)
+    if rejected:
+        response = jsonify({"access_granted": False, "error": f"Too many requests ({rejected})"})
+        return response, 429, {"Retry-After": "1"}
+
     if access_granted:
-        log_access_attempt(DBFILE, upn, rfid_uid, True, door_id)
         return jsonify({"access_granted": True, "upn": upn}), 200
-
-    log_access_attempt(DBFILE, upn, rfid_uid, False, door_id)
     return jsonify({"access_granted": False}), 403
 
 
+# Route to display the admission control counters
+@app.route("/admission")
+def admission():
+    return jsonify(admission_stats())
+
+
+# Route to display the recent slow requests and their profiles
+@app.route("/Profiles")
+def profiles():
+    return render_template(
+        "profiles.html",
+        enabled=profiling_enabled(),
+        threshold=SlowRequestMS,
+        sample=ProfileSAMPLE,
+        requests=slow_requests(),
+    )
+
+
+# Route to download the pstats file of a slow request
+@app.route("/Profiles/<name>")
+def profile_file(name):
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+
+# Live stream of access events (Server-Sent Events)
+@app.route("/events")
+def events():
+    client = subscribe(request.headers.get("Last-Event-ID", type=int))
+    if client is None:
+        return jsonify({"error": "Too many event stream clients"}), 503
+    return Response(
+        stream_with_context(stream(client)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Route for reader health checks and heartbeats, never touches the database on a cache hit.
+# Only doors configured in the database are recorded, so unauthenticated heartbeats cannot
+# grow the reader registry; the others are still answered, readers use this as liveness check
+@app.route("/health", methods=["GET", "POST"])
+def health():
+    if request.method == "POST":
+        data = request.get_json(silent=True) or {}
+        door_id = data.get("door_id")
+        if door_id is None:
+            return jsonify({"error": "Door ID is required"}), 400
+        if str(door_id) not in configured_doors():
+            log.debug("Heartbeat from unknown door %s ignored", door_id)
+            return jsonify({"status": "ok", "log_records_dropped": serverLog.dropped_records}), 200
+        record_heartbeat(
+            door_id,
+            firmware=data.get("firmware"),
+            uptime=data.get("uptime"),
+            mem_free=data.get("mem_free"),
+            mem_low=data.get("mem_low"),
+            ip=request.remote_addr,
+        )
+    return jsonify({"status": "ok", "log_records_dropped": serverLog.dropped_records}), 200
+
+
 def run_flask_app():
     """Run the Flask web application.
 
@@ -130,6 +391,7 @@ def run_flask_app():
     no reloader, on the specified port and host. It serves as the main entry
     point for running the web server.
     """
+    install_profiling(app)
     app.run(debug=True, use_reloader=False, port=WebServerPORT, host="0.0.0.0")
 
 
@@ -140,7 +402,7 @@ def run_webServer_thread():
     application. It allows the web server to run concurrently with other
     tasks in the main program, ensuring the web interface remains responsive.
     """
-    print(f"STARTING WEB SERVER ON PORT {WebServerPORT}")
+    log.info("STARTING WEB SERVER ON PORT %s", WebServerPORT)
     flask_thread = Thread(target=run_flask_app, daemon=True)
     flask_thread.start()
     # flask_thread.join()
@@ -0,0 +1,93 @@
+import time
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+
+from aclSnapshot import check_access
+from admission import admit, release
+from database import add_log_repeats, log_access_attempt
+from env import DBFILE
+
+try:
+    from env import DuplicateWINDOW
+except ImportError:
+    DuplicateWINDOW = 10
+
+# Repeated scans of the same tag on the same door, e.g. a card held against the reader or
+# swiped again while the door is still open, get the decision of the first scan without
+# another check and are merged into its log row. The window runs from the first scan, so a
+# revoked tag is refused again at most DuplicateWINDOW seconds later.
+MAX_TRACKED = 10000  # Scans remembered at once, older ones are dropped early
+
+_scans = OrderedDict()  # (UID, door) -> [granted, upn, log id, first scan (monotonic), repeats, last seen]
+_finished = []  # Scans out of their window with repeats not yet written
+_lock = Lock()
+
+
+def _expire(now):
+    # Move the scans out of their window to _finished. _scans is in insertion order, which is
+    # the order of their first scan, so this stops at the first scan still in its window
+    while _scans:
+        scan = next(iter(_scans.values()))
+        if now - scan[3] < DuplicateWINDOW and len(_scans) <= MAX_TRACKED:
+            break
+        _scans.popitem(last=False)
+        if scan[4]:
+            _finished.append(scan)
+
+
+def decide_access(rfid_uid, door_id):
+    """Decide on an access request and log it, merging repeated scans.
+
+    Shared by POST /access and the UDP access protocol.
+
+    ## Parameters:
+    - rfid_uid (str): The RFID UID of the tag.
+    - door_id (int): The door the request comes from.
+
+    ## Returns:
+    - tuple: (access granted, UPN or None, None or why admission control rejected the
+      request: "door", "uid" or "busy").
+    """
+    key = (rfid_uid, str(door_id))
+    now = time.monotonic()
+    with _lock:
+        scan = _scans.get(key)
+        if scan is not None and now - scan[3] < DuplicateWINDOW:
+            scan[4] += 1
+            scan[5] = datetime.now()
+            return scan[0], scan[1], None
+
+    # Rejected before any database work, only the admission counters record it
+    rejected = admit(door_id, rfid_uid)
+    if rejected:
+        return False, None, rejected
+    try:
+        access_granted, upn = check_access(rfid_uid, door_id)
+        log_id = log_access_attempt(DBFILE, upn, rfid_uid, access_granted, door_id)
+    finally:
+        release()
+
+    with _lock:
+        _expire(now)
+        previous = _scans.pop(key, None)
+        if previous is not None and previous[4]:
+            _finished.append(previous)
+        _scans[key] = [access_granted, upn, log_id, now, 0, None]
+    return access_granted, upn, None
+
+
+def flush_repeats(db_file=DBFILE):
+    """Write the repeat count and last seen time of the scans out of their window.
+
+    Scheduled every few seconds, so a burst costs one UPDATE instead of one row per scan.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    """
+    with _lock:
+        _expire(time.monotonic())
+        finished = _finished[:]
+        del _finished[:]
+    if finished:
+        add_log_repeats(db_file, [(scan[2], scan[4], str(scan[5])) for scan in finished])
@@ -0,0 +1,158 @@
+import json
+import queue
+from collections import deque
+from threading import Lock
+
+# Recent access events kept in memory, newest last. Each event is a tuple in the same
+# order as the rows of get_latest_logs: (timestamp, user, rFIDUID, granted, door_id).
+RECENT_EVENTS = 200
+CLIENT_QUEUE_SIZE = 100  # Events buffered per stream client before it starts losing them
+MAX_CLIENTS = 20
+KEEPALIVE = 15  # Seconds between keep-alive comments on an idle stream
+RETRY = 5  # Seconds a browser waits before reconnecting a dropped stream
+
+_events = deque(maxlen=RECENT_EVENTS)
+_last_id = 0
+_clients = set()
+_lock = Lock()
+dropped_events = 0  # Events not delivered to a stream client that was too slow
+
+
+class StreamClient:
+    """A bounded queue of events for one Server-Sent Events connection."""
+
+    def __init__(self):
+        self.queue = queue.Queue(CLIENT_QUEUE_SIZE)
+        self.dropped = 0
+
+
+def _publish(event_id, event):
+    # Never blocks: a full client queue loses the event and the client is told later
+    global dropped_events
+    for client in list(_clients):
+        try:
+            client.queue.put_nowait((event_id, event))
+        except queue.Full:
+            client.dropped += 1
+            dropped_events += 1
+
+
+def record_access_event(timestamp, user, rfid_uid, granted, door_id):
+    """Add an access attempt to the recent events and push it to the stream clients.
+
+    ## Parameters:
+    - timestamp (datetime): When the attempt was logged.
+    - user (str): The user's UPN, or None.
+    - rfid_uid (str): The RFID UID of the tag.
+    - granted (bool): Whether access was granted.
+    - door_id (int): The door the attempt was made on.
+    """
+    global _last_id
+    event = (str(timestamp), user, rfid_uid, int(bool(granted)), door_id)
+    with _lock:
+        _last_id += 1
+        _events.append((_last_id, event))
+        _publish(_last_id, event)
+
+
+def load_recent_events(logs):
+    """Fill the recent events from the log table at startup.
+
+    ## Parameters:
+    - logs (list): Log rows as returned by get_latest_logs, newest first.
+    """
+    global _last_id
+    with _lock:
+        for log in reversed(logs):
+            _last_id += 1
+            _events.append((_last_id, tuple(log)))
+
+
+def latest_events(limit):
+    """Return the latest access events without querying the database.
+
+    ## Parameters:
+    - limit (int): The number of events to return.
+
+    ## Returns:
+    - list: Events newest first, in the row format of get_latest_logs.
+    """
+    with _lock:
+        events = list(_events)[-limit:]
+    return [event for _, event in reversed(events)]
+
+
+def subscribe(last_event_id=None):
+    """Register a stream client.
+
+    ## Parameters:
+    - last_event_id (int): The last event the client saw before reconnecting. The newer
+      events still in memory are queued for it first.
+
+    ## Returns:
+    - StreamClient: The new client, or None if MAX_CLIENTS are already connected.
+    """
+    client = StreamClient()
+    with _lock:
+        if len(_clients) >= MAX_CLIENTS:
+            return None
+        if last_event_id is not None:
+            for event_id, event in _events:
+                if event_id > last_event_id and not client.queue.full():
+                    client.queue.put_nowait((event_id, event))
+        _clients.add(client)
+    return client
+
+
+def unsubscribe(client):
+    """Remove a stream client."""
+    with _lock:
+        _clients.discard(client)
+
+
+def format_event(event_id, event):
+    """Format an access event as a Server-Sent Events message.
+
+    ## Parameters:
+    - event_id (int): The event id, sent back by the browser as Last-Event-ID.
+    - event (tuple): The event.
+
+    ## Returns:
+    - str: The message.
+    """
+    timestamp, user, rfid_uid, granted, door_id = event
+    data = json.dumps(
+        {
+            "timestamp": timestamp,
+            "user": user,
+            "rfid_uid": rfid_uid,
+            "granted": bool(granted),
+            "door_id": door_id,
+        }
+    )
+    return f"id: {event_id}\nevent: access\ndata: {data}\n\n"
+
+
+def stream(client):
+    """Yield the Server-Sent Events messages of one client until it disconnects.
+
+    When the client fell behind and lost events, a "dropped" event with their number is sent
+    so the page can reload the full state.
+
+    ## Parameters:
+    - client (StreamClient): The client returned by `subscribe`.
+    """
+    try:
+        yield f"retry: {RETRY * 1000}\n\n"
+        while True:
+            try:
+                event_id, event = client.queue.get(timeout=KEEPALIVE)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if client.dropped:
+                dropped, client.dropped = client.dropped, 0
+                yield f"event: dropped\ndata: {dropped}\n\n"
+            yield format_event(event_id, event)
+    finally:
+        unsubscribe(client)
@@ -0,0 +1,133 @@
+import logging
+import socketserver
+import struct
+from collections import OrderedDict
+from threading import Lock, Thread
+
+from accessDecision import decide_access
+
+try:
+    from env import AccessUDPPORT
+except ImportError:
+    AccessUDPPORT = 5001
+
+log = logging.getLogger(__name__)
+
+# Compact access protocol, one UDP datagram each way (all integers big endian)
+#   request (22 bytes): magic "RA", version, UID length, door id (u32), nonce (u32),
+#                       UID bytes zero padded to 10
+#   reply (32 bytes):   magic "RA", version, flags (bit 0: granted, bit 1: rate limited),
+#                       nonce (u32), display name (UTF-8, zero padded to 24)
+# The reader resends a request with the same nonce when no reply arrives, so the last
+# replies are cached and a retransmission is answered without logging the scan twice.
+MAGIC = b"RA"
+VERSION = 1
+REQUEST_FMT = ">2sBBII10s"
+REPLY_FMT = ">2sBBI24s"
+REQUEST_SIZE = struct.calcsize(REQUEST_FMT)
+NAME_SIZE = 24
+FLAG_GRANTED = 0x01
+FLAG_REJECTED = 0x02
+REPLY_CACHE_SIZE = 256
+
+_replies = OrderedDict()
+_replies_lock = Lock()
+
+
+def uid_to_string(uid):
+    """Format UID bytes like the HTTP readers send them.
+
+    ## Parameters:
+    - uid (bytes): The UID bytes read from the tag.
+
+    ## Returns:
+    - str: The decimal value of each byte, concatenated.
+    """
+    return "".join(str(byte) for byte in uid)
+
+
+def short_name(upn):
+    """Cut a UPN to NAME_SIZE bytes of UTF-8 without splitting a character.
+
+    ## Parameters:
+    - upn (str): The user's UPN, or None.
+
+    ## Returns:
+    - bytes: The encoded name.
+    """
+    name = (upn or "").encode("utf-8")[:NAME_SIZE]
+    return name.decode("utf-8", "ignore").encode("utf-8")
+
+
+def handle_request(data, client):
+    """Decide on one access request datagram.
+
+    The decision and the log entry are the same as for POST /access.
+
+    ## Parameters:
+    - data (bytes): The received datagram.
+    - client (tuple): The sender address, used with the nonce to spot retransmissions.
+
+    ## Returns:
+    - bytes: The reply datagram, or None if the request is malformed.
+    """
+    if len(data) != REQUEST_SIZE:
+        return None
+    magic, version, uid_len, door_id, nonce, uid = struct.unpack(REQUEST_FMT, data)
+    if magic != MAGIC or version != VERSION or not 0 < uid_len <= len(uid):
+        return None
+
+    key = (client[0], door_id, nonce)
+    with _replies_lock:
+        reply = _replies.get(key)
+    if reply is not None:
+        return reply
+
+    access_granted, upn, rejected = decide_access(uid_to_string(uid[:uid_len]), door_id)
+    if rejected:
+        # Not cached: a retransmission is checked against the limits again
+        return struct.pack(REPLY_FMT, MAGIC, VERSION, FLAG_REJECTED, nonce, b"")
+    reply = struct.pack(
+        REPLY_FMT,
+        MAGIC,
+        VERSION,
+        FLAG_GRANTED if access_granted else 0,
+        nonce,
+        short_name(upn if access_granted else None),
+    )
+
+    with _replies_lock:
+        _replies[key] = reply
+        while len(_replies) > REPLY_CACHE_SIZE:
+            _replies.popitem(last=False)
+    return reply
+
+
+class AccessRequestHandler(socketserver.BaseRequestHandler):
+    """Answer one access request datagram."""
+
+    def handle(self):
+        data, sock = self.request
+        reply = handle_request(data, self.client_address)
+        if reply is not None:
+            sock.sendto(reply, self.client_address)
+
+
+def run_access_udp_server():
+    """Serve the compact access protocol on AccessUDPPORT.
+
+    Each datagram is handled in its own thread, like requests on the Flask server.
+    """
+    with socketserver.ThreadingUDPServer(("0.0.0.0", AccessUDPPORT), AccessRequestHandler) as server:
+        server.daemon_threads = True
+        server.serve_forever()
+
+
+def run_access_udp_thread():
+    """Start the compact access protocol server in a separate thread.
+
+    The server runs next to the Flask web server and shares its access check and logging.
+    """
+    log.info("STARTING ACCESS UDP SERVER ON PORT %s", AccessUDPPORT)
+    udp_thread = Thread(target=run_access_udp_server, daemon=True)
+    udp_thread.start()
@@ -0,0 +1,333 @@
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import zlib
+from threading import Lock
+
+from database import check_access as check_access_database
+from doorSchedules import door_open_now
+from env import DBFILE
+
+log = logging.getLogger(__name__)
+
+# Compiled ACL snapshot, written after every sync and door change and read with mmap
+#
+# File layout (all integers little endian):
+#   header (64 bytes): magic "RFACL", format version, generation, CRC-32 of everything
+#                      after the header, then the count and offset of each table
+#   UID index:   sorted (UID key, user index), the key is the UID string zero padded
+#   users:       (UPN offset, UPN length) into the string pool
+#   doors:       sorted (door id, offset and count in the allowed table)
+#   allowed:     per door, the sorted indexes of the users allowed through it
+#   string pool: UTF-8 UPNs
+#
+# A lookup is a binary search of the UID index, a binary search of the doors and a binary
+# search of that door's allowed set, reading the mapped file without loading or parsing it
+# (each probe of the UID index copies its 32 byte key). A new snapshot is
+# written to a temporary file and renamed over the old one, so every process keeps a
+# complete snapshot mapped and picks up the new one on its next lookup.
+MAGIC = b"RFACL\x00\x00\x00"
+FORMAT_VERSION = 1
+HEADER_FMT = "<8sHHQI" + "II" * 5
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+KEY_SIZE = 32
+UID_RECORD_FMT = "<%dsI" % KEY_SIZE
+UID_RECORD_SIZE = struct.calcsize(UID_RECORD_FMT)
+USER_RECORD_FMT = "<II"
+USER_RECORD_SIZE = struct.calcsize(USER_RECORD_FMT)
+DOOR_RECORD_FMT = "<qII"
+DOOR_RECORD_SIZE = struct.calcsize(DOOR_RECORD_FMT)
+SNAPSHOT_FILE = os.path.splitext(DBFILE)[0] + ".acl"
+
+_publish_lock = Lock()
+_snapshots = {}
+_snapshots_lock = Lock()
+
+
+def _uid_key(rfid_uid):
+    # UIDs are stored as bytes by the LDAP sync and looked up as str
+    if isinstance(rfid_uid, str):
+        rfid_uid = rfid_uid.encode("utf-8")
+    return bytes(rfid_uid)
+
+
+def compile_snapshot(db_file, generation):
+    """Compile the access rules of the database into the snapshot layout.
+
+    A user may open a door when the door's group is one of the entries of its
+    EffectiveMemberOf column (MemberOf until the next sync for users of older versions),
+    with the same matching as `database.check_access`.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    - generation (int): The snapshot generation written in the header.
+
+    ## Returns:
+    - bytes: The complete snapshot file.
+    """
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT upn, rFIDUID, COALESCE(EffectiveMemberOf, MemberOf) FROM Users ORDER BY rowid"
+    )
+    users = cursor.fetchall()
+    cursor.execute("SELECT id, GroupCn FROM Doors ORDER BY id")
+    doors = cursor.fetchall()
+    conn.close()
+
+    uid_index = {}
+    upns = []
+    members = {}  # group CN -> indexes of its users, increasing
+    for upn, rfid_uid, member_of in users:
+        if not rfid_uid:
+            continue
+        key = _uid_key(rfid_uid)
+        if len(key) > KEY_SIZE:
+            log.warning("ACL snapshot: UID of '%s' too long, skipped", upn, extra={"upn": upn})
+            continue
+        if key in uid_index:
+            continue  # check_access only ever sees the first user with a UID
+        for group_cn in set((member_of or "").split(",")):
+            members.setdefault(group_cn, []).append(len(upns))
+        uid_index[key] = len(upns)
+        upns.append(upn.decode("utf-8") if isinstance(upn, bytes) else upn)
+
+    pool = bytearray()
+    user_table = bytearray()
+    for upn in upns:
+        data = upn.encode("utf-8")
+        user_table += struct.pack(USER_RECORD_FMT, len(pool), len(data))
+        pool += data
+
+    uid_table = bytearray()
+    for key in sorted(uid_index):
+        uid_table += struct.pack(UID_RECORD_FMT, key, uid_index[key])
+
+    door_table = bytearray()
+    allowed_table = bytearray()
+    for door_id, group_cn in doors:
+        allowed = members.get(group_cn, [])
+        door_table += struct.pack(DOOR_RECORD_FMT, door_id, len(allowed_table) // 4, len(allowed))
+        allowed_table += struct.pack("<%dI" % len(allowed), *allowed)
+
+    tables = [uid_table, user_table, door_table, allowed_table, pool]
+    counts = [
+        len(uid_index),
+        len(upns),
+        len(doors),
+        len(allowed_table) // 4,
+        len(pool),
+    ]
+    body = bytearray()
+    layout = []
+    for count, table in zip(counts, tables):
+        layout += [count, HEADER_SIZE + len(body)]
+        body += table
+    header = struct.pack(
+        HEADER_FMT, MAGIC, FORMAT_VERSION, 0, generation, zlib.crc32(body), *layout
+    )
+    return header + bytes(body)
+
+
+def publish_snapshot(db_file=DBFILE, path=SNAPSHOT_FILE):
+    """Compile a new snapshot and atomically replace the published one.
+
+    If the snapshot cannot be written the published one is removed, so access checks fall
+    back to the database rather than use outdated rules.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    - path (str): The snapshot file.
+
+    ## Returns:
+    - int: The generation of the new snapshot, or None if it could not be published.
+    """
+    with _publish_lock:
+        try:
+            generation = AclSnapshot(path).generation + 1
+        except (OSError, ValueError):
+            generation = 1
+        tmp = None
+        try:
+            data = compile_snapshot(db_file, generation)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except (OSError, sqlite3.Error) as e:
+            log.error("ACL snapshot error: %s", e)
+            for stale in (tmp, path):
+                if stale and os.path.exists(stale):
+                    os.unlink(stale)
+            return None
+    log.info("ACL snapshot %s published (%s bytes)", generation, len(data))
+    return generation
+
+
+class AclSnapshot:
+    """A read-only view of a snapshot file, searched through mmap without loading it.
+
+    ## Parameters:
+    - path (str): The snapshot file.
+
+    ## Raises:
+    - ValueError: If the file is not a valid snapshot or its checksum does not match.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if stat.st_size < HEADER_SIZE:
+                raise ValueError("ACL snapshot too short")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = struct.unpack_from(HEADER_FMT, self.map, 0)
+        magic, version, _, self.generation, crc = fields[:5]
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError("not an ACL snapshot")
+        if zlib.crc32(memoryview(self.map)[HEADER_SIZE:]) != crc:
+            raise ValueError("ACL snapshot checksum mismatch")
+        (
+            self.uid_count,
+            self.uid_offset,
+            self.user_count,
+            self.user_offset,
+            self.door_count,
+            self.door_offset,
+            _,
+            self.allowed_offset,
+            _,
+            self.pool_offset,
+        ) = fields[5:]
+
+    def _find_user(self, key):
+        # Binary search of the UID index, returns the user index or -1
+        key = key.ljust(KEY_SIZE, b"\x00")
+        lo, hi = 0, self.uid_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = self.uid_offset + mid * UID_RECORD_SIZE
+            # Copying the 32 byte key is faster in CPython than comparing through a memoryview
+            probe = self.map[off : off + KEY_SIZE]
+            if probe == key:
+                return struct.unpack_from("<I", self.map, off + KEY_SIZE)[0]
+            if probe < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return -1
+
+    def _find_door(self, door_id):
+        # Binary search of the doors, returns (start, count) in the allowed table or None
+        lo, hi = 0, self.door_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe, start, count = struct.unpack_from(
+                DOOR_RECORD_FMT, self.map, self.door_offset + mid * DOOR_RECORD_SIZE
+            )
+            if probe == door_id:
+                return start, count
+            if probe < door_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def _is_allowed(self, start, count, user):
+        lo, hi = start, start + count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            probe = struct.unpack_from("<I", self.map, self.allowed_offset + mid * 4)[0]
+            if probe == user:
+                return True
+            if probe < user:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def upn(self, user):
+        """Return the UPN of a user index."""
+        off, length = struct.unpack_from(
+            USER_RECORD_FMT, self.map, self.user_offset + user * USER_RECORD_SIZE
+        )
+        start = self.pool_offset + off
+        return self.map[start : start + length].decode("utf-8")
+
+    def check_access(self, rfid_uid, door_id):
+        """Check if the user is allowed to open the door.
+
+        ## Parameters:
+        - rfid_uid (str): The RFID UID of the user.
+        - door_id (int): The ID of the door.
+
+        ## Returns:
+        - tuple: (True, upn) if access is granted, otherwise (False, None).
+        """
+        try:
+            door_id = int(door_id)
+        except (TypeError, ValueError):
+            return False, None
+        user = self._find_user(_uid_key(rfid_uid))
+        if user < 0:
+            return False, None
+        door = self._find_door(door_id)
+        if door is None or not self._is_allowed(door[0], door[1], user):
+            return False, None
+        return True, self.upn(user)
+
+
+def get_snapshot(path=SNAPSHOT_FILE):
+    """Return the mapped snapshot, remapping it when a new one was published.
+
+    ## Parameters:
+    - path (str): The snapshot file.
+
+    ## Returns:
+    - AclSnapshot: The current snapshot, or None if there is no valid one.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with _snapshots_lock:
+        snapshot = _snapshots.get(path)
+        if snapshot is not None and snapshot.identity == identity:
+            return snapshot
+        try:
+            snapshot = AclSnapshot(path)
+        except (OSError, ValueError) as e:
+            log.error("ACL snapshot error: %s", e)
+            return None
+        # The previous map is closed once no lookup holds it any more
+        _snapshots[path] = snapshot
+        return snapshot
+
+
+def check_access(rfid_uid_str, door_id):
+    """Check if the user is allowed to open the door, using the ACL snapshot.
+
+    Falls back to `database.check_access` when no valid snapshot is published. Access is
+    denied outside the windows of the door's schedule.
+
+    ## Parameters:
+    - rfid_uid_str (str): The RFID UID of the user.
+    - door_id (int): The ID of the door.
+
+    ## Returns:
+    - tuple: (True, upn) if access is granted, otherwise (False, None).
+    """
+    snapshot = get_snapshot()
+    if snapshot is None:
+        access_granted, upn = check_access_database(rfid_uid_str, door_id)
+    else:
+        access_granted, upn = snapshot.check_access(rfid_uid_str, door_id)
+    if access_granted and not door_open_now(door_id):
+        return False, None
+    return access_granted, upn
@@ -0,0 +1,118 @@
+import logging
+import time
+from collections import OrderedDict
+from threading import BoundedSemaphore, Lock
+
+log = logging.getLogger(__name__)
+
+# Admission control for access requests, checked before any database work.
+# Each door and each UID has a token bucket: `rate` requests per second on average, with
+# bursts of up to `burst`. A reader already ignores a tag held in the field for 2 seconds,
+# so anything faster is a stuck card or a misbehaving reader.
+DOOR_RATE = 5
+DOOR_BURST = 10
+UID_RATE = 1
+UID_BURST = 3
+MAX_CONCURRENT = 8  # Access requests allowed to wait on the database at the same time
+MAX_TRACKED = 10000  # Buckets kept per kind, the least recently used are forgotten
+
+_concurrency = BoundedSemaphore(MAX_CONCURRENT)
+_lock = Lock()
+_buckets = {"door": OrderedDict(), "uid": OrderedDict()}
+_dropped = {"door": 0, "uid": 0, "busy": 0}
+_dropped_by_door = OrderedDict()  # Door id (str) -> dropped requests, MAX_TRACKED at most
+_admitted = 0
+_reported = 0  # Total dropped at the last summary
+
+
+def _refill(kind, key, rate, burst, now):
+    # Refill the bucket of `key` up to now and return its tokens
+    buckets = _buckets[kind]
+    tokens, last = buckets.pop(key, (burst, now))
+    tokens = min(burst, tokens + (now - last) * rate)
+    buckets[key] = (tokens, now)
+    if len(buckets) > MAX_TRACKED:
+        buckets.popitem(last=False)
+    return tokens
+
+
+def _take(kind, key):
+    # Take one token from a bucket refilled by `_refill`
+    tokens, last = _buckets[kind][key]
+    _buckets[kind][key] = (tokens - 1, last)
+
+
+def admit(door_id, rfid_uid):
+    """Decide whether an access request may go to the database.
+
+    An admitted request holds one of the MAX_CONCURRENT slots and must call `release` when
+    it is done. Tokens are only taken from the buckets when the request is admitted, so a
+    request rejected for its UID or because the server is busy does not count against the door.
+
+    ## Parameters:
+    - door_id (int): The door the request comes from.
+    - rfid_uid (str): The RFID UID of the tag.
+
+    ## Returns:
+    - str: None if the request is admitted, otherwise why it was rejected: "door", "uid"
+      or "busy".
+    """
+    global _admitted
+    now = time.monotonic()
+    door = str(door_id)
+    uid = str(rfid_uid)
+    with _lock:
+        if _refill("door", door, DOOR_RATE, DOOR_BURST, now) < 1:
+            reason = "door"
+        elif _refill("uid", uid, UID_RATE, UID_BURST, now) < 1:
+            reason = "uid"
+        elif not _concurrency.acquire(blocking=False):
+            reason = "busy"
+        else:
+            _take("door", door)
+            _take("uid", uid)
+            _admitted += 1
+            return None
+        _dropped[reason] += 1
+        _dropped_by_door[door] = _dropped_by_door.pop(door, 0) + 1
+        if len(_dropped_by_door) > MAX_TRACKED:
+            _dropped_by_door.popitem(last=False)
+        return reason
+
+
+def release():
+    """Free the slot taken by an admitted request."""
+    _concurrency.release()
+
+
+def admission_stats():
+    """Return the admission counters since the server started.
+
+    ## Returns:
+    - dict: Admitted requests, dropped requests per reason and per door (the MAX_TRACKED
+      doors that dropped requests most recently).
+    """
+    with _lock:
+        return {
+            "admitted": _admitted,
+            "dropped": dict(_dropped),
+            "dropped_total": sum(_dropped.values()),
+            "dropped_by_door": dict(_dropped_by_door),
+        }
+
+
+def log_admission_summary():
+    """Log the requests dropped since the last summary, if any."""
+    global _reported
+    stats = admission_stats()
+    dropped = stats["dropped_total"] - _reported
+    if dropped:
+        _reported = stats["dropped_total"]
+        worst = sorted(stats["dropped_by_door"].items(), key=lambda item: -item[1])[:5]
+        log.warning(
+            "Admission control dropped %s access requests (totals: %s, top doors: %s)",
+            dropped,
+            stats["dropped"],
+            dict(worst),
+            extra={"dropped": dropped, "dropped_by_door": dict(worst)},
+        )
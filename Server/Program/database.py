@@ -1,7 +1,12 @@
+import logging
 import sqlite3
 from datetime import datetime
 
+from accessEvents import record_access_event
 from env import DBFILE
+from pageCache import bump_data_version
+
+log = logging.getLogger(__name__)
 
 
 # Function to check if a table exists in the database
@@ -28,7 +33,8 @@ def table_exists(cursor, table_name):
 def create_users_table(cursor):
     """Create the Users table in the database.
 
-    This function creates the Users table with columns for user principal name (upn), RFID UID, and member of groups.
+    This function creates the Users table with columns for user principal name (upn), RFID UID, member of groups,
+    and the door groups the user is in directly or through nested groups, computed by the LDAP sync.
 
     ## Parameters:
     - cursor (sqlite3.Cursor): The cursor object to execute SQL queries.
@@ -37,6 +43,7 @@ def create_users_table(cursor):
                         upn TEXT PRIMARY KEY,
                         rFIDUID TEXT,
                         MemberOf TEXT,
+                        EffectiveMemberOf TEXT,
                         FOREIGN KEY (MemberOf) REFERENCES Groups(cn)
                     )""")
 
@@ -59,7 +66,8 @@ def create_groups_table(cursor):
 def create_doors_table(cursor):
     """Create the Doors table in the database.
 
-    This function creates the Doors table with columns for door ID and associated group common name.
+    This function creates the Doors table with columns for door ID, associated group common name, and the name of
+    the schedule restricting when the group may open the door (NULL for always).
 
     ## Parameters:
     - cursor (sqlite3.Cursor): The cursor object to execute SQL queries.
@@ -67,7 +75,27 @@ def create_doors_table(cursor):
     cursor.execute("""CREATE TABLE Doors (
                         id INTEGER PRIMARY KEY,
                         GroupCn TEXT,
-                        FOREIGN KEY (GroupCn) REFERENCES Groups(cn)
+                        Schedule TEXT,
+                        FOREIGN KEY (GroupCn) REFERENCES Groups(cn),
+                        FOREIGN KEY (Schedule) REFERENCES Schedules(name)
+                    )""")
+
+
+# Function to create the Schedules table
+def create_schedules_table(cursor):
+    """Create the Schedules table in the database.
+
+    This function creates the Schedules table with columns for the schedule name, its weekday rules and exception
+    dates as written by the administrator, and the interval tables compiled from them (JSON).
+
+    ## Parameters:
+    - cursor (sqlite3.Cursor): The cursor object to execute SQL queries.
+    """
+    cursor.execute("""CREATE TABLE Schedules (
+                        name TEXT PRIMARY KEY,
+                        rules TEXT,
+                        exceptions TEXT,
+                        compiled TEXT
                     )""")
 
 
@@ -76,7 +104,7 @@ def create_logs_table(cursor):
     """Create the logs table in the database.
 
     This function creates the logs table with columns for ID (auto-incremented), timestamp, user, RFID UID, door ID,
-    and access granted status. Foreign key constraints are set on the door ID, user, and RFID UID columns.
+    access granted status, and the number and last time of repeated scans merged into the row. Foreign key constraints are set on the door ID, user, and RFID UID columns.
 
     ## Parameters:
     - cursor (sqlite3.Cursor): The cursor object to execute SQL queries.
@@ -89,6 +117,8 @@ def create_logs_table(cursor):
             rFIDUID TEXT,
             door_id INTEGER ,
             granted BOOLEAN ,
+            repeat_count INTEGER DEFAULT 1,
+            last_seen TEXT,
             FOREIGN KEY (door_id) REFERENCES Doors (id)
             FOREIGN KEY (user) REFERENCES Users (upn)
             FOREIGN KEY (rFIDUID) REFERENCES Users (rFIDUID)            
@@ -96,6 +126,42 @@ def create_logs_table(cursor):
     """)
 
 
+# Function to create the user search table
+def create_users_search_table(cursor):
+    """Create the UsersSearch full text table and the triggers that keep it in sync with Users.
+
+    The table uses the FTS5 trigram tokenizer, so any substring of three characters or more
+    of a UPN, RFID UID or group is found through the index. The triggers mirror every write
+    to Users (LDAP sync included), and the table is filled from the existing users.
+
+    ## Parameters:
+    - cursor (sqlite3.Cursor): The cursor object to execute SQL queries.
+
+    ## Raises:
+    - sqlite3.OperationalError: If this SQLite build has no FTS5 trigram tokenizer.
+    """
+    cursor.execute("""CREATE VIRTUAL TABLE UsersSearch USING fts5(
+                        upn, rFIDUID, MemberOf, tokenize='trigram'
+                    )""")
+    columns = "CAST({0}.upn AS TEXT), CAST({0}.rFIDUID AS TEXT), {0}.MemberOf"
+    cursor.execute(f"""CREATE TRIGGER UsersSearch_insert AFTER INSERT ON Users BEGIN
+                        INSERT INTO UsersSearch (rowid, upn, rFIDUID, MemberOf)
+                        VALUES (new.rowid, {columns.format("new")});
+                    END""")
+    cursor.execute("""CREATE TRIGGER UsersSearch_delete AFTER DELETE ON Users BEGIN
+                        DELETE FROM UsersSearch WHERE rowid = old.rowid;
+                    END""")
+    cursor.execute(f"""CREATE TRIGGER UsersSearch_update AFTER UPDATE ON Users BEGIN
+                        DELETE FROM UsersSearch WHERE rowid = old.rowid;
+                        INSERT INTO UsersSearch (rowid, upn, rFIDUID, MemberOf)
+                        VALUES (new.rowid, {columns.format("new")});
+                    END""")
+    cursor.execute(
+        f"INSERT INTO UsersSearch (rowid, upn, rFIDUID, MemberOf) "
+        f"SELECT rowid, {columns.format('Users')} FROM Users"
+    )
+
+
 # Function to setup the database
 def setup_database(db_file):
     """Set up the SQLite database by creating necessary tables if they don't already exist.
@@ -117,29 +183,67 @@ def setup_database(db_file):
     # Check and create Users table
     if not table_exists(cursor, "Users"):
         create_users_table(cursor)
-        print(f"[{datetime.now()}] Users table created successfully.")
+        log.info("Users table created successfully.")
     else:
-        print(f"[{datetime.now()}] Users table already exists.")
+        log.info("Users table already exists.")
+        # Add the nested group membership column to users created by older versions
+        cursor.execute("PRAGMA table_info(Users)")
+        if "EffectiveMemberOf" not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE Users ADD COLUMN EffectiveMemberOf TEXT")
+            log.info("Users table upgraded with nested group membership.")
 
     # Check and create Groups table
     if not table_exists(cursor, "Groups"):
         create_groups_table(cursor)
-        print(f"[{datetime.now()}] Groups table created successfully.")
+        log.info("Groups table created successfully.")
     else:
-        print(f"[{datetime.now()}] Groups table already exists.")
+        log.info("Groups table already exists.")
 
     # Check and create Doors table
     if not table_exists(cursor, "Doors"):
         create_doors_table(cursor)
-        print(f"[{datetime.now()}] Doors table created successfully.")
+        log.info("Doors table created successfully.")
+    else:
+        log.info("Doors table already exists.")
+        # Add the schedule column to doors created by older versions
+        cursor.execute("PRAGMA table_info(Doors)")
+        if "Schedule" not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE Doors ADD COLUMN Schedule TEXT")
+            log.info("Doors table upgraded with schedules.")
+
+    # Check and create Schedules table
+    if not table_exists(cursor, "Schedules"):
+        create_schedules_table(cursor)
+        log.info("Schedules table created successfully.")
     else:
-        print(f"[{datetime.now()}] Doors table already exists.")
-        # Check and create Doors table
+        log.info("Schedules table already exists.")
+
     if not table_exists(cursor, "Log"):
         create_logs_table(cursor)
-        print(f"[{datetime.now()}] Log table created successfully.")
+        log.info("Log table created successfully.")
+    else:
+        log.info("Log table already exists.")
+
+    # Add the repeated scan columns to logs created by older versions
+    cursor.execute("PRAGMA table_info(log)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if "repeat_count" not in columns:
+        cursor.execute("ALTER TABLE log ADD COLUMN repeat_count INTEGER DEFAULT 1")
+        cursor.execute("ALTER TABLE log ADD COLUMN last_seen TEXT")
+        log.info("Log table upgraded with repeat columns.")
+
+    # Index the UID lookups of check_access
+    cursor.execute("CREATE INDEX IF NOT EXISTS Users_rFIDUID ON Users (rFIDUID)")
+
+    # Check and create the user search table
+    if not table_exists(cursor, "UsersSearch"):
+        try:
+            create_users_search_table(cursor)
+            log.info("UsersSearch table created successfully.")
+        except sqlite3.OperationalError as e:
+            log.warning("UsersSearch table not available, searching without it: %s", e)
     else:
-        print(f"[{datetime.now()}] Log table already exists.")
+        log.info("UsersSearch table already exists.")
     # Commit changes and close connection
     conn.commit()
     conn.close()
@@ -159,21 +263,51 @@ def log_access_attempt(db_file, user, rFIDUID, granted, doorID):
     - doorID (int): The ID of the door where the access attempt occurred.
 
     # Returns:
-    - None
+    - int: The id of the new log row.
     """
     conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
 
-    print(f"[{datetime.now()}] User {user} get granted : {granted} on door : {doorID}")
+    timestamp = datetime.now()
+    log.info(
+        "User %s get granted : %s on door : %s",
+        user,
+        granted,
+        doorID,
+        extra={"upn": user, "rfid_uid": rFIDUID, "door_id": doorID, "granted": granted},
+    )
     cursor.execute(
         """
         INSERT INTO log (timestamp, user, rFIDUID, granted, door_id) VALUES (?, ?, ?, ?, ?)
     """,
-        (datetime.now(), user, rFIDUID, granted, doorID),
+        (timestamp, user, rFIDUID, granted, doorID),
     )
 
+    log_id = cursor.lastrowid
+
     conn.commit()
     conn.close()
+    record_access_event(timestamp, user, rFIDUID, granted, doorID)
+    bump_data_version("logs")
+    return log_id
+
+
+def add_log_repeats(db_file, repeats):
+    """Merge repeated scans into the log rows of their first scan.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    - repeats (list): (log id, number of repeats, last seen time) tuples.
+    """
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.executemany(
+        "UPDATE log SET repeat_count = repeat_count + ?, last_seen = ? WHERE id = ?",
+        [(count, last_seen, log_id) for log_id, count, last_seen in repeats],
+    )
+    conn.commit()
+    conn.close()
+    bump_data_version("logs")
 
 
 def print_users_table(cursor):
@@ -259,7 +393,7 @@ def get_logs():
     cursor = conn.cursor()
 
     cursor.execute("""
-    SELECT timestamp, user, rFIDUID, granted, door_id
+    SELECT timestamp, user, rFIDUID, granted, door_id, repeat_count, last_seen
     FROM log 
     ORDER BY id DESC 
     """)
@@ -316,7 +450,7 @@ def get_existing_groups(db_file):
         conn.close()
         return [group[0] for group in groups]
     except sqlite3.Error as e:
-        print(f"SQLite Error: {e}")
+        log.error("SQLite Error: %s", e)
         return []
 
 
@@ -335,6 +469,7 @@ def delete_group_from_database(group_cn):
     cursor.execute("DELETE FROM Doors WHERE GroupCn = ?", (group_cn,))
     conn.commit()
     conn.close()
+    bump_data_version("groups", "doors")
 
 
 def get_doors():
@@ -369,6 +504,59 @@ def get_users():
     return users
 
 
+USER_SEARCH_FIELDS = {"upn": "upn", "uid": "rFIDUID", "group": "MemberOf"}
+
+
+def search_users(query="", field="all", page=1, per_page=50):
+    """Fetch one page of users, optionally filtered by a search string.
+
+    Queries of three characters or more use the UsersSearch trigram index; shorter ones, or
+    databases without the search table, fall back to a LIKE scan. Matching is a case
+    insensitive substring match.
+
+    ## Parameters:
+        - query (str): The text to search for, empty for every user.
+        - field (str): "upn", "uid", "group" or "all".
+        - page (int): The page number, starting at 1.
+        - per_page (int): The number of users per page.
+
+    ## Returns:
+        - tuple: The users of the page as (upn, RFID UID, member of) tuples, and the total
+          number of matching users.
+    """
+    if field in USER_SEARCH_FIELDS:
+        columns = [USER_SEARCH_FIELDS[field]]
+    else:
+        columns = list(USER_SEARCH_FIELDS.values())
+    conn = sqlite3.connect(DBFILE)
+    cursor = conn.cursor()
+
+    source = " FROM Users"
+    params = []
+    if len(query) >= 3 and table_exists(cursor, "UsersSearch"):
+        phrase = '"' + query.replace('"', '""') + '"'
+        source += " JOIN UsersSearch ON UsersSearch.rowid = Users.rowid WHERE UsersSearch MATCH ?"
+        params.append("{" + " ".join(columns) + "} : " + phrase)
+    elif query:
+        pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        source += " WHERE " + " OR ".join(
+            f"CAST(Users.{column} AS TEXT) LIKE ? ESCAPE '\\'" for column in columns
+        )
+        params += [pattern] * len(columns)
+
+    cursor.execute("SELECT COUNT(*)" + source, params)
+    total = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT CAST(Users.upn AS TEXT), CAST(Users.rFIDUID AS TEXT), Users.MemberOf"
+        + source
+        + " ORDER BY Users.upn LIMIT ? OFFSET ?",
+        params + [per_page, (page - 1) * per_page],
+    )
+    users = cursor.fetchall()
+    conn.close()
+    return users, total
+
+
 # Function to add a door to the database
 def add_door_to_database(db_file, group_cn, Door_id):
     """Add a door to the database.
@@ -398,14 +586,128 @@ def add_door_to_database(db_file, group_cn, Door_id):
         )
         conn.commit()
         conn.close()
+        bump_data_version("doors")
         # print_database_content(DBFILE)
         return True
     except sqlite3.Error as e:
         # print_database_content(DBFILE)
-        print(f"SQLite Error: {e}")
+        log.error("SQLite Error: %s", e)
         return (False, e)
 
 
+def get_schedules(db_file):
+    """Retrieve all schedules with the doors they apply to.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+
+    ## Returns:
+    - list: (name, rules, exceptions, door ids) tuples sorted by name, the door ids as a
+      comma separated string or None.
+    """
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT Schedules.name, Schedules.rules, Schedules.exceptions, GROUP_CONCAT(Doors.id, ', ')
+        FROM Schedules LEFT JOIN Doors ON Doors.Schedule = Schedules.name
+        GROUP BY Schedules.name
+        ORDER BY Schedules.name
+    """)
+    schedules = cursor.fetchall()
+    conn.close()
+    return schedules
+
+
+def save_schedule(db_file, name, rules, exceptions, compiled):
+    """Add a schedule or replace the one with the same name.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    - name (str): The name of the schedule.
+    - rules (str): The weekday rules.
+    - exceptions (str): The exception dates.
+    - compiled (str): The interval tables compiled from the rules, as JSON.
+
+    ## Returns:
+    - bool: True if the schedule was saved, False otherwise.
+    """
+    try:
+        conn = sqlite3.connect(db_file)
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO Schedules (name, rules, exceptions, compiled) VALUES (?, ?, ?, ?)",
+            (name, rules, exceptions, compiled),
+        )
+        conn.commit()
+        conn.close()
+        bump_data_version("doors")
+        return True
+    except sqlite3.Error as e:
+        log.error("SQLite Error: %s", e)
+        return False
+
+
+def delete_schedule(db_file, name):
+    """Delete a schedule, the doors it applied to are open at any time again.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    - name (str): The name of the schedule.
+    """
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute("UPDATE Doors SET Schedule = NULL WHERE Schedule = ?", (name,))
+    cursor.execute("DELETE FROM Schedules WHERE name = ?", (name,))
+    conn.commit()
+    conn.close()
+    bump_data_version("doors")
+
+
+def set_door_schedule(db_file, door_id, name):
+    """Apply a schedule to a door.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    - door_id (int): The ID of the door.
+    - name (str): The name of the schedule, None to open the door at any time.
+
+    ## Returns:
+    - bool: True if the door exists and was updated, False otherwise.
+    """
+    try:
+        conn = sqlite3.connect(db_file)
+        cursor = conn.cursor()
+        cursor.execute("UPDATE Doors SET Schedule = ? WHERE id = ?", (name, door_id))
+        updated = cursor.rowcount == 1
+        conn.commit()
+        conn.close()
+        bump_data_version("doors")
+        return updated
+    except sqlite3.Error as e:
+        log.error("SQLite Error: %s", e, extra={"door_id": door_id})
+        return False
+
+
+def get_door_schedules(db_file):
+    """Retrieve the compiled schedule of every door that has one.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+
+    ## Returns:
+    - list: (door id, compiled schedule JSON, rules, exceptions) tuples.
+    """
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT Doors.id, Schedules.compiled, Schedules.rules, Schedules.exceptions "
+        "FROM Doors JOIN Schedules ON Doors.Schedule = Schedules.name"
+    )
+    door_schedules = cursor.fetchall()
+    conn.close()
+    return door_schedules
+
+
 # Function to verify if the user is allowed to open the door
 def check_access(rfid_uid_str, door_id):
     """Check if the user is allowed to open the door.
@@ -430,9 +732,9 @@ def check_access(rfid_uid_str, door_id):
         # Convert the received RFID UID string to bytes
         rfid_uid_bytes = rfid_uid_str.encode("utf-8")
 
-        # Get the user's UPN and group memberships based on the RFID UID
+        # Get the user's UPN and group memberships, nested groups included, based on the RFID UID
         cursor.execute(
-            "SELECT upn, MemberOf FROM Users WHERE rFIDUID = ?",
+            "SELECT upn, COALESCE(EffectiveMemberOf, MemberOf) FROM Users WHERE rFIDUID = ?",
             (rfid_uid_bytes,),
         )
         user_data = cursor.fetchone()
@@ -458,5 +760,5 @@ def check_access(rfid_uid_str, door_id):
         return False, None  # Access denied
 
     except sqlite3.Error as e:
-        print(f"SQLite Error: {e}")
+        log.error("SQLite Error: %s", e, extra={"rfid_uid": rfid_uid_str, "door_id": door_id})
         return False, None
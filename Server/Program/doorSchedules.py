@@ -0,0 +1,225 @@
+import json
+import logging
+import re
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from database import get_door_schedules
+from env import DBFILE
+
+try:
+    from env import SCHEDULE_TZ
+except ImportError:
+    SCHEDULE_TZ = ""  # Time zone of the schedules, e.g. "Europe/Paris", the server's when empty
+
+log = logging.getLogger(__name__)
+
+# Door schedules: when the group of a door may open it. A schedule is written as rules,
+# one per line, compiled when it is saved into sorted, merged intervals per weekday:
+#
+#   Mon-Fri 07:00-19:00      weekdays from 7 to 19
+#   Sat 08:00-12:00          several lines add up
+#   Fri 22:00-02:00          a window past midnight continues on the next day
+#   * 00:00-24:00            every day
+#
+# and exceptions, one date per line, that replace the weekday rules on that date:
+#
+#   2026-12-25               closed all day
+#   2026-12-24 07:00-12:00   only these windows that day
+#
+# An exception replaces the windows starting on its date. A window of the day before that
+# passes midnight still continues into it, unless the day before is an exception too.
+#
+# Checking a scan is then a dictionary lookup for the date and a binary search in the
+# intervals of the day, nothing is parsed per scan. Doors without a schedule are always open.
+# Times are in SCHEDULE_TZ.
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+DAY_MINUTES = 24 * 60
+
+_WINDOW = re.compile(r"^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$")
+
+_door_schedules = {}  # door id -> Schedule, replaced as a whole when a schedule changes
+
+
+def _schedule_zone(name):
+    # The configured zone, None (server local time) when empty or unknown
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        log.error("Unknown SCHEDULE_TZ '%s', schedules use the server time zone", name)
+        return None
+
+
+_zone = _schedule_zone(SCHEDULE_TZ)
+
+
+def _parse_minutes(hours, minutes):
+    value = int(hours) * 60 + int(minutes)
+    if int(minutes) > 59 or value > DAY_MINUTES:
+        raise ValueError(f"invalid time {hours}:{minutes}")
+    return value
+
+
+def _parse_window(text):
+    # "07:00-19:00" -> (420, 1140), the end may be before the start (past midnight)
+    match = _WINDOW.match(text)
+    if not match:
+        raise ValueError(f"invalid window '{text}', expected HH:MM-HH:MM")
+    start = _parse_minutes(*match.group(1, 2))
+    end = _parse_minutes(*match.group(3, 4))
+    if start == end:
+        raise ValueError(f"empty window '{text}'")
+    return start, end
+
+
+def _parse_days(text):
+    # "Mon-Fri", "Sat,Sun", "*" -> weekday numbers, Monday is 0
+    if text == "*":
+        return list(range(7))
+    days = []
+    for part in text.lower().split(","):
+        first, _, last = part.partition("-")
+        if first[:3] not in DAYS or (last and last[:3] not in DAYS):
+            raise ValueError(f"invalid days '{text}', expected e.g. Mon-Fri, Sat,Sun or *")
+        start = DAYS.index(first[:3])
+        end = DAYS.index(last[:3]) if last else start
+        days.extend(day % 7 for day in range(start, end + 1 if end >= start else end + 8))
+    return days
+
+
+def _merge(intervals):
+    # Sort and merge touching or overlapping intervals
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def compile_schedule(rules, exceptions=""):
+    """Compile schedule rules into interval tables.
+
+    ## Parameters:
+    - rules (str): Weekday rules, one "days HH:MM-HH:MM" per line.
+    - exceptions (str): Dates replacing the weekday rules, one "YYYY-MM-DD [HH:MM-HH:MM]"
+      per line.
+
+    ## Returns:
+    - dict: "days", seven lists of [start, end] minutes of the windows starting that day,
+      "carry", seven lists of the windows continuing after midnight from the day before, and
+      "dates", the lists of the exception dates. Stored as JSON next to the rules.
+
+    ## Raises:
+    - ValueError: If a line cannot be parsed, with its line number.
+    """
+    days = [[] for _ in DAYS]
+    carry = [[] for _ in DAYS]
+    for number, line in enumerate(rules.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            day_text, window = line.split()
+            start, end = _parse_window(window)
+            for day in _parse_days(day_text):
+                if end > start:
+                    days[day].append((start, end))
+                else:
+                    days[day].append((start, DAY_MINUTES))
+                    carry[(day + 1) % 7].append((0, end))
+        except ValueError as e:
+            raise ValueError(f"Rule line {number}: {e}") from None
+
+    dates = {}
+    for number, line in enumerate(exceptions.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            day_text, *windows = line.split()
+            day = date.fromisoformat(day_text).isoformat()
+            intervals = dates.setdefault(day, [])
+            for window in windows:
+                start, end = _parse_window(window)
+                if end < start:
+                    raise ValueError(f"window '{window}' passes midnight")
+                intervals.append((start, end))
+        except ValueError as e:
+            raise ValueError(f"Exception line {number}: {e}") from None
+
+    return {
+        "days": [_merge(intervals) for intervals in days],
+        "carry": [_merge(intervals) for intervals in carry],
+        "dates": {day: _merge(intervals) for day, intervals in dates.items()},
+    }
+
+
+class Schedule:
+    """A compiled schedule, as flat start and end arrays per weekday and exception date.
+
+    The dates whose windows differ from their weekday's get their own arrays: the exception
+    dates, with what continues from the day before, and the days after them, without it.
+    """
+
+    def __init__(self, compiled):
+        days = compiled["days"]
+        carry = compiled["carry"]
+        exceptions = compiled["dates"]
+        self.days = [self._table(_merge(days[day] + carry[day])) for day in range(7)]
+        self.dates = {}
+        for text, intervals in exceptions.items():
+            day = date.fromisoformat(text)
+            before = (day - timedelta(days=1)).isoformat()
+            continued = [] if before in exceptions else carry[day.weekday()]
+            self.dates[text] = self._table(_merge(intervals + continued))
+            after = day + timedelta(days=1)
+            if after.isoformat() not in exceptions:
+                self.dates[after.isoformat()] = self._table(days[after.weekday()])
+
+    @staticmethod
+    def _table(intervals):
+        return [start for start, _ in intervals], [end for _, end in intervals]
+
+    def allows(self, when):
+        """Return True if `when` (datetime) is inside an allowed window."""
+        starts, ends = self.dates.get(when.date().isoformat()) or self.days[when.weekday()]
+        minute = when.hour * 60 + when.minute
+        i = bisect_right(starts, minute) - 1
+        return i >= 0 and minute < ends[i]
+
+
+def load_door_schedules(db_file=DBFILE):
+    """Load the compiled schedules of the doors, after any change to schedules or doors.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    """
+    global _door_schedules
+    schedules = {}
+    compiled = {}
+    for door_id, compiled_json, rules, exceptions in get_door_schedules(db_file):
+        if compiled_json not in compiled:
+            tables = json.loads(compiled_json)
+            if "carry" not in tables:
+                # Compiled by an older version, which had no separate carry over
+                tables = compile_schedule(rules, exceptions or "")
+            compiled[compiled_json] = Schedule(tables)
+        schedules[str(door_id)] = compiled[compiled_json]
+    _door_schedules = schedules
+
+
+def door_open_now(door_id, when=None):
+    """Check the schedule of a door.
+
+    ## Parameters:
+    - door_id (int): The ID of the door.
+    - when (datetime): The time to check, in SCHEDULE_TZ, now by default.
+
+    ## Returns:
+    - bool: True if the door has no schedule or `when` is inside one of its windows.
+    """
+    schedule = _door_schedules.get(str(door_id))
+    return schedule is None or schedule.allows(when or datetime.now(_zone))
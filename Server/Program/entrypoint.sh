@@ -6,8 +6,17 @@ LDAPPASS = "${LDAPPASS}"
 LDAP_SERVER = "${LDAP_SERVER}"
 DOOR_ACCESS_GROUPS_DN = "${DOOR_ACCESS_GROUPS_DN}"
 USERS_DN = "${USERS_DN}"
+NESTED_GROUPS_DN = "${NESTED_GROUPS_DN:-${DOOR_ACCESS_GROUPS_DN}}"
+LDAP_SYNC_MODE = "${LDAP_SYNC_MODE:-users}"
 DBFILE = "${DBFILE}"
 WebServerPORT = ${WebServerPORT}
+AccessUDPPORT = ${AccessUDPPORT:-5001}
+DuplicateWINDOW = ${DuplicateWINDOW:-10}
+SlowRequestMS = ${SlowRequestMS:-0}
+ProfileSAMPLE = ${ProfileSAMPLE:-1}
+LogLEVEL = "${LogLEVEL:-INFO}"
+LogLEVELS = "${LogLEVELS}"
+SCHEDULE_TZ = "${SCHEDULE_TZ}"
 EOT
 
 
@@ -0,0 +1,91 @@
+# Transitive closure of nested group membership, computed once per LDAP sync so that an
+# access check stays a single lookup of the user's effective groups.
+#
+# Groups are strongly connected components of the "member of" graph: AD allows cycles
+# (A in B, B in A) and every group of a cycle has the same ancestors. Tarjan's algorithm
+# finds the components in O(groups + memberships) and emits each one after every component
+# it is a member of, so its ancestors are the union of already computed sets. Only the
+# door groups are kept in the sets, which keeps them small on deep hierarchies.
+
+
+def group_closure(parents, keep=None):
+    """Compute every group a group is a member of, directly or through nested groups.
+
+    ## Parameters:
+    - parents (dict): The CNs of the groups each group is a direct member of, by group CN.
+    - keep (set): The only groups to keep in the results, e.g. the door groups. All groups
+      are kept when None.
+
+    ## Returns:
+    - dict: A frozenset of the group itself and all its ancestors, by group CN. Groups of
+      the same cycle share the same set.
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    closure = {}
+    nodes = set(parents)
+    for group_parents in parents.values():
+        nodes.update(group_parents)
+
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(parents.get(root, ())))]
+        while work:
+            node, remaining = work[-1]
+            for parent in remaining:
+                if parent not in index:
+                    index[parent] = low[parent] = len(index)
+                    stack.append(parent)
+                    on_stack.add(parent)
+                    work.append((parent, iter(parents.get(parent, ()))))
+                    break
+                if parent in on_stack:
+                    low[node] = min(low[node], index[parent])
+            else:
+                work.pop()
+                if work:
+                    caller = work[-1][0]
+                    low[caller] = min(low[caller], low[node])
+                if low[node] != index[node]:
+                    continue
+                # `node` is the root of a component, everything above it on the stack is in it
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    members.append(member)
+                    if member == node:
+                        break
+                component = set(members)
+                ancestors = set(component) if keep is None else component & keep
+                for member in members:
+                    for parent in parents.get(member, ()):
+                        if parent not in component:
+                            ancestors |= closure[parent]
+                ancestors = frozenset(ancestors)
+                for member in members:
+                    closure[member] = ancestors
+    return closure
+
+
+def effective_groups(direct, closure, door_groups):
+    """Return the door groups a user is in through its direct groups.
+
+    ## Parameters:
+    - direct (iterable): The CNs of the user's direct groups.
+    - closure (dict): The result of `group_closure`, usually limited to `door_groups`.
+    - door_groups (set): The CNs of the groups doors can be assigned to.
+
+    ## Returns:
+    - list: The sorted CNs of the door groups.
+    """
+    groups = set()
+    for group in direct:
+        groups |= closure.get(group, {group})
+    return sorted(groups & door_groups)
@@ -1,10 +1,30 @@
+import logging
 import sqlite3
 import threading
-from datetime import datetime
+from collections import Counter
 
 import ldap
 import schedule
+from aclSnapshot import publish_snapshot
 from env import DOOR_ACCESS_GROUPS_DN, LDAP_SERVER, LDAPPASS, LDAPUSER, USERS_DN
+from groupClosure import effective_groups, group_closure
+from ldap.filter import escape_filter_chars
+from pageCache import bump_data_version
+
+try:
+    from env import NESTED_GROUPS_DN
+except ImportError:
+    NESTED_GROUPS_DN = DOOR_ACCESS_GROUPS_DN  # Where the groups nested in door groups are
+
+try:
+    from env import LDAP_SYNC_MODE
+except ImportError:
+    LDAP_SYNC_MODE = "users"  # "users": every user of USERS_DN, "groups": door group members
+
+USER_ATTRIBUTES = ["userPrincipalName", "rFIDUID", "userAccountControl"]
+USERS_PER_SEARCH = 100  # Users read by DN in one search of the group sync
+
+log = logging.getLogger(__name__)
 
 
 # Function to initialize LDAP connection
@@ -13,7 +33,7 @@ def initialize_ldap_connection():
 
     This function attempts to establish a connection to the LDAP server using the provided server address,
     user credentials, and settings. If the connection is successful, it returns the connection object.
-    In case of an error, it prints the error and returns None.
+    In case of an error, it logs the error and returns None.
 
     ## Returns:
     - ldap.LDAPObject or None: The LDAP connection object if successful, otherwise None.
@@ -22,10 +42,10 @@ def initialize_ldap_connection():
         connect = ldap.initialize(LDAP_SERVER)
         connect.set_option(ldap.OPT_REFERRALS, 0)
         connect.simple_bind_s(LDAPUSER, LDAPPASS)
-        print(f"[{datetime.now()}] LDAP connection successful.")
+        log.info("LDAP connection successful.")
         return connect
     except ldap.LDAPError as e:
-        print(f"[{datetime.now()}] LDAP Error: {e}")
+        log.error("LDAP Error: %s", e)
         return None
 
 
@@ -52,7 +72,7 @@ def retrieve_users_from_ldap(ldap_connection):
         )
         return result
     except ldap.LDAPError as e:
-        print(f"[{datetime.now()}] LDAP Error: {e}")
+        log.error("LDAP Error: %s", e)
         return []
 
 
@@ -79,12 +99,206 @@ def retrieve_groups_from_ldap(ldap_connection):
         )
         return result
     except ldap.LDAPError as e:
-        print(f"[{datetime.now()}]LDAP Error: {e}")
+        log.error("LDAP Error: %s", e)
+        return []
+
+
+# Function to retrieve the groups that can be nested in door groups
+def retrieve_nested_groups_from_ldap(ldap_connection, door_groups):
+    """Retrieve the groups under NESTED_GROUPS_DN with the groups they are members of.
+
+    ## Parameters:
+    - ldap_connection (ldap.LDAPObject): The LDAP connection object.
+    - door_groups (list): The result of `retrieve_groups_from_ldap`, returned again when
+      NESTED_GROUPS_DN is the door groups DN.
+
+    ## Returns:
+    - list of tuple: (DN, attributes) of each group, an empty list if the search fails.
+    """
+    if NESTED_GROUPS_DN == DOOR_ACCESS_GROUPS_DN:
+        return door_groups
+    try:
+        return ldap_connection.search_s(
+            NESTED_GROUPS_DN,
+            ldap.SCOPE_SUBTREE,
+            "(objectClass=group)",
+            ["cn", "memberOf"],
+        )
+    except ldap.LDAPError as e:
+        log.error("LDAP Error: %s", e)
         return []
 
 
+def dn_to_cn(dn):
+    """Return the CN of a DN, the way group memberships are stored in the database."""
+    return dn.decode("utf-8").split(",")[0].split("=")[1]
+
+
+def group_parents(groups):
+    """Return the groups each group is a direct member of.
+
+    ## Parameters:
+    - groups (list): (DN, attributes) of each group, as returned by LDAP.
+
+    ## Returns:
+    - dict: The list of parent group CNs, by group CN.
+    """
+    parents = {}
+    for dn, group_info in groups:
+        cn = group_info.get("cn", [""])[0].decode("utf-8")
+        parents[cn] = [dn_to_cn(parent) for parent in group_info.get("memberOf", [])]
+    return parents
+
+
+# Function to read a multi-valued attribute that AD returns in ranges
+def retrieve_ranged_attribute(ldap_connection, dn, attribute="member"):
+    """Retrieve every value of a multi-valued attribute with ranged retrieval.
+
+    AD returns at most 1500 values (MaxValRange) of an attribute like `member` per search and
+    names the attribute with the range it returned, e.g. `member;range=0-1499`. The next
+    search asks for `member;range=1500-*`, until the returned range ends with `*`.
+
+    ## Parameters:
+    - ldap_connection (ldap.LDAPObject): The LDAP connection object.
+    - dn (str): The DN of the entry, e.g. a group.
+    - attribute (str): The attribute to read.
+
+    ## Returns:
+    - list: All values of the attribute.
+
+    ## Raises:
+    - ldap.LDAPError: If a search fails, so a partial list is never used.
+    """
+    values = []
+    start = 0
+    prefix = attribute.lower() + ";range="
+    while True:
+        result = ldap_connection.search_s(
+            dn, ldap.SCOPE_BASE, "(objectClass=*)", [f"{attribute};range={start}-*"]
+        )
+        entries = [attributes for entry_dn, attributes in result if entry_dn is not None]
+        if not entries:
+            return values
+        ranged = [name for name in entries[0] if name.lower().startswith(prefix)]
+        if not ranged:
+            # Small attributes may come back without a range
+            values.extend(entries[0].get(attribute, []))
+            return values
+        values.extend(entries[0][ranged[0]])
+        end = ranged[0][len(prefix) :].split("-", 1)[1]
+        if end == "*":
+            return values
+        start = int(end) + 1
+
+
+# Function to read the members of the door groups and of the groups nested in them
+def retrieve_door_group_members(ldap_connection, door_groups, nested_groups):
+    """Read the `member` attribute of the door groups and of the groups nested in them.
+
+    Every group is read once, with ranged retrieval. Members that are groups under
+    NESTED_GROUPS_DN are followed, the other members are taken as users.
+
+    ## Parameters:
+    - ldap_connection (ldap.LDAPObject): The LDAP connection object.
+    - door_groups (list): (DN, attributes) of the door groups.
+    - nested_groups (list): (DN, attributes) of the groups under NESTED_GROUPS_DN.
+
+    ## Returns:
+    - tuple: (user groups, group parents, number of groups read). User groups maps each user
+      DN (lower case) to its DN and the set of CNs of the groups it is a direct member of.
+      Group parents maps each group CN to the CNs of the groups it is a member of.
+
+    ## Raises:
+    - ldap.LDAPError: If a search fails.
+    """
+    group_cns = {}
+    for dn, group_info in list(door_groups) + list(nested_groups):
+        group_cns[dn.lower()] = group_info.get("cn", [""])[0].decode("utf-8")
+
+    user_groups = {}
+    parents = {}
+    todo = [dn for dn, _ in door_groups]
+    seen = {dn.lower() for dn in todo}
+    for group_dn in todo:
+        cn = group_cns[group_dn.lower()]
+        for member in retrieve_ranged_attribute(ldap_connection, group_dn):
+            member = member.decode("utf-8")
+            key = member.lower()
+            if key in group_cns:
+                parents.setdefault(group_cns[key], []).append(cn)
+                if key not in seen:
+                    seen.add(key)
+                    todo.append(member)
+            else:
+                user_groups.setdefault(key, (member, set()))[1].add(cn)
+    return user_groups, parents, len(todo)
+
+
+# Function to read users by DN
+def retrieve_users_by_dn(ldap_connection, dns):
+    """Retrieve the users with the given DNs under USERS_DN.
+
+    The users are read USERS_PER_SEARCH at a time with a filter on their DNs.
+
+    ## Parameters:
+    - ldap_connection (ldap.LDAPObject): The LDAP connection object.
+    - dns (list): The DNs of the users.
+
+    ## Returns:
+    - list of tuple: (DN, attributes) of each user found.
+
+    ## Raises:
+    - ldap.LDAPError: If a search fails.
+    """
+    users = []
+    for i in range(0, len(dns), USERS_PER_SEARCH):
+        batch = "".join(
+            f"(distinguishedName={escape_filter_chars(dn)})"
+            for dn in dns[i : i + USERS_PER_SEARCH]
+        )
+        result = ldap_connection.search_s(
+            USERS_DN,
+            ldap.SCOPE_SUBTREE,
+            f"(&(objectClass=user)(|{batch}))",
+            USER_ATTRIBUTES,
+        )
+        users.extend((dn, user_info) for dn, user_info in result if dn is not None)
+    return users
+
+
+def is_disabled(user_info):
+    """Return True if the user is disabled in LDAP (ADS_UF_ACCOUNTDISABLE flag)."""
+    user_account_control = user_info.get("userAccountControl", [0])[0]
+    return user_account_control == b"514" or user_account_control == b"66050"
+
+
+def remove_disabled_user(conn, cursor, upn):
+    """Remove a user disabled in LDAP from the database if present.
+
+    ## Returns:
+    - bool: True if the user was removed.
+    """
+    cursor.execute("SELECT * FROM Users WHERE upn=?", (upn,))
+    existing_user = cursor.fetchone()
+    if existing_user:
+        cursor.execute("DELETE FROM Users WHERE upn=?", (upn,))
+        conn.commit()
+        log.debug(
+            "User '%s' disabled in LDAP and removed from the database.",
+            upn,
+            extra={"upn": upn},
+        )
+        return True
+    log.debug(
+        "User '%s' disabled in LDAP but not present in the database.",
+        upn,
+        extra={"upn": upn},
+    )
+    return False
+
+
 # Function to add user to the database or update if already exists
-def add_user_to_database(conn, cursor, upn, rfid_uid, member_of):
+def add_user_to_database(conn, cursor, upn, rfid_uid, member_of, effective_member_of=None):
     """Add a user to the database or update the user's information if they already exist.
 
     This function checks if a user with the given UPN (User Principal Name) already exists in the database.
@@ -97,9 +311,11 @@ def add_user_to_database(conn, cursor, upn, rfid_uid, member_of):
     - upn (str): The User Principal Name of the user.
     - rfid_uid (str): The RFID UID associated with the user.
     - member_of (str): The group membership (CN) of the user.
+    - effective_member_of (str): The door groups (CN) the user is in, directly or through
+      nested groups, comma separated.
 
     ## Returns:
-    - None
+    - str: What was done: "added", "updated" or "unchanged", or None on a database error.
 
     ## Raises:
     - sqlite3.Error: If an error occurs while accessing the SQLite database.
@@ -109,27 +325,35 @@ def add_user_to_database(conn, cursor, upn, rfid_uid, member_of):
         existing_user = cursor.fetchone()
         if existing_user:
             # User already exists, check if data needs to be updated
-            if existing_user[1] != rfid_uid or existing_user[2] != member_of:
+            if (
+                existing_user[1] != rfid_uid
+                or existing_user[2] != member_of
+                or existing_user[3] != effective_member_of
+            ):
                 cursor.execute(
-                    "UPDATE Users SET rFIDUID=?, MemberOf=? WHERE upn=?",
-                    (rfid_uid, member_of, upn),
+                    "UPDATE Users SET rFIDUID=?, MemberOf=?, EffectiveMemberOf=? WHERE upn=?",
+                    (rfid_uid, member_of, effective_member_of, upn),
                 )
                 conn.commit()
-                print(f"[{datetime.now()}] User '{upn}' updated in the database.")
-            else:
-                print(
-                    f"[{datetime.now()}] User '{upn}' already exists in the database with the same data.",
-                )
+                log.debug("User '%s' updated in the database.", upn, extra={"upn": upn})
+                return "updated"
+            log.debug(
+                "User '%s' already exists in the database with the same data.",
+                upn,
+                extra={"upn": upn},
+            )
+            return "unchanged"
         else:
             # User doesn't exist, insert new user
             cursor.execute(
-                "INSERT INTO Users (upn, rFIDUID, MemberOf) VALUES (?, ?, ?)",
-                (upn, rfid_uid, member_of),
+                "INSERT INTO Users (upn, rFIDUID, MemberOf, EffectiveMemberOf) VALUES (?, ?, ?, ?)",
+                (upn, rfid_uid, member_of, effective_member_of),
             )
             conn.commit()
-            print(f"[{datetime.now()}] User '{upn}' added to the database.")
+            log.debug("User '%s' added to the database.", upn, extra={"upn": upn})
+            return "added"
     except sqlite3.Error as e:
-        print(f"SQLite Error: {e}")
+        log.error("SQLite Error: %s", e, extra={"upn": upn})
 
 
 # Function to add group to the database or update if already exists
@@ -137,7 +361,7 @@ def add_group_to_database(conn, cursor, cn):
     """Add a group to the database if it does not already exist.
 
     This function checks if a group with the given CN (Common Name) already exists in the database.
-    If the group exists, it prints a message indicating that the group already exists. If the group
+    If the group exists, it logs a message indicating that the group already exists. If the group
     does not exist, it inserts a new record for the group.
 
     Parameters
@@ -148,7 +372,7 @@ def add_group_to_database(conn, cursor, cn):
 
     Returns
     -------
-    None
+    str: What was done: "added" or "unchanged", or None on a database error.
 
     Raises
     ------
@@ -160,14 +384,16 @@ def add_group_to_database(conn, cursor, cn):
         existing_group = cursor.fetchone()
         if existing_group:
             # Group already exists, no need to update
-            print(f"[{datetime.now()}] Group '{cn}' already exists in the database.")
+            log.debug("Group '%s' already exists in the database.", cn, extra={"group": cn})
+            return "unchanged"
         else:
             # Group doesn't exist, insert new group
             cursor.execute("INSERT INTO Groups (cn) VALUES (?)", (cn,))
             conn.commit()
-            print(f"[{datetime.now()}] Group '{cn}' added to the database.")
+            log.debug("Group '%s' added to the database.", cn, extra={"group": cn})
+            return "added"
     except sqlite3.Error as e:
-        print(f"SQLite Error: {e}")
+        log.error("SQLite Error: %s", e, extra={"group": cn})
 
 
 # Function to sync LDAP users and groups to the database
@@ -186,6 +412,11 @@ def sync_ldap_to_database(db_file):
     and synchronizes it with the SQLite database. It checks if users are disabled in
     LDAP and removes them from the database if necessary. It also ensures that users
     and groups are added or updated in the database according to the LDAP information.
+    Nested groups are resolved once per sync: each user gets the door groups it is in
+    through any chain of groups under NESTED_GROUPS_DN. When no door group can be read, the
+    sync stops and leaves the users and the published access rules unchanged.
+
+    With LDAP_SYNC_MODE set to "groups", `sync_ldap_groups_to_database` is used instead.
 
     Note:
     ----
@@ -193,53 +424,167 @@ def sync_ldap_to_database(db_file):
         from the machine running this script.
 
     """
+    if LDAP_SYNC_MODE == "groups":
+        return sync_ldap_groups_to_database(db_file)
+
     ldap_conn = initialize_ldap_connection()
     if ldap_conn:
         conn = sqlite3.connect(db_file)
         cursor = conn.cursor()
+        users_done = Counter()
+        groups_done = Counter()
+
+        # Resolve the nested groups once, users with the same direct groups share the result
+        groups = retrieve_groups_from_ldap(ldap_conn)
+        if not groups:
+            # Without the door groups every user would lose access, keep the last sync
+            log.warning("No door group found in LDAP, users left unchanged.")
+            conn.close()
+            ldap_conn.unbind()
+            return
+        door_groups = {group_info.get("cn", [""])[0].decode("utf-8") for _, group_info in groups}
+        nested_groups = retrieve_nested_groups_from_ldap(ldap_conn, groups)
+        closure = group_closure(group_parents(nested_groups), door_groups)
+        effective = {}
 
         # Retrieve users from LDAP and add them to the database
         users = retrieve_users_from_ldap(ldap_conn)
         for dn, user_info in users:
             upn = user_info.get("userPrincipalName", [""])[0]
             rfid_uid = user_info.get("rFIDUID", [""])[0]
-            member_of = [
-                group.decode("utf-8").split(",")[0].split("=")[1]
-                for group in user_info.get("memberOf", [])
-            ]
+            member_of = [dn_to_cn(group) for group in user_info.get("memberOf", [])]
 
-            # Check if the user is disabled in LDAP
-            user_account_control = user_info.get("userAccountControl", [0])[0]
-            if (
-                user_account_control == b"514" or user_account_control == b"66050"
-            ):  # Check if the 9th bit is set (ADS_UF_ACCOUNTDISABLE flag)
-                # User is disabled, check if user exists in the database and remove if present
-                cursor.execute("SELECT * FROM Users WHERE upn=?", (upn,))
-                existing_user = cursor.fetchone()
-                if existing_user:
-                    cursor.execute("DELETE FROM Users WHERE upn=?", (upn,))
-                    conn.commit()
-                    print(
-                        f"[{datetime.now()}] User '{upn}' disabled in LDAP and removed from the database.",
-                    )
-                else:
-                    print(
-                        f"[{datetime.now()}] User '{upn}' disabled in LDAP but not present in the database.",
-                    )
+            # Check if the user is disabled in LDAP, remove it from the database if present
+            if is_disabled(user_info):
+                if remove_disabled_user(conn, cursor, upn):
+                    users_done["removed"] += 1
                 continue  # Skip adding the disabled user to the database
 
             # User is not disabled, add or update user in the database
-            add_user_to_database(conn, cursor, upn, rfid_uid, ", ".join(member_of))
+            direct = frozenset(member_of)
+            if direct not in effective:
+                effective[direct] = ",".join(effective_groups(direct, closure, door_groups))
+            done = add_user_to_database(
+                conn, cursor, upn, rfid_uid, ", ".join(member_of), effective[direct]
+            )
+            users_done[done or "failed"] += 1
 
-        # Retrieve groups from LDAP and add them to the database
-        groups = retrieve_groups_from_ldap(ldap_conn)
+        # Add the door groups to the database
         for dn, group_info in groups:
             cn = group_info.get("cn", [""])[0].decode("utf-8")
-            add_group_to_database(conn, cursor, cn)
+            groups_done[add_group_to_database(conn, cursor, cn) or "failed"] += 1
+
+        finish_sync(db_file, conn, ldap_conn, users_done, groups_done)
+
+
+def finish_sync(db_file, conn, ldap_conn, users_done, groups_done):
+    """Close the connections of a sync and publish its result.
+
+    ## Parameters:
+    - db_file (str): The path to the SQLite database file.
+    - conn (sqlite3.Connection): The SQLite database connection.
+    - ldap_conn (ldap.LDAPObject): The LDAP connection object.
+    - users_done (Counter): What was done to the users.
+    - groups_done (Counter): What was done to the groups.
+    """
+    # Close connections
+    changed = conn.total_changes
+    conn.close()
+    ldap_conn.unbind()
+    if changed:
+        bump_data_version("users", "groups")
+    log.info(
+        "LDAP sync done: users %s, groups %s.",
+        dict(users_done),
+        dict(groups_done),
+        extra={"users": dict(users_done), "groups": dict(groups_done)},
+    )
+
+    # Publish the new access rules to every server process
+    publish_snapshot(db_file)
+
+
+# Function to sync the members of the door groups to the database
+def sync_ldap_groups_to_database(db_file):
+    """Sync the members of the door groups to the SQLite database.
+
+    Instead of reading every user of USERS_DN and its `memberOf`, which AD truncates on
+    large groups, this reads the `member` attribute of each door group and of the groups
+    nested in them with ranged retrieval, then only the users found there. The cost of a
+    sync scales with the door groups and their members.
+
+    Users that are no longer a member of any door group are removed from the database.
+    Nothing is changed when LDAP fails during the sync or returns no door group.
 
-        # Close connections
-        conn.close()
+    ## Parameters:
+    - db_file (str): The path to the SQLite database file.
+    """
+    ldap_conn = initialize_ldap_connection()
+    if not ldap_conn:
+        return
+    groups = retrieve_groups_from_ldap(ldap_conn)
+    if not groups:
+        log.warning("No door group found in LDAP, users left unchanged.")
         ldap_conn.unbind()
+        return
+    door_groups = {group_info.get("cn", [""])[0].decode("utf-8") for _, group_info in groups}
+    try:
+        user_groups, parents, groups_read = retrieve_door_group_members(
+            ldap_conn, groups, retrieve_nested_groups_from_ldap(ldap_conn, groups)
+        )
+        users = retrieve_users_by_dn(ldap_conn, [dn for dn, _ in user_groups.values()])
+    except ldap.LDAPError as e:
+        log.error("LDAP Error, users left unchanged: %s", e)
+        ldap_conn.unbind()
+        return
+    log.info("Read the members of %s groups, %s users.", groups_read, len(users))
+    closure = group_closure(parents, door_groups)
+    effective = {}
+
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    users_done = Counter()
+    groups_done = Counter()
+    synced = set()
+    for dn, user_info in users:
+        upn = user_info.get("userPrincipalName", [""])[0]
+        rfid_uid = user_info.get("rFIDUID", [""])[0]
+        if is_disabled(user_info):
+            if remove_disabled_user(conn, cursor, upn):
+                users_done["removed"] += 1
+            continue
+
+        member = user_groups.get(dn.lower())
+        if member is None:
+            # LDAP returned the user under another form of the DN found in the groups
+            log.warning(
+                "User '%s' not matched to a group member, left unchanged.", dn, extra={"upn": upn}
+            )
+            synced.add(upn)
+            continue
+        direct = frozenset(member[1])
+        if direct not in effective:
+            effective[direct] = ",".join(effective_groups(direct, closure, door_groups))
+        done = add_user_to_database(
+            conn, cursor, upn, rfid_uid, ", ".join(sorted(direct)), effective[direct]
+        )
+        users_done[done or "failed"] += 1
+        synced.add(upn)
+
+    # Users left every door group since the last sync
+    cursor.execute("SELECT upn FROM Users")
+    for (upn,) in cursor.fetchall():
+        if upn not in synced:
+            cursor.execute("DELETE FROM Users WHERE upn=?", (upn,))
+            users_done["removed"] += 1
+            log.debug("User '%s' in no door group, removed from the database.", upn, extra={"upn": upn})
+    conn.commit()
+
+    for dn, group_info in groups:
+        cn = group_info.get("cn", [""])[0].decode("utf-8")
+        groups_done[add_group_to_database(conn, cursor, cn) or "failed"] += 1
+
+    finish_sync(db_file, conn, ldap_conn, users_done, groups_done)
 
 
 def run_sync_ldap_to_database_thread(db_file):
@@ -258,7 +603,7 @@ def run_sync_ldap_to_database_thread(db_file):
     None
 
     """
-    print(f"[{datetime.now()}] Running LDAP sync")
+    log.info("Running LDAP sync")
     threading.Thread(target=sync_ldap_to_database, args=(db_file,), daemon=True).start()
 
 
@@ -0,0 +1,207 @@
+import argparse
+import sqlite3
+import sys
+from datetime import date, timedelta
+
+from env import DBFILE
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Columnar export of the access logs, as Parquet or Arrow IPC, from /export_logs/<format>
+# or the command line:
+#
+#   python logExport.py -o logs.parquet [--format arrow] [--since 2026-01-01] [--until 2026-01-31] [--door 3]
+#
+# The log table is read in batches of BATCH_ROWS rows by increasing id and each batch is
+# written as one Parquet row group or Arrow record batch, so memory stays bounded whatever
+# the size of the table. Needs pyarrow, the export is unavailable without it.
+BATCH_ROWS = 65536
+FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", "arrow"),
+}
+
+if pa is not None:
+    SCHEMA = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("timestamp", pa.timestamp("us")),
+            ("user", pa.string()),
+            ("rfid_uid", pa.string()),
+            ("door_id", pa.int64()),
+            ("granted", pa.bool_()),
+            ("repeat_count", pa.int32()),
+            ("last_seen", pa.timestamp("us")),
+        ]
+    )
+
+
+def export_available():
+    """Return True when pyarrow is installed."""
+    return pa is not None
+
+
+def _text(value):
+    # UPNs may be stored as bytes
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return None if value is None else str(value)
+
+
+def _timestamps(values):
+    # Timestamps are stored as str(datetime), "YYYY-MM-DD HH:MM:SS[.ffffff]"
+    return pa.array(values, pa.string()).cast(pa.timestamp("us"))
+
+
+def iter_log_batches(db_file=DBFILE, since=None, until=None, door_id=None, batch_rows=BATCH_ROWS):
+    """Read the log table as Arrow record batches, oldest first.
+
+    ## Parameters:
+    - db_file (str): The file path to the SQLite database.
+    - since (date): Only logs from this day on.
+    - until (date): Only logs before this day.
+    - door_id (int): Only logs of this door.
+    - batch_rows (int): The maximum number of rows per batch.
+
+    ## Returns:
+    - generator: pyarrow.RecordBatch objects following SCHEMA.
+    """
+    conditions = ["id > ?"]
+    filters = []
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        filters.append(since.isoformat())
+    if until is not None:
+        conditions.append("timestamp < ?")
+        filters.append(until.isoformat())
+    if door_id is not None:
+        conditions.append("door_id = ?")
+        filters.append(door_id)
+    query = (
+        "SELECT id, timestamp, user, rFIDUID, door_id, granted, repeat_count, last_seen FROM log "
+        f"WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+    )
+
+    conn = sqlite3.connect(db_file)
+    try:
+        last_id = 0
+        while True:
+            rows = conn.execute(query, [last_id] + filters + [batch_rows]).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            ids, timestamps, users, uids, doors, granted, repeats, last_seen = zip(*rows)
+            yield pa.record_batch(
+                [
+                    pa.array(ids, pa.int64()),
+                    _timestamps(timestamps),
+                    pa.array([_text(user) for user in users], pa.string()),
+                    pa.array([_text(uid) for uid in uids], pa.string()),
+                    pa.array([None if door is None else int(door) for door in doors], pa.int64()),
+                    pa.array([None if g is None else bool(g) for g in granted], pa.bool_()),
+                    pa.array(repeats, pa.int32()),
+                    _timestamps(last_seen),
+                ],
+                schema=SCHEMA,
+            )
+    finally:
+        conn.close()
+
+
+class _ChunkSink:
+    # Write-only file collecting what pyarrow writes until it is taken
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _writer(sink, fmt):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, SCHEMA, compression="snappy")
+    return pa.ipc.new_file(sink, SCHEMA)
+
+
+def stream_logs(fmt="parquet", **filters):
+    """Yield the export file in chunks, one per batch, for a streamed HTTP response.
+
+    ## Parameters:
+    - fmt (str): "parquet" or "arrow".
+    - filters: The filters of `iter_log_batches`.
+
+    ## Returns:
+    - generator: bytes.
+    """
+    sink = _ChunkSink()
+    writer = _writer(pa.PythonFile(sink, mode="w"), fmt)
+    for batch in iter_log_batches(**filters):
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def export_logs(path, fmt="parquet", **filters):
+    """Write the export file to `path`.
+
+    ## Parameters:
+    - path (str): The output file.
+    - fmt (str): "parquet" or "arrow".
+    - filters: The filters of `iter_log_batches`.
+
+    ## Returns:
+    - int: The number of rows written.
+    """
+    rows = 0
+    with pa.OSFile(path, "wb") as sink:
+        writer = _writer(sink, fmt)
+        for batch in iter_log_batches(**filters):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+        writer.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the access logs as Parquet or Arrow IPC.")
+    parser.add_argument("-o", "--output", required=True, help="output file")
+    parser.add_argument("--format", choices=sorted(FORMATS), default="parquet")
+    parser.add_argument("--db", default=DBFILE, help="SQLite database (default: DBFILE)")
+    parser.add_argument("--since", type=date.fromisoformat, help="first day, YYYY-MM-DD")
+    parser.add_argument("--until", type=date.fromisoformat, help="last day, YYYY-MM-DD")
+    parser.add_argument("--door", type=int, help="only this door")
+    args = parser.parse_args()
+    if not export_available():
+        sys.exit("pyarrow is not installed: pip install pyarrow")
+
+    rows = export_logs(
+        args.output,
+        args.format,
+        db_file=args.db,
+        since=args.since,
+        until=args.until + timedelta(days=1) if args.until else None,
+        door_id=args.door,
+    )
+    print(f"{rows} log rows written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# Version counters of the data shown on the dashboard pages. Every write path bumps the
+# tables it changed, the pages build their ETag from the versions they depend on and
+# cache their rendered fragments under the same versions.
+BOOT_ID = "%x" % int(time.time() * 1000)  # Versions restart at 0 with the server
+CACHE_SIZE = 32
+
+_versions = {"users": 0, "groups": 0, "doors": 0, "logs": 0}
+_versions_lock = Lock()
+_fragments = OrderedDict()
+_fragments_lock = Lock()
+
+
+def bump_data_version(*tables):
+    """Record that tables changed.
+
+    ## Parameters:
+    - tables (str): The changed tables: "users", "groups", "doors" or "logs".
+    """
+    with _versions_lock:
+        for table in tables:
+            _versions[table] += 1
+
+
+def data_version(*tables):
+    """Return a version string that changes whenever one of the tables changes.
+
+    ## Parameters:
+    - tables (str): The tables a page depends on.
+
+    ## Returns:
+    - str: The version, usable as an ETag.
+    """
+    with _versions_lock:
+        return "-".join([BOOT_ID] + [str(_versions[table]) for table in tables])
+
+
+def cached_fragment(key, build):
+    """Return a cached page fragment, building it on a miss.
+
+    The least recently used fragments are evicted past CACHE_SIZE entries. Keys include the
+    data version, so outdated fragments are never returned and simply age out.
+
+    ## Parameters:
+    - key (tuple): The fragment name and the data version it was built from.
+    - build (callable): Builds the fragment.
+
+    ## Returns:
+    - The cached or newly built fragment.
+    """
+    with _fragments_lock:
+        if key in _fragments:
+            _fragments.move_to_end(key)
+            return _fragments[key]
+    fragment = build()
+    with _fragments_lock:
+        _fragments[key] = fragment
+        while len(_fragments) > CACHE_SIZE:
+            _fragments.popitem(last=False)
+    return fragment
@@ -0,0 +1,161 @@
+import cProfile
+import itertools
+import logging
+import os
+import pstats
+import time
+from collections import deque
+from datetime import datetime
+from threading import Lock
+
+from env import DBFILE
+
+log = logging.getLogger(__name__)
+
+try:
+    from env import SlowRequestMS
+except ImportError:
+    SlowRequestMS = 0  # Profiling off
+
+try:
+    from env import ProfileSAMPLE
+except ImportError:
+    ProfileSAMPLE = 1  # Profile one request in ProfileSAMPLE
+
+# Requests slower than SlowRequestMS are listed on the Profiles page. The profiled ones
+# also get their pstats file written to PROFILE_DIR, open it with
+# `python -m pstats <file>` or snakeviz. Only the last MAX_PROFILES files are kept.
+PROFILE_DIR = os.path.join(os.path.dirname(DBFILE), "profiles")
+MAX_PROFILES = 50
+TOP_FUNCTIONS = 10
+
+_slow_requests = deque(maxlen=MAX_PROFILES)
+_slow_lock = Lock()
+# cProfile can only profile one request at a time, concurrent requests are timed only
+_profile_lock = Lock()
+_counter = itertools.count()
+
+
+def profiling_enabled():
+    """Return True when slow requests are recorded."""
+    return SlowRequestMS > 0
+
+
+def top_functions(profile, limit=TOP_FUNCTIONS):
+    """Return the functions a profiled request spent the most time in.
+
+    ## Parameters:
+    - profile (cProfile.Profile): The profile of the request.
+    - limit (int): The number of functions to return.
+
+    ## Returns:
+    - list: (function, calls, own time in ms, cumulative time in ms) tuples, by own time.
+    """
+    stats = pstats.Stats(profile).stats
+    functions = sorted(stats.items(), key=lambda item: -item[1][2])[:limit]
+    return [
+        (f"{os.path.basename(filename)}:{line}({name})", calls, own * 1000, cumulative * 1000)
+        for (filename, line, name), (_, calls, own, cumulative, _) in functions
+    ]
+
+
+def _rotate_profiles():
+    # Keep the newest MAX_PROFILES files
+    files = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".prof"))
+    for name in files[:-MAX_PROFILES]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except OSError:
+            pass
+
+
+def record_slow_request(method, path, status, duration, profile=None):
+    """Record a request slower than SlowRequestMS.
+
+    ## Parameters:
+    - method (str): The HTTP method.
+    - path (str): The requested path.
+    - status (str): The response status, or None if the request raised.
+    - duration (float): The time spent in the application, in milliseconds.
+    - profile (cProfile.Profile): The profile of the request, if it was profiled.
+    """
+    now = datetime.now()
+    request = {
+        "time": now.strftime("%Y-%m-%d %H:%M:%S"),
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration": duration,
+        "file": None,
+        "top": [],
+    }
+    if profile is not None:
+        request["top"] = top_functions(profile)
+        name = f"{now:%Y%m%d-%H%M%S-%f}-{method}{path.replace('/', '_')}.prof"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profile.dump_stats(os.path.join(PROFILE_DIR, name))
+            _rotate_profiles()
+            request["file"] = name
+        except OSError as e:
+            log.error("Failed to write profile %s: %s", name, e)
+    with _slow_lock:
+        _slow_requests.appendleft(request)
+
+
+def slow_requests():
+    """Return the recent slow requests, newest first."""
+    with _slow_lock:
+        return list(_slow_requests)
+
+
+class ProfilingMiddleware:
+    """WSGI middleware timing every request and profiling one in ProfileSAMPLE.
+
+    The time of a streamed response only covers the call of the application, not the
+    stream itself.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        profile = None
+        if next(_counter) % ProfileSAMPLE == 0 and _profile_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            profile.enable()
+        status = []
+
+        def record_status(status_line, headers, exc_info=None):
+            status.append(status_line)
+            return start_response(status_line, headers, exc_info)
+
+        start = time.perf_counter()
+        try:
+            return self.wsgi_app(environ, record_status)
+        finally:
+            duration = (time.perf_counter() - start) * 1000
+            if profile is not None:
+                profile.disable()
+                _profile_lock.release()
+            if duration >= SlowRequestMS:
+                record_slow_request(
+                    environ.get("REQUEST_METHOD"),
+                    environ.get("PATH_INFO", ""),
+                    status[-1] if status else None,
+                    duration,
+                    profile,
+                )
+
+
+def install_profiling(app):
+    """Wrap a Flask application with the profiling middleware when SlowRequestMS is set.
+
+    With profiling off the application is left untouched, so it costs nothing.
+
+    ## Parameters:
+    - app (flask.Flask): The application.
+    """
+    if profiling_enabled():
+        log.info("PROFILING REQUESTS SLOWER THAN %s ms", SlowRequestMS)
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app)
@@ -0,0 +1,82 @@
+import time
+from datetime import datetime
+from threading import Lock
+
+# A reader is shown as offline when it missed this many seconds of heartbeats
+# (the firmware sends one every 60 seconds)
+READER_TIMEOUT = 180
+
+_readers = {}
+_readers_lock = Lock()
+_version = 0  # Bumped when a reader appears, reboots or changes firmware or address
+
+
+def record_heartbeat(door_id, firmware=None, uptime=None, mem_free=None, mem_low=None, ip=None):
+    """Record a heartbeat sent by a reader.
+
+    The registry is kept in memory only, so health checks never touch the database.
+
+    ## Parameters:
+    - door_id (str): The door the reader is installed on.
+    - firmware (str): The firmware version reported by the reader.
+    - uptime (int): Seconds since the reader booted.
+    - mem_free (int): Free heap on the reader, in bytes.
+    - mem_low (int): Lowest free heap seen on the reader since boot, in bytes.
+    - ip (str): The address the heartbeat came from.
+    """
+    global _version
+    with _readers_lock:
+        previous = _readers.get(str(door_id))
+        if (
+            previous is None
+            or previous["firmware"] != firmware
+            or previous["ip"] != ip
+            or (uptime or 0) < (previous["uptime"] or 0)  # Rebooted
+        ):
+            _version += 1
+        _readers[str(door_id)] = {
+            "door_id": str(door_id),
+            "firmware": firmware,
+            "uptime": uptime,
+            "mem_free": mem_free,
+            "mem_low": mem_low,
+            "ip": ip,
+            "last_seen": time.time(),
+        }
+
+
+def registry_version():
+    """Return a counter that changes when a reader appears, reboots or changes firmware or address.
+
+    Heartbeats that only update the uptime, memory and last seen time leave it unchanged, so
+    pages cached on it stay valid while readers keep reporting.
+    """
+    with _readers_lock:
+        return _version
+
+
+def get_readers(door_ids=()):
+    """Return the known readers with their online status.
+
+    ## Parameters:
+    - door_ids (iterable): Doors configured in the database. Doors that never sent a
+      heartbeat are listed as offline.
+
+    ## Returns:
+    - list: One dict per reader, sorted by door id, with "online" set to False when the
+      last heartbeat is older than READER_TIMEOUT.
+    """
+    now = time.time()
+    with _readers_lock:
+        readers = {door_id: dict(reader) for door_id, reader in _readers.items()}
+    for door_id in door_ids:
+        readers.setdefault(str(door_id), {"door_id": str(door_id), "last_seen": None})
+    for reader in readers.values():
+        last_seen = reader["last_seen"]
+        reader["online"] = last_seen is not None and now - last_seen <= READER_TIMEOUT
+        reader["last_seen_text"] = (
+            datetime.fromtimestamp(last_seen).strftime("%Y-%m-%d %H:%M:%S")
+            if last_seen is not None
+            else "Never"
+        )
+    return sorted(readers.values(), key=lambda reader: reader["door_id"])
@@ -1,12 +1,27 @@
 import schedule
-from database import setup_database
+from accessDecision import flush_repeats
+from accessEvents import RECENT_EVENTS, load_recent_events
+from accessProtocol import run_access_udp_thread
+from aclSnapshot import publish_snapshot
+from admission import log_admission_summary
+from database import get_latest_logs, setup_database
+from doorSchedules import load_door_schedules
 from env import DBFILE
 from ldapSync import schedule_sync_ldap_to_database
+from serverLog import log_dropped_records, setup_logging
 from Webserver import run_webServer_thread
 
+setup_logging()
 setup_database(DBFILE)
+publish_snapshot(DBFILE)
+load_door_schedules(DBFILE)
+load_recent_events(get_latest_logs(DBFILE, RECENT_EVENTS))
 run_webServer_thread()
+run_access_udp_thread()
 schedule_sync_ldap_to_database(DBFILE)
+schedule.every(1).minutes.do(log_admission_summary)
+schedule.every(1).minutes.do(log_dropped_records)
+schedule.every(5).seconds.do(flush_repeats)
 
 while True:
     schedule.run_pending()
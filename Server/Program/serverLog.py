@@ -0,0 +1,128 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime
+from threading import Lock
+
+try:
+    from env import LogLEVEL
+except ImportError:
+    LogLEVEL = "INFO"
+
+try:
+    from env import LogLEVELS
+except ImportError:
+    LogLEVELS = ""  # Levels per subsystem, e.g. "ldapSync=DEBUG,werkzeug=WARNING"
+
+# Every module logs to `logging.getLogger(__name__)`, so a subsystem is a module name.
+# Records go through a bounded queue to a single thread writing JSON lines to stdout:
+# logging never waits on stdout, and when the queue is full records are dropped.
+QUEUE_SIZE = 10000
+
+# Attributes of every LogRecord, anything else was passed with `extra` and is a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message"}
+
+_listener = None
+_dropped_lock = Lock()
+dropped_records = 0  # Records dropped because the queue was full, since startup
+_reported_drops = 0  # dropped_records at the last report
+
+
+def _json_value(value):
+    # UPNs and UIDs from LDAP are bytes
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return str(value)
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as one JSON object, with its `extra` fields (door_id, rfid_uid, upn...)."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=_json_value)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full."""
+
+    def enqueue(self, record):
+        global dropped_records
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _dropped_lock:
+                dropped_records += 1
+
+
+def parse_levels(levels):
+    """Parse the per subsystem levels setting.
+
+    ## Parameters:
+    - levels (str): Comma separated "logger=LEVEL" pairs.
+
+    ## Returns:
+    - dict: The level name of each logger.
+    """
+    parsed = {}
+    for item in levels.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+
+def setup_logging(stream=sys.stdout):
+    """Send the server logs as JSON lines to `stream` from a background thread.
+
+    Call it once at startup, before anything logs. Later calls do nothing.
+
+    ## Parameters:
+    - stream (file): Where the records are written.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    records = queue.Queue(QUEUE_SIZE)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    root = logging.getLogger()
+    root.handlers[:] = [DroppingQueueHandler(records)]
+    root.setLevel(LogLEVEL.upper())
+    for name, level in parse_levels(LogLEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def log_dropped_records():
+    """Log how many records were dropped since the last call, if any.
+
+    Scheduled every minute: by then the queue has drained, so this warning gets through.
+    """
+    global _reported_drops
+    with _dropped_lock:
+        dropped = dropped_records - _reported_drops
+        _reported_drops = dropped_records
+    if dropped:
+        logging.getLogger(__name__).warning(
+            "Log queue full, %s records dropped (%s since startup)",
+            dropped,
+            _reported_drops,
+            extra={"dropped": dropped, "dropped_total": _reported_drops},
+        )
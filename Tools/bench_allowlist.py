@@ -0,0 +1,87 @@
+"""Host-side harness for the reader allow-list (Client/allowlist.py).
+
+Builds an allow-list file with 50k random UIDs, then measures lookup and
+update speed and the heap used while doing so. Run it with CPython from the
+repository root:
+
+    python Tools/bench_allowlist.py [--uids 50000] [--lookups 20000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Client"))
+
+import allowlist  # noqa: E402
+
+
+def random_uids(count, seed):
+    """Generate `count` unique 4 and 7 byte UIDs."""
+    rng = random.Random(seed)
+    uids = set()
+    while len(uids) < count:
+        size = 4 if rng.random() < 0.8 else 7
+        uids.add(bytes(rng.randrange(256) for _ in range(size)))
+    return list(uids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--uids", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    uids = random_uids(args.uids + args.updates, args.seed)
+    stored, extra = uids[: args.uids], uids[args.uids :]
+    path = os.path.join(tempfile.mkdtemp(), "allow.bin")
+
+    start = time.perf_counter()
+    allowlist.build(path, sorted(bytes(allowlist.encode_uid(u)) for u in stored))
+    print(f"build: {time.perf_counter() - start:.3f}s, {os.path.getsize(path)} bytes")
+
+    acl = allowlist.AllowList(path)
+    rng = random.Random(args.seed + 1)
+    probes = [rng.choice(stored) for _ in range(args.lookups // 2)]
+    probes += [bytes(rng.randrange(256) for _ in range(4)) for _ in range(args.lookups // 2)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    hits = sum(1 for uid in probes if acl.contains(uid))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"lookup: {elapsed / len(probes) * 1e6:.1f} us/op over {len(probes)} "
+        f"({hits} hits), peak heap {peak} bytes"
+    )
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    acl.apply(inserts=extra, deletes=stored[: args.updates])
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"update: {elapsed / (2 * args.updates) * 1e6:.1f} us/op, "
+        f"peak heap {peak} bytes, {acl.blocks} blocks"
+    )
+
+    missing = [u for u in extra if not acl.contains(u)]
+    revoked = [u for u in stored[: args.updates] if acl.contains(u)]
+    acl.close()
+    if missing or revoked:
+        print(f"FAILED: {len(missing)} inserts missing, {len(revoked)} deletes present")
+        return 1
+    print("ok")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
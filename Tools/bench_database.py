@@ -0,0 +1,318 @@
+"""Micro-benchmarks of the database query layer (Server/Program/database.py).
+
+Times check_access, log_access_attempt, get_logs, get_latest_logs, get_users, get_doors
+and add_door_to_database on one database grown through increasing sizes of the log and
+Users tables, and records the query plan (EXPLAIN QUERY PLAN) of every statement they run,
+so a missing index shows up as a SCAN next to the time. Run it with CPython from the
+repository root:
+
+    python Tools/bench_database.py [--logs 1000,100000,1000000] [--users 1000,100000]
+    python Tools/bench_database.py --logs 1000,1000000,10000000 --users 1000,100000,500000 --json run.json
+    python Tools/bench_database.py --json new.json --compare run.json   # after a change
+
+The log functions are timed at every log size, with the first number of users, and the
+user functions at every user size. Each function runs until --budget seconds are spent
+(at least once) and the median and minimum time of a call are reported. get_logs returns
+the whole table, it is skipped above --max-get-logs rows to keep the benchmark in memory.
+With --compare, calls more than 1.5 times slower than in the earlier run and changed query
+plans are flagged.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import types
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server", "Program"))
+
+CHUNK_ROWS = 100000  # Rows inserted per transaction while generating data
+SLOWER = 1.5  # Ratio flagged by --compare
+
+
+def install_env(db_file):
+    """Import database.py with a benchmark env module."""
+    env = types.ModuleType("env")
+    env.DBFILE = db_file
+    sys.modules["env"] = env
+
+    import database
+
+    return database
+
+
+class Dataset:
+    """The benchmark database, grown table by table to the requested sizes."""
+
+    def __init__(self, db_file, groups, doors, seed):
+        self.db_file = db_file
+        self.rng = random.Random(seed)
+        self.groups = [f"Group{i:04d}" for i in range(groups)]
+        self.doors = list(range(1, doors + 1))
+        self.tags = []
+        self.log_rows = 0
+        self.timestamp = datetime(2024, 1, 1)
+
+        conn = sqlite3.connect(db_file)
+        conn.executemany("INSERT INTO Groups (cn) VALUES (?)", [(cn,) for cn in self.groups])
+        conn.executemany(
+            "INSERT INTO Doors (id, GroupCn) VALUES (?, ?)",
+            [(door, self.groups[door % groups]) for door in self.doors],
+        )
+        conn.commit()
+        conn.close()
+
+    def _insert(self, query, rows, count):
+        conn = sqlite3.connect(self.db_file)
+        for start in range(0, count, CHUNK_ROWS):
+            conn.executemany(query, (next(rows) for _ in range(min(CHUNK_ROWS, count - start))))
+            conn.commit()
+        conn.close()
+
+    def grow_users(self, size):
+        """Add users up to `size`, stored like the LDAP sync does (UPN and UID as bytes)."""
+        rng = self.rng
+
+        def rows():
+            while True:
+                i = len(self.tags)
+                tag = "%08X" % rng.getrandbits(32)
+                self.tags.append(tag)
+                direct = sorted(rng.sample(self.groups, rng.randint(1, 3)))
+                yield (b"user%07d@bench.local" % i, tag.encode(), ", ".join(direct), ",".join(direct))
+
+        self._insert(
+            "INSERT INTO Users (upn, rFIDUID, MemberOf, EffectiveMemberOf) VALUES (?, ?, ?, ?)",
+            rows(),
+            size - len(self.tags),
+        )
+
+    def grow_logs(self, size):
+        """Add log rows up to `size`, a few seconds apart, 90% of them granted."""
+        rng = self.rng
+
+        def rows():
+            while True:
+                self.timestamp += timedelta(seconds=rng.randint(1, 20))
+                granted = rng.random() < 0.9
+                i = rng.randrange(len(self.tags))
+                user = f"user{i:07d}@bench.local" if granted else None
+                yield (str(self.timestamp), user, self.tags[i], rng.choice(self.doors), granted)
+
+        self._insert(
+            "INSERT INTO log (timestamp, user, rFIDUID, door_id, granted) VALUES (?, ?, ?, ?, ?)",
+            rows(),
+            size - self.log_rows,
+        )
+        self.log_rows = size
+
+
+def time_calls(call, budget, max_runs=10000):
+    """Run `call` until `budget` seconds are spent and return the time of each call."""
+    times = []
+    started = time.perf_counter()
+    while not times or (time.perf_counter() - started < budget and len(times) < max_runs):
+        start = time.perf_counter()
+        call()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def query_plans(database, call):
+    """Run `call` once and return the query plan of each statement it executes."""
+    statements = []
+    traced = types.ModuleType("sqlite3")
+    traced.__dict__.update(vars(sqlite3))
+
+    def connect(*args, **kwargs):
+        conn = sqlite3.connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    traced.connect = connect
+    database.sqlite3 = traced
+    try:
+        call()
+    finally:
+        database.sqlite3 = sqlite3
+
+    plans = []
+    conn = sqlite3.connect(database.DBFILE)
+    for statement in statements:
+        sql = " ".join(statement.split())
+        if sql.split(" ", 1)[0].upper() not in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+            continue
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        plans.append({"sql": sql, "plan": plan})
+    conn.close()
+    return plans
+
+
+def plan_summary(plans):
+    return " | ".join("; ".join(entry["plan"]) for entry in plans if entry["plan"]) or "-"
+
+
+class Runner:
+    """Benchmark the functions and collect the results."""
+
+    def __init__(self, database, dataset, args):
+        self.database = database
+        self.dataset = dataset
+        self.args = args
+        self.rng = random.Random(args.seed + 1)
+        self.results = []
+        self.next_door = 1000000
+
+    def run(self, name, table, rows, call):
+        times = time_calls(call, self.args.budget)
+        plans = query_plans(self.database, call)
+        result = {
+            "function": name,
+            "table": table,
+            "rows": rows,
+            "median_ms": statistics.median(times) * 1000,
+            "min_ms": min(times) * 1000,
+            "runs": len(times),
+            "plans": plans,
+        }
+        self.results.append(result)
+        print(
+            f"  {name:22} {rows:9} {result['median_ms']:10.3f} {result['min_ms']:10.3f} {len(times):6}  "
+            f"{plan_summary(plans)}"
+        )
+
+    def skip(self, name, rows, reason):
+        print(f"  {name:22} {rows:9} {'skipped':>10} {'':10} {'':6}  {reason}")
+
+    def bench_logs(self, rows):
+        database = self.database
+        db_file = self.dataset.db_file
+        if rows <= self.args.max_get_logs:
+            self.run("get_logs", "log", rows, database.get_logs)
+        else:
+            self.skip("get_logs", rows, f"whole table above --max-get-logs {self.args.max_get_logs}")
+        self.run("get_latest_logs", "log", rows, lambda: database.get_latest_logs(db_file, 10))
+        self.run("get_latest_logs(200)", "log", rows, lambda: database.get_latest_logs(db_file, 200))
+
+        tags = self.dataset.tags
+        doors = self.dataset.doors
+        rng = self.rng
+
+        def log_one():
+            database.log_access_attempt(db_file, "user@bench.local", rng.choice(tags), True, rng.choice(doors))
+
+        self.run("log_access_attempt", "log", rows, log_one)
+
+    def bench_users(self, rows):
+        database = self.database
+        tags = self.dataset.tags
+        doors = self.dataset.doors
+        rng = self.rng
+        unknown = ["%010X" % rng.getrandbits(40) for _ in range(1000)]  # Users have 8 digits
+        self.run("check_access", "Users", rows, lambda: database.check_access(rng.choice(tags), rng.choice(doors)))
+        self.run("check_access(unknown)", "Users", rows, lambda: database.check_access(rng.choice(unknown), 1))
+        self.run("get_users", "Users", rows, database.get_users)
+
+    def bench_doors(self):
+        database = self.database
+        db_file = self.dataset.db_file
+        doors = len(self.dataset.doors)
+        group = self.dataset.groups[0]
+
+        def add_door():
+            self.next_door += 1
+            database.add_door_to_database(db_file, group, self.next_door)
+
+        self.run("get_doors", "Doors", doors, database.get_doors)
+        self.run("add_door_to_database", "Doors", doors, add_door)
+        conn = sqlite3.connect(db_file)
+        conn.execute("DELETE FROM Doors WHERE id > 1000000")
+        conn.commit()
+        conn.close()
+
+
+def compare(results, path):
+    """Print the calls slower than in the results of an earlier run, and changed plans."""
+    with open(path) as f:
+        earlier = {(r["function"], r["rows"]): r for r in json.load(f)["results"]}
+    print(f"\nCompared with {path} (median, flagged when {SLOWER}x slower or the plan changed):")
+    for result in results:
+        before = earlier.get((result["function"], result["rows"]))
+        if before is None:
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else 1.0
+        flags = []
+        if ratio > SLOWER:
+            flags.append("SLOWER")
+        if [p["plan"] for p in result["plans"]] != [p["plan"] for p in before["plans"]]:
+            flags.append(f"PLAN was {plan_summary(before['plans'])}")
+        print(
+            f"  {result['function']:22} {result['rows']:9} {before['median_ms']:10.3f} -> "
+            f"{result['median_ms']:10.3f} ms  x{ratio:5.2f}  {' '.join(flags)}"
+        )
+
+
+def sizes(text):
+    return sorted(int(size) for size in text.split(","))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logs", type=sizes, default="1000,100000,1000000", help="log table sizes")
+    parser.add_argument("--users", type=sizes, default="1000,100000", help="Users table sizes")
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--doors", type=int, default=100)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds spent per function and size")
+    parser.add_argument("--max-get-logs", type=int, default=1000000, help="largest log table get_logs reads")
+    parser.add_argument("--db-dir", help="directory of the database (default: a temporary directory)")
+    parser.add_argument("--json", help="write the timings and plans to this file")
+    parser.add_argument("--compare", help="flag regressions against an earlier --json file")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_database_", dir=args.db_dir)
+    try:
+        db_file = os.path.join(work_dir, "data.db")
+        database = install_env(db_file)
+        database.setup_database(db_file)
+        dataset = Dataset(db_file, args.groups, args.doors, args.seed)
+        runner = Runner(database, dataset, args)
+        print(f"SQLite {sqlite3.sqlite_version}, database in {work_dir}")
+        print(f"  {'function':22} {'rows':>9} {'median ms':>10} {'min ms':>10} {'runs':>6}  query plan")
+
+        dataset.grow_users(args.users[0])
+        for rows in args.logs:
+            dataset.grow_logs(rows)
+            runner.bench_logs(rows)
+        for rows in args.users:
+            dataset.grow_users(rows)
+            runner.bench_users(rows)
+        runner.bench_doors()
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(
+                    {
+                        "sqlite_version": sqlite3.sqlite_version,
+                        "python": sys.version.split()[0],
+                        "date": datetime.now().isoformat(timespec="seconds"),
+                        "results": runner.results,
+                    },
+                    f,
+                    indent=1,
+                )
+        if args.compare:
+            compare(runner.results, args.compare)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
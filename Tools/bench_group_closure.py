@@ -0,0 +1,125 @@
+"""Benchmark of the nested group closure computed by the LDAP sync (Server/Program/groupClosure.py).
+
+Builds synthetic group graphs, computes their closure limited to the door groups like the
+sync does, then the effective door groups of random users, and compares with a
+breadth-first search per group. Run it with CPython from the repository root:
+
+    python Tools/bench_group_closure.py [--depth 2000] [--fanout 8] [--levels 5] [--users 20000]
+
+Shapes:
+  deep    one chain of `depth` groups, a door group at the top
+  wide    a tree of `levels` levels with `fanout` children per group, door groups at the
+          top two levels
+  cycles  the wide tree with one back edge per 50 groups, as AD allows
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server", "Program"))
+
+from groupClosure import effective_groups, group_closure  # noqa: E402
+
+
+def deep_graph(depth):
+    """A single chain g0 -> g1 -> ... -> g{depth-1}, the last one is the door group."""
+    parents = {f"g{i}": [f"g{i + 1}"] for i in range(depth - 1)}
+    parents[f"g{depth - 1}"] = []
+    return parents, {f"g{depth - 1}"}
+
+
+def wide_graph(fanout, levels):
+    """A tree where every group has `fanout` children, door groups are the top two levels."""
+    parents = {"g": []}
+    level = ["g"]
+    door_groups = {"g"}
+    for depth in range(1, levels):
+        children = []
+        for parent in level:
+            for i in range(fanout):
+                child = f"{parent}.{i}"
+                parents[child] = [parent]
+                children.append(child)
+        if depth == 1:
+            door_groups.update(children)
+        level = children
+    return parents, door_groups
+
+
+def add_cycles(parents, every, seed):
+    """Make one group in `every` a member of one of its descendants' groups."""
+    rng = random.Random(seed)
+    groups = sorted(parents)
+    for group in groups[::every]:
+        descendants = [other for other in groups if other.startswith(group + ".")]
+        if descendants:
+            parents[group] = parents[group] + [rng.choice(descendants)]
+    return parents
+
+
+def naive_closure(parents):
+    """Breadth-first search from every group, for comparison."""
+    closure = {}
+    for group in parents:
+        seen = {group}
+        todo = deque([group])
+        while todo:
+            for parent in parents.get(todo.popleft(), ()):
+                if parent not in seen:
+                    seen.add(parent)
+                    todo.append(parent)
+        closure[group] = seen
+    return closure
+
+
+def run(name, parents, door_groups, users, seed, naive):
+    """Time the closure and the effective groups of `users` random users."""
+    memberships = sum(len(p) for p in parents.values())
+    start = time.perf_counter()
+    closure = group_closure(parents, door_groups)
+    elapsed = time.perf_counter() - start
+    line = f"{name:7} {len(parents):7} groups {memberships:7} memberships  closure {elapsed * 1000:9.1f} ms"
+
+    if naive:
+        start = time.perf_counter()
+        expected = naive_closure(parents)
+        naive_elapsed = time.perf_counter() - start
+        assert all(closure[group] == expected[group] & door_groups for group in parents), "mismatch"
+        line += f"  bfs {naive_elapsed * 1000:9.1f} ms"
+
+    rng = random.Random(seed)
+    groups = sorted(parents)
+    directs = [frozenset(rng.sample(groups, min(3, len(groups)))) for _ in range(users)]
+    start = time.perf_counter()
+    effective = {}
+    for direct in directs:
+        if direct not in effective:
+            effective[direct] = effective_groups(direct, closure, door_groups)
+    elapsed = time.perf_counter() - start
+    line += f"  {users} users {elapsed * 1000:7.1f} ms"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--depth", type=int, default=2000)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--levels", type=int, default=5)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-bfs", action="store_true", help="skip the per group search")
+    args = parser.parse_args()
+
+    run("deep", *deep_graph(args.depth), args.users, args.seed, not args.no_bfs)
+    run("wide", *wide_graph(args.fanout, args.levels), args.users, args.seed, not args.no_bfs)
+    parents, door_groups = wide_graph(args.fanout, args.levels)
+    parents = add_cycles(parents, 50, args.seed)
+    run("cycles", parents, door_groups, args.users, args.seed, not args.no_bfs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,500 @@
+"""Benchmark of the LDAP sync (Server/Program/ldapSync.py) against a synthetic directory.
+
+The directory lives in an in-process fake of the `ldap` module, so no LDAP server is
+needed: users under OU=Users with an rFIDUID, team groups under OU=Teams nested in door
+groups under OU=Doors (with a few membership cycles), one large door group holding most of
+the users, which needs ranged retrieval of `member`, and a share of disabled accounts.
+Entries are built when a search returns them, like python-ldap does, so their memory counts
+in the sync. Run it with CPython from the repository root:
+
+    python Tools/bench_ldap_sync.py [--users 10000,100000,500000] [--mode users|groups|both]
+    python Tools/bench_ldap_sync.py --users 100000 --db-dir /srv/bench   # on a real disk
+
+For every size and sync mode, on a new database:
+  initial   the first sync into the empty database
+  resync    a sync after --churn of the users changed their tag, group or account state,
+            while a thread checks access every --probe-interval seconds, through the ACL
+            snapshot and through SQLite, and compares with the latency before the sync
+  memory    the initial sync again on an empty database, under tracemalloc (slower), for
+            the peak memory allocated by the sync
+
+Phases are the sync functions, the rest of the sync (loops, removals) is "other". SQL
+statements and commits are those executed by the sync and the snapshot it publishes,
+SQLite statements also count what the engine runs for them (triggers, full text index).
+"""
+
+import argparse
+import os
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server", "Program"))
+
+BASE_DN = "DC=bench,DC=local"
+USERS_DN = "OU=Users," + BASE_DN
+DOORS_DN = "OU=Doors," + BASE_DN
+TEAMS_DN = "OU=Teams," + BASE_DN
+MAX_VAL_RANGE = 1500  # Values of `member` AD returns per search
+DISABLED = b"514"
+ENABLED = b"512"
+
+# Functions of ldapSync timed as phases, none calls another one
+PHASES = [
+    ("connect", "initialize_ldap_connection"),
+    ("door groups", "retrieve_groups_from_ldap"),
+    ("nested groups", "retrieve_nested_groups_from_ldap"),
+    ("group members", "retrieve_door_group_members"),
+    ("users", "retrieve_users_from_ldap"),
+    ("users by DN", "retrieve_users_by_dn"),
+    ("closure", "group_closure"),
+    ("user rows", "add_user_to_database"),
+    ("disabled rows", "remove_disabled_user"),
+    ("group rows", "add_group_to_database"),
+    ("snapshot", "publish_snapshot"),
+]
+
+
+class Directory:
+    """A synthetic AD: users, team groups and door groups, as compact records."""
+
+    def __init__(self, users, seed, disabled=0.03):
+        rng = random.Random(seed)
+        self.rng = rng
+        doors = max(10, users // 2000)
+        teams = max(50, users // 100)
+        # Groups: [DN, CN, parent group indexes]
+        self.groups = [[f"CN=Door{i:04d},{DOORS_DN}", f"Door{i:04d}", []] for i in range(doors)]
+        self.groups.append([f"CN=Building-Staff,{DOORS_DN}", "Building-Staff", []])
+        self.door_count = len(self.groups)
+        for i in range(teams):
+            parents = [rng.randrange(doors)]
+            if i and rng.random() < 0.2:
+                parents.append(self.door_count + rng.randrange(i))  # Nested in another team
+            self.groups.append([f"CN=Team{i:05d},{TEAMS_DN}", f"Team{i:05d}", parents])
+        for i in range(self.door_count, len(self.groups), 200):
+            # A cycle: a team is a member of one of its own member teams
+            children = [j for j, group in enumerate(self.groups) if i in group[2]]
+            if children:
+                self.groups[i][2].append(children[0])
+
+        # Users: [tag, userAccountControl, direct group indexes]
+        self.users = []
+        for i in range(users):
+            direct = rng.sample(range(self.door_count, len(self.groups)), rng.randint(1, 3))
+            if rng.random() < 0.1:
+                direct.append(rng.randrange(doors))
+            if rng.random() < 0.6:
+                direct.append(doors)  # Building-Staff
+            state = DISABLED if rng.random() < disabled else ENABLED
+            self.users.append([self.new_tag(), state, direct])
+        self.index_members()
+
+    def new_tag(self):
+        return "%08X" % self.rng.getrandbits(32)
+
+    def index_members(self):
+        """Build the `member` lists of the groups: ("u", index) or ("g", index)."""
+        self.members = [[] for _ in self.groups]
+        for i, (_, _, direct) in enumerate(self.users):
+            for group in direct:
+                self.members[group].append(("u", i))
+        for i, group in enumerate(self.groups):
+            for parent in group[2]:
+                self.members[parent].append(("g", i))
+        self.group_by_dn = {group[0].lower(): i for i, group in enumerate(self.groups)}
+
+    def churn(self, share):
+        """Change the tag, the groups or the account state of a share of the users."""
+        for user in self.rng.sample(self.users, int(len(self.users) * share)):
+            change = self.rng.randrange(3)
+            if change == 0:
+                user[0] = self.new_tag()
+            elif change == 1:
+                user[2] = self.rng.sample(range(self.door_count, len(self.groups)), 2)
+            else:
+                user[1] = ENABLED if user[1] == DISABLED else DISABLED
+        self.index_members()
+
+    def user_dn(self, i):
+        return f"CN=user{i:07d},{USERS_DN}"
+
+    def user_entry(self, i):
+        tag, state, direct = self.users[i]
+        return {
+            "objectClass": [b"top", b"person", b"organizationalPerson", b"user"],
+            "cn": [b"user%07d" % i],
+            "distinguishedName": [self.user_dn(i).encode()],
+            "userPrincipalName": [b"user%07d@bench.local" % i],
+            "rFIDUID": [tag.encode()],
+            "userAccountControl": [state],
+            "memberOf": [self.groups[group][0].encode() for group in direct],
+        }
+
+    def group_entry(self, i):
+        dn, cn, parents = self.groups[i]
+        return {
+            "objectClass": [b"top", b"group"],
+            "cn": [cn.encode()],
+            "distinguishedName": [dn.encode()],
+            "memberOf": [self.groups[parent][0].encode() for parent in parents],
+        }
+
+    def member_dn(self, member):
+        kind, i = member
+        return (self.user_dn(i) if kind == "u" else self.groups[i][0]).encode()
+
+
+def _select(entry, attributes):
+    if not attributes:
+        return entry
+    wanted = {name.lower() for name in attributes}
+    return {name: values for name, values in entry.items() if name.lower() in wanted}
+
+
+_DN_FILTER = re.compile(r"\(distinguishedName=((?:[^()\\]|\\[0-9a-fA-F]{2})*)\)")
+_RANGE = re.compile(r"^member;range=(\d+)-\*$", re.IGNORECASE)
+
+
+def _unescape(value):
+    return re.sub(r"\\([0-9a-fA-F]{2})", lambda m: chr(int(m.group(1), 16)), value)
+
+
+class FakeLDAPObject:
+    """The searches of ldapSync, answered from a Directory, counted."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.searches = 0
+
+    def set_option(self, option, value):
+        pass
+
+    def simple_bind_s(self, who, cred):
+        pass
+
+    def unbind(self):
+        pass
+
+    def search_s(self, base, scope, filterstr="(objectClass=*)", attrlist=None):
+        self.searches += 1
+        directory = self.directory
+        base = base.lower()
+        if scope == fake_ldap.SCOPE_BASE:
+            i = directory.group_by_dn.get(base)
+            if i is None:
+                raise fake_ldap.NO_SUCH_OBJECT({"desc": "No such object"})
+            match = _RANGE.match(attrlist[0]) if attrlist else None
+            if not match:
+                return [(directory.groups[i][0], _select(directory.group_entry(i), attrlist))]
+            start = int(match.group(1))
+            members = directory.members[i][start : start + MAX_VAL_RANGE]
+            end = "*" if start + MAX_VAL_RANGE >= len(directory.members[i]) else start + MAX_VAL_RANGE - 1
+            values = [directory.member_dn(member) for member in members]
+            return [(directory.groups[i][0], {f"member;range={start}-{end}": values})]
+
+        if filterstr == "(objectClass=group)":
+            return [
+                (group[0], _select(directory.group_entry(i), attrlist))
+                for i, group in enumerate(directory.groups)
+                if group[0].lower().endswith(base)
+            ]
+        if filterstr == "(objectClass=user)":
+            if not USERS_DN.lower().endswith(base):
+                return []
+            return [
+                (directory.user_dn(i), _select(directory.user_entry(i), attrlist))
+                for i in range(len(directory.users))
+            ]
+        if filterstr.startswith("(&(objectClass=user)(|"):
+            result = []
+            for dn in _DN_FILTER.findall(filterstr):
+                name = _unescape(dn).split(",", 1)[0]
+                if name.lower().startswith("cn=user") and _unescape(dn).lower().endswith(base):
+                    i = int(name[7:])
+                    if i < len(directory.users):
+                        result.append((directory.user_dn(i), _select(directory.user_entry(i), attrlist)))
+            return result
+        raise fake_ldap.FILTER_ERROR({"desc": f"Bad search filter {filterstr}"})
+
+
+def _escape_filter_chars(value):
+    value = value.replace("\\", "\\5c")
+    for char, escaped in (("*", "\\2a"), ("(", "\\28"), (")", "\\29"), ("\x00", "\\00")):
+        value = value.replace(char, escaped)
+    return value
+
+
+# The parts of python-ldap ldapSync uses
+fake_ldap = types.ModuleType("ldap")
+fake_ldap.SCOPE_BASE, fake_ldap.SCOPE_ONELEVEL, fake_ldap.SCOPE_SUBTREE = 0, 1, 2
+fake_ldap.OPT_REFERRALS = 8
+fake_ldap.LDAPError = type("LDAPError", (Exception,), {})
+fake_ldap.NO_SUCH_OBJECT = type("NO_SUCH_OBJECT", (fake_ldap.LDAPError,), {})
+fake_ldap.FILTER_ERROR = type("FILTER_ERROR", (fake_ldap.LDAPError,), {})
+fake_ldap.filter = types.ModuleType("ldap.filter")
+fake_ldap.filter.escape_filter_chars = _escape_filter_chars
+
+
+def install_fakes(db_file):
+    """Import the server modules with the fake ldap module and a benchmark env module."""
+    env = types.ModuleType("env")
+    env.DBFILE = db_file
+    env.LDAP_SERVER = "ldap://bench.local"
+    env.LDAPUSER = "CN=bench," + USERS_DN
+    env.LDAPPASS = "bench"
+    env.USERS_DN = USERS_DN
+    env.DOOR_ACCESS_GROUPS_DN = DOORS_DN
+    env.NESTED_GROUPS_DN = BASE_DN
+    sys.modules["env"] = env
+    sys.modules["ldap"] = fake_ldap
+    sys.modules["ldap.filter"] = fake_ldap.filter
+
+    import aclSnapshot
+    import database
+    import ldapSync
+
+    return ldapSync, aclSnapshot, database
+
+
+class SyncProbe:
+    """Time the phases of a sync and count its SQL statements and commits."""
+
+    def __init__(self, ldapSync, aclSnapshot):
+        self.modules = [ldapSync, aclSnapshot]
+        self.ldapSync = ldapSync
+        self.originals = {name: getattr(ldapSync, name) for _, name in PHASES}
+        self.reset()
+        probe = self
+
+        class Cursor(sqlite3.Cursor):
+            def execute(self, *args):
+                probe.statements += 1
+                return super().execute(*args)
+
+            def executemany(self, *args):
+                probe.statements += 1
+                return super().executemany(*args)
+
+        class Connection(sqlite3.Connection):
+            def cursor(self, factory=Cursor):
+                return super().cursor(factory)
+
+            def execute(self, *args):
+                return self.cursor().execute(*args)
+
+            def executemany(self, *args):
+                return self.cursor().executemany(*args)
+
+            def commit(self):
+                probe.commits += 1
+                return super().commit()
+
+        def connect(database, **kwargs):
+            conn = sqlite3.connect(database, factory=Connection, **kwargs)
+            conn.set_trace_callback(self.trace)
+            return conn
+
+        self.sqlite3 = types.SimpleNamespace(connect=connect, Error=sqlite3.Error)
+
+    def reset(self):
+        self.times = dict.fromkeys((phase for phase, _ in PHASES), 0.0)
+        self.statements = 0
+        self.commits = 0
+        self.engine_statements = 0
+
+    def trace(self, statement):
+        # Everything SQLite runs, trigger and FTS index statements included
+        self.engine_statements += 1
+
+    def timed(self, phase, function):
+        times = self.times
+        perf_counter = time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                times[phase] += perf_counter() - start
+
+        return wrapper
+
+    def run(self, db_file):
+        """Run one sync and return its total time in seconds."""
+        self.reset()
+        for phase, name in PHASES:
+            setattr(self.ldapSync, name, self.timed(phase, self.originals[name]))
+        for module in self.modules:
+            module.sqlite3 = self.sqlite3
+        try:
+            start = time.perf_counter()
+            self.ldapSync.sync_ldap_to_database(db_file)
+            return time.perf_counter() - start
+        finally:
+            for name, function in self.originals.items():
+                setattr(self.ldapSync, name, function)
+            for module in self.modules:
+                module.sqlite3 = sqlite3
+
+
+class AccessProbe(threading.Thread):
+    """Check access at a fixed interval and record the latencies, like readers would."""
+
+    def __init__(self, check_access, tags, doors, interval, seed):
+        super().__init__(daemon=True)
+        self.check_access = check_access
+        self.tags = tags
+        self.doors = doors
+        self.interval = interval
+        self.rng = random.Random(seed)
+        self.latencies = []
+        self.errors = 0
+        self.stopping = threading.Event()
+
+    def run(self):
+        while not self.stopping.is_set():
+            tag = self.rng.choice(self.tags)
+            door = self.rng.choice(self.doors)
+            start = time.perf_counter()
+            try:
+                self.check_access(tag, door)
+            except Exception:
+                self.errors += 1
+            self.latencies.append(time.perf_counter() - start)
+            self.stopping.wait(self.interval)
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def percentiles(latencies):
+    if not latencies:
+        return "%8s %8s %8s" % ("-", "-", "-")
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    return "%8.2f %8.2f %8.2f" % (statistics.median(ordered) * 1000, p99 * 1000, ordered[-1] * 1000)
+
+
+def reset_database(database, aclSnapshot, db_file):
+    for path in (db_file, aclSnapshot.SNAPSHOT_FILE):
+        if os.path.exists(path):
+            os.remove(path)
+    database.setup_database(db_file)
+
+
+def bench(modules, users, mode, args):
+    """Run the initial sync, the resync under access checks and the memory pass."""
+    ldapSync, aclSnapshot, database = modules
+    db_file = sys.modules["env"].DBFILE
+    directory = Directory(users, args.seed)
+    connection = FakeLDAPObject(directory)
+    fake_ldap.initialize = lambda uri: connection
+    ldapSync.LDAP_SYNC_MODE = mode
+    probe = SyncProbe(ldapSync, aclSnapshot)
+    disabled = sum(user[1] == DISABLED for user in directory.users)
+    print(
+        f"\n{users} users ({disabled} disabled), {len(directory.groups) - directory.door_count} teams, "
+        f"{directory.door_count} door groups, largest group {max(map(len, directory.members))} "
+        f"members, LDAP_SYNC_MODE={mode}"
+    )
+
+    results = []
+    reset_database(database, aclSnapshot, db_file)
+    connection.searches = 0
+    total = probe.run(db_file)
+    results.append(
+        (total, dict(probe.times), probe.statements, probe.commits, probe.engine_statements, connection.searches)
+    )
+
+    # Doors for the access checks, published in a snapshot like the web UI does
+    doors = list(range(1, directory.door_count + 1))
+    for door_id, group in zip(doors, directory.groups):
+        database.add_door_to_database(db_file, group[1], door_id)
+    aclSnapshot.publish_snapshot(db_file)
+    tags = [user[0] for user in directory.users] + [directory.new_tag() for _ in range(users // 10)]
+    checks = [("snapshot", aclSnapshot.check_access), ("sqlite", database.check_access)]
+
+    idle = {}
+    for name, check_access in checks:
+        access = AccessProbe(check_access, tags, doors, args.probe_interval, args.seed)
+        access.start()
+        time.sleep(args.idle)
+        access.stop()
+        idle[name] = access
+
+    directory.churn(args.churn)
+    during = {}
+    for name, check_access in checks:
+        during[name] = AccessProbe(check_access, tags, doors, args.probe_interval, args.seed)
+        during[name].start()
+    connection.searches = 0
+    total = probe.run(db_file)
+    for access in during.values():
+        access.stop()
+    results.append(
+        (total, dict(probe.times), probe.statements, probe.commits, probe.engine_statements, connection.searches)
+    )
+
+    print(f"  {'':16} {'initial':>11} {'resync':>11}")
+    for phase, _ in PHASES:
+        values = [result[1][phase] for result in results]
+        if any(values):
+            print(f"  {phase:16}" + "".join(f" {value * 1000:8.1f} ms" for value in values))
+    print(f"  {'other':16}" + "".join(f" {(t - sum(times.values())) * 1000:8.1f} ms" for t, times, *_ in results))
+    print(f"  {'total':16}" + "".join(f" {t * 1000:8.1f} ms" for t, *_ in results))
+    print(f"  {'SQL statements':16}" + "".join(f" {r[2]:11}" for r in results))
+    print(f"  {'commits':16}" + "".join(f" {r[3]:11}" for r in results))
+    print(f"  {'SQLite stmts':16}" + "".join(f" {r[4]:11}" for r in results))
+    print(f"  {'LDAP searches':16}" + "".join(f" {r[5]:11}" for r in results))
+
+    print(f"  {'check_access ms':16} {'idle p50':>8} {'p99':>8} {'max':>8}   {'resync p50':>10} {'p99':>8} {'max':>8}  checks errors")
+    for name, _ in checks:
+        print(
+            f"  {name:16} {percentiles(idle[name].latencies)}   {percentiles(during[name].latencies):>28}"
+            f"  {len(during[name].latencies):6} {during[name].errors:6}"
+        )
+
+    if not args.no_memory:
+        reset_database(database, aclSnapshot, db_file)
+        tracemalloc.start()
+        probe.run(db_file)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  peak memory of the initial sync: {peak / 1e6:.1f} MB (tracemalloc)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="10000,100000", help="comma separated sizes, e.g. 10000,100000,500000")
+    parser.add_argument("--mode", choices=["users", "groups", "both"], default="both")
+    parser.add_argument("--churn", type=float, default=0.01, help="share of the users changed before the resync")
+    parser.add_argument("--probe-interval", type=float, default=0.005, help="seconds between access checks")
+    parser.add_argument("--idle", type=float, default=2.0, help="seconds of access checks before the resync")
+    parser.add_argument("--db-dir", help="directory of the database (default: a temporary directory)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_ldap_sync_", dir=args.db_dir)
+    try:
+        modules = install_fakes(os.path.join(work_dir, "data.db"))
+        modes = ["users", "groups"] if args.mode == "both" else [args.mode]
+        for users in (int(size) for size in args.users.split(",")):
+            for mode in modes:
+                bench(modules, users, mode, args)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
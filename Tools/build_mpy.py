@@ -0,0 +1,51 @@
+"""Precompile the reader modules to .mpy bytecode.
+
+Importing a .mpy file skips parsing and compiling on the Pico, which shortens
+boot. MicroPython only runs ``main.py`` from source, so the firmware itself is
+compiled to ``firmware.mpy`` and a two line ``main.py`` stub that starts it is
+written next to it. ``env.py`` stays as source, it is edited per door. Needs
+``mpy-cross`` matching the firmware version (``pip install mpy-cross``).
+
+    python Tools/build_mpy.py [--out Client/build]
+
+Then upload the contents of the output directory together with env.py instead
+of the .py files.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Client")
+KEEP_AS_SOURCE = ("env.py",)
+FIRMWARE_MODULE = "firmware"  # main.py is compiled under this name
+MAIN_STUB = "from %s import asyncio, main\n\nasyncio.run(main())\n" % FIRMWARE_MODULE
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", default=os.path.join(CLIENT, "build"))
+    parser.add_argument("--mpy-cross", default="mpy-cross")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for name in sorted(os.listdir(CLIENT)):
+        if not name.endswith(".py") or name in KEEP_AS_SOURCE:
+            continue
+        module = FIRMWARE_MODULE if name == "main.py" else name[:-3]
+        target = os.path.join(args.out, module + ".mpy")
+        subprocess.run(
+            [args.mpy_cross, "-O2", "-o", target, os.path.join(CLIENT, name)],
+            check=True,
+        )
+        print(target)
+    stub = os.path.join(args.out, "main.py")
+    with open(stub, "w") as f:
+        f.write(MAIN_STUB)
+    print(stub)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
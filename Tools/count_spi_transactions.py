@@ -0,0 +1,209 @@
+"""Count SPI transactions made by the MFRC522 driver for one card read.
+
+A small model of the RC522 chip sits behind a fake SPI bus and answers a
+single 4 byte UID card. The script runs the same calls as the firmware's
+`poll_tags` (arm_card_detect and card_present for a poll, then request and
+read_uid for the card read) and prints the number of chip select frames, SPI
+calls and bytes on the bus. It exits with status 1 when a poll or a card read
+takes more chip select frames than its budget. A driver without read_uid (an
+older one given with --driver) is measured with request and SelectTagSN.
+
+    python Tools/count_spi_transactions.py
+    python Tools/count_spi_transactions.py --driver /tmp/old_mfrc522.py
+"""
+
+import argparse
+import importlib.util
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, "fakes"), os.path.join(HERE, "..", "Client")]
+
+import machine  # noqa: E402
+
+CARD_UID = [0xDE, 0xAD, 0xBE, 0xEF]
+CS_PIN = 5
+MAX_POLL_FRAMES = 9  # Chip select frames budget of one poll without a card read
+MAX_READ_FRAMES = 48  # Chip select frames budget of one card read
+
+
+def crc_a(data):
+    """ISO 14443-A CRC, as computed by the chip's CalcCRC command."""
+    crc = 0x6363
+    for byte in data:
+        byte ^= crc & 0xFF
+        byte = (byte ^ (byte << 4)) & 0xFF
+        crc = (crc >> 8) ^ (byte << 8) ^ (byte << 3) ^ (byte >> 4)
+    return [crc & 0xFF, crc >> 8]
+
+
+class Chip:
+    """Register level model of the RC522 with one card in the field."""
+
+    def __init__(self):
+        self.regs = [0] * 64
+        self.fifo = []
+        self.frame = None
+        self.frames = 0
+        self.calls = 0
+        self.bytes = 0
+
+    def select(self, active):
+        if active:
+            self.frame = []
+            self.frames += 1
+        else:
+            self.frame = None
+
+    def transfer(self, out):
+        self.calls += 1
+        self.bytes += len(out)
+        result = bytearray(len(out))
+        for i, byte in enumerate(out):
+            if not self.frame:
+                self.frame.append(byte)
+                continue
+            addr = (self.frame[0] >> 1) & 0x3F
+            if self.frame[0] & 0x80:
+                result[i] = self.read(addr)
+            else:
+                self.write(addr, byte)
+            self.frame.append(byte)
+        return result
+
+    def read(self, addr):
+        if addr == 0x09:
+            return self.fifo.pop(0) if self.fifo else 0
+        if addr == 0x0A:
+            return len(self.fifo)
+        return self.regs[addr]
+
+    def write(self, addr, val):
+        if addr == 0x09:
+            self.fifo.append(val)
+        elif addr == 0x0A:
+            if val & 0x80:
+                self.fifo = []
+        elif addr in (0x04, 0x05):
+            if val & 0x80:
+                self.regs[addr] |= val & 0x7F
+            else:
+                self.regs[addr] &= ~val & 0x7F
+        elif addr == 0x01:
+            self.regs[addr] = val
+            if val == 0x03:
+                crc = crc_a(self.fifo)
+                self.regs[0x22], self.regs[0x21] = crc
+                self.regs[0x05] |= 0x04
+        elif addr == 0x0D:
+            self.regs[addr] = val & 0x7F
+            if val & 0x80 and self.regs[0x01] == 0x0C:
+                self.transceive(self.fifo)
+        else:
+            self.regs[addr] = val
+
+    def transceive(self, frame):
+        bcc = CARD_UID[0] ^ CARD_UID[1] ^ CARD_UID[2] ^ CARD_UID[3]
+        if frame in ([0x26], [0x52]):
+            answer = [0x04, 0x00]  # ATQA
+        elif frame == [0x93, 0x20]:
+            answer = CARD_UID + [bcc]
+        elif frame[:2] == [0x93, 0x70] and frame[2:7] == CARD_UID + [bcc]:
+            answer = [0x08] + crc_a([0x08])  # SAK
+        else:
+            self.regs[0x04] |= 0x01  # TimerIRq, no answer
+            return
+        self.fifo = list(answer)
+        self.regs[0x0C] &= ~0x07
+        self.regs[0x04] |= 0x20  # RxIRq
+
+
+CHIP = Chip()
+
+
+class ChipPin(machine.Pin):
+    def value(self, value=None):
+        if value is not None and self.id == CS_PIN:
+            CHIP.select(not value)
+        return super().value(value)
+
+
+class ChipSPI(machine.SPI):
+    def write(self, buf):
+        CHIP.transfer(bytes(buf))
+
+    def read(self, nbytes, write=0):
+        return bytes(CHIP.transfer(bytes([write]) * nbytes))
+
+    def readinto(self, buf, write=0):
+        buf[:] = CHIP.transfer(bytes([write]) * len(buf))
+
+    def write_readinto(self, out, buf):
+        buf[:] = CHIP.transfer(bytes(out))
+
+
+def load_driver(path):
+    spec = importlib.util.spec_from_file_location("mfrc522_under_test", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.Pin = ChipPin
+    module.SPI = ChipSPI
+    module.uname = lambda: ("rp2",)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--driver", default=os.path.join(HERE, "..", "Client", "mfrc522.py")
+    )
+    parser.add_argument("--max-poll-frames", type=int, default=MAX_POLL_FRAMES)
+    parser.add_argument("--max-read-frames", type=int, default=MAX_READ_FRAMES)
+    args = parser.parse_args()
+
+    driver = load_driver(args.driver)
+    reader = driver.MFRC522(spi_id=0, sck=6, miso=4, mosi=7, cs=CS_PIN, rst=22)
+    over_budget = False
+
+    if hasattr(reader, "arm_card_detect"):
+        CHIP.frames = CHIP.calls = CHIP.bytes = 0
+        reader.arm_card_detect()
+        if not reader.card_present():
+            print("FAILED: card not detected")
+            return 1
+        print(
+            f"poll (arm_card_detect + card_present): {CHIP.frames} chip select frames, "
+            f"{CHIP.calls} SPI calls, {CHIP.bytes} bytes (budget {args.max_poll_frames})"
+        )
+        over_budget = CHIP.frames > args.max_poll_frames
+
+    CHIP.frames = CHIP.calls = CHIP.bytes = 0
+    status, bits = reader.request(reader.REQIDL)
+    if status != reader.OK:
+        print("FAILED: REQA not answered")
+        return 1
+    if hasattr(reader, "read_uid"):
+        path = "request + read_uid"
+        buf = bytearray(10)
+        uid = buf[: reader.read_uid(buf)]
+    else:
+        path = "request + SelectTagSN"
+        status, uid = reader.SelectTagSN()
+        if status != reader.OK:
+            uid = []
+    if list(uid) != CARD_UID:
+        print(f"FAILED: {path} returned {list(uid)}")
+        return 1
+    print(
+        f"card read ({path}): {CHIP.frames} chip select frames, "
+        f"{CHIP.calls} SPI calls, {CHIP.bytes} bytes (budget {args.max_read_frames})"
+    )
+    if over_budget or CHIP.frames > args.max_read_frames:
+        print("FAILED: over the chip select frame budget")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""Fake ``framebuf`` module: a FrameBuffer that only tracks set pixels."""
+
+MONO_VLSB = 0
+MONO_HLSB = 3
+MONO_HMSB = 4
+
+
+class FrameBuffer:
+    def __init__(self, buffer, width, height, format, stride=None):
+        self.buffer = buffer
+        self.width = width
+        self.height = height
+        self.pixels = set()
+
+    def fill(self, color):
+        self.pixels = set()
+
+    def pixel(self, x, y, color=None):
+        if color is None:
+            return 1 if (x, y) in self.pixels else 0
+        if 0 <= x < self.width and 0 <= y < self.height:
+            if color:
+                self.pixels.add((x, y))
+            else:
+                self.pixels.discard((x, y))
+
+    def text(self, string, x, y, color=1):
+        pass
+
+    def hline(self, x, y, w, color):
+        pass
+
+    def vline(self, x, y, h, color):
+        pass
+
+    def fill_rect(self, x, y, w, h, color):
+        pass
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        pass
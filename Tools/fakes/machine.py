@@ -0,0 +1,98 @@
+"""Fake ``machine`` module: pins, buses and timers that only record state."""
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+    PULL_DOWN = 3
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = value or 0
+        self.handler = None
+
+    def init(self, mode=IN, pull=None, value=None):
+        self.mode = mode
+        if value is not None:
+            self._value = value
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+    __call__ = value
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+    def irq(self, handler=None, trigger=IRQ_FALLING):
+        self.handler = handler
+
+
+class SPI:
+    MASTER = 0
+
+    def __init__(self, id=0, baudrate=1000000, **kwargs):
+        self.baudrate = baudrate
+
+    def init(self, *args, **kwargs):
+        self.baudrate = kwargs.get("baudrate", self.baudrate)
+
+    def write(self, buf):
+        pass
+
+    def read(self, nbytes, write=0):
+        return bytes(nbytes)
+
+    def readinto(self, buf, write=0):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+    def write_readinto(self, out, buf):
+        for i in range(len(buf)):
+            buf[i] = 0
+
+
+class I2C:
+    def __init__(self, id=0, scl=None, sda=None, freq=400000):
+        self.freq = freq
+        self.writes = 0
+        self.bytes_written = 0
+
+    def writeto(self, addr, buf):
+        self.writes += 1
+        self.bytes_written += len(buf)
+
+    def writevto(self, addr, bufs):
+        self.writes += 1
+        self.bytes_written += sum(len(b) for b in bufs)
+
+
+class Timer:
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, id=-1):
+        self.callback = None
+
+    def init(self, period=1000, mode=PERIODIC, callback=None):
+        self.callback = callback
+
+    def deinit(self):
+        self.callback = None
+
+
+def reset():
+    raise SystemExit("machine.reset()")
+
+
+def unique_id():
+    return b"\x00\x11\x22\x33\x44\x55\x66\x77"
@@ -0,0 +1,51 @@
+"""Fake MFRC522 driver: tags are placed in the field with ``present``."""
+
+
+class MFRC522:
+    OK = 0
+    NOTAGERR = 1
+    ERR = 2
+
+    REQIDL = 0x26
+    REQALL = 0x52
+
+    def __init__(self, sck=None, mosi=None, miso=None, rst=None, cs=None, irq=None, **kwargs):
+        self.uid = None
+        self.irq = None
+        self.irq_callback = None
+        self.requests = 0
+        self.polls = 0
+
+    def present(self, uid):
+        """Put a tag with the given UID (list of ints) in the field."""
+        self.uid = list(uid)
+
+    def remove(self):
+        """Take the tag out of the field."""
+        self.uid = None
+
+    def init(self):
+        pass
+
+    def arm_card_detect(self):
+        self.polls += 1
+
+    def card_present(self):
+        return self.uid is not None
+
+    def request(self, mode):
+        self.requests += 1
+        if self.uid is None:
+            return self.NOTAGERR, 0
+        return self.OK, 0x10
+
+    def read_uid(self, uid):
+        if self.uid is None:
+            return 0
+        uid[: len(self.uid)] = bytes(self.uid)
+        return len(self.uid)
+
+    def SelectTagSN(self):
+        if self.uid is None:
+            return self.ERR, []
+        return self.OK, list(self.uid)
@@ -0,0 +1,48 @@
+"""Fake ``network`` module: a WLAN interface that associates immediately."""
+
+STA_IF = 0
+AP_IF = 1
+
+_next_ip = [10]
+
+
+class WLAN:
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connected = False
+        self._config = ("0.0.0.0", "255.255.255.0", "0.0.0.0", "0.0.0.0")
+
+    def active(self, value=None):
+        if value is None:
+            return self._active
+        self._active = value
+
+    def connect(self, ssid=None, password=None, bssid=None):
+        self._connected = True
+        if self._config[0] == "0.0.0.0":
+            self._config = ("10.0.0.%d" % _next_ip[0],) + self._config[1:]
+            _next_ip[0] += 1
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self):
+        return self._connected
+
+    def status(self, param=None):
+        if param == "rssi":
+            return -50
+        return 3 if self._connected else 0
+
+    def ifconfig(self, config=None):
+        if config is None:
+            return self._config
+        if config == "dhcp":
+            self._config = ("0.0.0.0",) + self._config[1:]
+        else:
+            self._config = tuple(config)
+
+    def config(self, *args, **kwargs):
+        if args:
+            return {"mac": b"\x00\x11\x22\x33\x44\x55", "channel": 1, "ssid": ""}.get(args[0])
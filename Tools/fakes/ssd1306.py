@@ -0,0 +1,40 @@
+"""Fake SSD1306 OLED: keeps the text currently drawn, ordered by position."""
+
+
+class SSD1306_I2C:
+    def __init__(self, width, height, i2c, addr=0x3C, external_vcc=False):
+        self.width = width
+        self.height = height
+        self.i2c = i2c
+        self.texts = {}
+        self.screen = []
+        self.history = []
+        self.shows = 0
+
+    def fill(self, color):
+        self.texts = {}
+
+    def fill_rect(self, x, y, w, h, color):
+        for pos in list(self.texts):
+            if x <= pos[1] < x + w and y <= pos[0] < y + h:
+                del self.texts[pos]
+
+    def text(self, string, x, y, color=1):
+        self.texts[(y, x)] = string
+
+    def pixel(self, x, y, color=None):
+        pass
+
+    def blit(self, fbuf, x, y, key=-1, palette=None):
+        self.texts = {}
+
+    def show(self):
+        self.screen = [self.texts[pos] for pos in sorted(self.texts)]
+        self.history.append(self.screen)
+        self.shows += 1
+
+    def poweroff(self):
+        pass
+
+    def poweron(self):
+        pass
@@ -0,0 +1,3 @@
+"""Fake ``ujson`` module backed by the standard library."""
+
+from json import dump, dumps, load, loads  # noqa: F401
@@ -0,0 +1,305 @@
+"""Simulate a fleet of readers badging against an access server.
+
+Every virtual reader is a separate instance of the real firmware
+(Client/main.py) running under CPython with the fake drivers in Tools/fakes,
+all in one event loop. Tags are placed in each reader's fake RC522 following
+an arrival pattern, and the time from the tag entering the field to the
+reader showing the decision (green/red LED) is recorded, along with failed
+access requests and scans that never got a decision. The screensaver and the
+firmware's idle gc.collect() are disabled, since all readers share one heap.
+
+By default a built-in stub server answers /access and /health; point the
+readers at a real server (for example the Flask app started locally) with
+--server.
+
+    python Tools/fleet_sim.py --readers 300 --pattern burst --window 10
+    python Tools/fleet_sim.py --readers 100 --pattern poisson --rate 6 --duration 60
+    python Tools/fleet_sim.py --server 127.0.0.1:5000 --csv per_reader.csv
+
+Patterns:
+    poisson  each reader scans at random, --rate scans per minute on average
+    steady   each reader scans every 60 / --rate seconds, random phase
+    burst    shift change: each reader gets --scans tags within --window seconds
+"""
+
+import argparse
+import asyncio
+import contextlib
+import csv
+import importlib.util
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIRMWARE = os.path.join(HERE, "..", "Client", "main.py")
+sys.path[:0] = [os.path.join(HERE, "fakes"), os.path.join(HERE, "..", "Client")]
+
+TAG_HOLD = 0.5  # Seconds a tag stays in the field, longer than the idle poll interval
+DRAIN_TIMEOUT = 30  # Seconds to wait for outstanding decisions at the end
+
+
+class Reader:
+    """One virtual reader: a firmware instance plus its measurements."""
+
+    def __init__(self, index, module):
+        self.index = index
+        self.door_id = module.DOOR_ID
+        self.module = module
+        self.pending = []  # Times tags were presented, oldest first
+        self.latencies = []
+        self.granted = 0
+        self.errors = 0
+        self.scans = 0
+
+    def decided(self, granted):
+        if self.pending:
+            self.latencies.append(time.perf_counter() - self.pending.pop(0))
+        if granted:
+            self.granted += 1
+
+
+def load_firmware(index, door_id, host, port):
+    """Import a fresh copy of Client/main.py with its own env module."""
+    env = types.ModuleType("env")
+    env.DOOR_ID = door_id
+    env.WLAN_SSID = "fleet"
+    env.WLAN_PASS = "fleet"
+    env.SERVER_IP = host
+    env.SERVER_PORT = port
+    sys.modules["env"] = env
+    spec = importlib.util.spec_from_file_location("reader_%d" % index, FIRMWARE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def instrument(reader):
+    """Hook the firmware functions that mark a decision and an access request."""
+    module = reader.module
+    signal_access = module.signal_access
+    http_exchange = module.http_exchange
+
+    def on_decision(granted):
+        reader.decided(granted)
+        signal_access(granted)
+
+    async def on_exchange(request):
+        if not bytes(request[:12]) == b"POST /access":
+            return await http_exchange(request)
+        try:
+            result = await http_exchange(request)
+        except Exception:
+            reader.errors += 1
+            raise
+        if result[0] not in (200, 403):
+            reader.errors += 1
+        return result
+
+    async def no_screensaver():
+        pass
+
+    module.signal_access = on_decision
+    module.http_exchange = on_exchange
+    # All readers share one CPython heap: a gc.collect() per reader would scan every
+    # instance, and the screensaver circles would only cost CPU, so both are disabled
+    module.gc = types.SimpleNamespace(collect=lambda: None)
+    module.build_screensaver_circles = no_screensaver
+    module.SCREEN_TIMEOUT = 10**9
+    module.NET_CACHE_FILE = "netcache_%d.json" % reader.index
+
+
+def scan_times(pattern, rng, args):
+    """Offsets (seconds from the start) at which one reader sees a tag."""
+    if pattern == "burst":
+        return sorted(rng.uniform(0, args.window) for _ in range(args.scans))
+    period = 60.0 / args.rate
+    times = []
+    t = rng.uniform(0, period) if pattern == "steady" else rng.expovariate(1 / period)
+    while t < args.duration:
+        times.append(t)
+        t += period if pattern == "steady" else rng.expovariate(1 / period)
+    return times
+
+
+async def badge(reader, offsets, start, rng):
+    """Present a new random tag to the reader at each offset."""
+    rfid = reader.module.reader
+    for offset in offsets:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        reader.scans += 1
+        reader.pending.append(time.perf_counter())
+        rfid.present([rng.randrange(256) for _ in range(4)])
+        await asyncio.sleep(TAG_HOLD)
+        rfid.remove()
+
+
+async def stub_server(delay, grant_ratio, rng):
+    """A minimal access server answering /access and /health."""
+
+    async def handle(stream_reader, writer):
+        try:
+            head = await stream_reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            if length:
+                await stream_reader.readexactly(length)
+            if head.startswith(b"POST /access"):
+                await asyncio.sleep(delay)
+                if rng.random() < grant_ratio:
+                    status, payload = 200, {"access_granted": True, "upn": "user@example.com"}
+                else:
+                    status, payload = 403, {"access_granted": False}
+            else:
+                status, payload = 200, {"status": "ok"}
+            content = json.dumps(payload).encode()
+            writer.write(
+                b"HTTP/1.0 %d X\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+                % (status, len(content))
+                + content
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # The reader gave up on the request, it counts the error itself
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+
+
+def percentile(values, fraction):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summary(values):
+    return "p50 %7.1f  p95 %7.1f  p99 %7.1f  max %7.1f ms" % tuple(
+        percentile(values, f) * 1000 for f in (0.5, 0.95, 0.99, 1.0)
+    )
+
+
+def histogram(values, buckets=(0.05, 0.1, 0.2, 0.5, 1, 2, 5)):
+    counts = [0] * (len(buckets) + 1)
+    for value in values:
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+    labels = ["<= %g s" % b for b in buckets] + ["> %g s" % buckets[-1]]
+    width = max(counts) or 1
+    for label, count in zip(labels, counts):
+        print("  %-9s %6d %s" % (label, count, "#" * (40 * count // width)))
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    server = None
+    if args.server:
+        host, port = args.server.rsplit(":", 1)
+        port = int(port)
+    else:
+        server = await stub_server(args.server_delay, args.grant_ratio, rng)
+        host, port = "127.0.0.1", server.sockets[0].getsockname()[1]
+
+    os.chdir(tempfile.mkdtemp())  # The firmware writes its network cache to the cwd
+    log = sys.stdout if args.verbose else open(os.devnull, "w")
+    readers = []
+    with contextlib.redirect_stdout(log):
+        for i in range(args.readers):
+            reader = Reader(i, load_firmware(i, args.first_door + i, host, port))
+            instrument(reader)
+            readers.append(reader)
+        tasks = [asyncio.create_task(reader.module.main()) for reader in readers]
+        while not all(reader.module.network_ready.is_set() for reader in readers):
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(1)  # Let the boot time server checks finish
+
+        start = time.perf_counter()
+        await asyncio.gather(
+            *(
+                badge(reader, scan_times(args.pattern, rng, args), start, rng)
+                for reader in readers
+            )
+        )
+        deadline = time.perf_counter() + DRAIN_TIMEOUT
+        while any(r.pending for r in readers) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.perf_counter() - start
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    if server:
+        server.close()
+
+    latencies = [value for reader in readers for value in reader.latencies]
+    scans = sum(reader.scans for reader in readers)
+    errors = sum(reader.errors for reader in readers)
+    lost = sum(len(reader.pending) for reader in readers)
+    granted = sum(reader.granted for reader in readers)
+    print(
+        "%d readers, pattern %s, %d scans in %.1f s (%.1f scans/s)"
+        % (len(readers), args.pattern, scans, elapsed, scans / elapsed if elapsed else 0)
+    )
+    print("decisions: %d (%d granted), errors: %d, lost: %d" % (len(latencies), granted, errors, lost))
+    print("scan to decision: " + summary(latencies))
+    histogram(latencies)
+
+    worst = sorted(readers, key=lambda r: percentile(r.latencies, 0.95), reverse=True)
+    print("slowest readers (p95):")
+    for reader in worst[: args.top]:
+        print(
+            "  door %-5s scans %4d errors %3d lost %3d  %s"
+            % (reader.door_id, reader.scans, reader.errors, len(reader.pending), summary(reader.latencies))
+        )
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            out = csv.writer(f)
+            out.writerow(["door_id", "scans", "decisions", "errors", "lost", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+            for reader in readers:
+                out.writerow(
+                    [reader.door_id, reader.scans, len(reader.latencies), reader.errors, len(reader.pending)]
+                    + ["%.1f" % (percentile(reader.latencies, f) * 1000) for f in (0.5, 0.95, 0.99, 1.0)]
+                )
+    return 1 if errors or lost else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0], formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--readers", type=int, default=200)
+    parser.add_argument("--pattern", choices=("poisson", "steady", "burst"), default="burst")
+    parser.add_argument("--rate", type=float, default=4, help="scans per reader per minute")
+    parser.add_argument("--duration", type=float, default=30, help="seconds, poisson and steady")
+    parser.add_argument("--scans", type=int, default=3, help="tags per reader, burst")
+    parser.add_argument("--window", type=float, default=10, help="seconds, burst")
+    parser.add_argument("--server", help="host:port of a running access server")
+    parser.add_argument("--server-delay", type=float, default=0.02, help="stub server delay")
+    parser.add_argument("--grant-ratio", type=float, default=0.8, help="stub server grants")
+    parser.add_argument("--first-door", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--top", type=int, default=5, help="slowest readers to list")
+    parser.add_argument("--csv", help="write per-reader statistics to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the firmware output")
+    args = parser.parse_args()
+    if args.csv:
+        args.csv = os.path.abspath(args.csv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
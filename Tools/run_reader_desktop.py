@@ -0,0 +1,181 @@
+"""Run the reader firmware (Client/main.py) on a computer with fake hardware.
+
+The fake drivers in Tools/fakes replace ``machine``, ``network``, the MFRC522
+and the SSD1306. A small local HTTP server stands in for the access server and
+answers slowly on purpose. The script checks that:
+
+- tag polling keeps running while an access request is in flight,
+- a second person badging during a slow request is still served,
+- the display shows the decision and goes back to "Scan your tag",
+- the reader reports itself to the health endpoint.
+
+With --protocol udp the access requests use the compact UDP protocol; the stand-in
+server answers late, so the reader's retransmissions and stale replies are covered.
+
+    python Tools/run_reader_desktop.py [--protocol udp]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+import tempfile
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(HERE, "fakes"), os.path.join(HERE, "..", "Client")]
+
+ALLOWED = {"1234": "alice@example.com"}
+SLOW_RESPONSE = 1.0
+
+
+async def handle_http(stream_reader, writer, seen, heartbeats):
+    head = await stream_reader.readuntil(b"\r\n\r\n")
+    request_line = head.split(b"\r\n", 1)[0].decode()
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    body = await stream_reader.readexactly(length) if length else b""
+
+    if request_line.startswith("POST /access"):
+        data = json.loads(body)
+        seen.append(data["rfid_uid"])
+        await asyncio.sleep(SLOW_RESPONSE)
+        upn = ALLOWED.get(data["rfid_uid"])
+        status = 200 if upn else 403
+        payload = {"access_granted": True, "upn": upn} if upn else {"access_granted": False}
+    elif request_line.startswith("POST /health"):
+        heartbeats.append(json.loads(body))
+        status, payload = 200, {"status": "ok"}
+    else:
+        status, payload = 200, {}
+    content = json.dumps(payload).encode()
+    writer.write(
+        b"HTTP/1.0 %d X\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n"
+        % (status, len(content))
+        + content
+    )
+    await writer.drain()
+    writer.close()
+
+
+class UDPAccess(asyncio.DatagramProtocol):
+    """Stand-in for Server/Program/accessProtocol.py, every datagram is answered late."""
+
+    def __init__(self, seen):
+        self.seen = seen
+        self.nonces = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        magic, version, uid_len, door_id, nonce, uid = struct.unpack(">2sBBII10s", data)
+        rfid_uid = "".join(str(b) for b in uid[:uid_len])
+        if nonce not in self.nonces:
+            self.nonces.add(nonce)
+            self.seen.append(rfid_uid)
+        upn = ALLOWED.get(rfid_uid)
+        reply = struct.pack(
+            ">2sBBI24s", b"RA", 1, 1 if upn else 0, nonce, (upn or "").encode()[:24]
+        )
+        asyncio.get_running_loop().call_later(
+            SLOW_RESPONSE, self.transport.sendto, reply, addr
+        )
+
+
+async def wait_until(condition, timeout):
+    """Poll `condition` until it is true or `timeout` seconds have passed."""
+    for _ in range(int(timeout / 0.02)):
+        if condition():
+            return True
+        await asyncio.sleep(0.02)
+    return condition()
+
+
+async def run(protocol):
+    seen = []
+    heartbeats = []
+    server = await asyncio.start_server(
+        lambda r, w: handle_http(r, w, seen, heartbeats), "127.0.0.1", 0
+    )
+    port = server.sockets[0].getsockname()[1]
+    udp, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: UDPAccess(seen), local_addr=("127.0.0.1", 0)
+    )
+
+    env = types.ModuleType("env")
+    env.DOOR_ID = 1
+    env.WLAN_SSID = "ssid"
+    env.WLAN_PASS = "pass"
+    env.SERVER_IP = "127.0.0.1"
+    env.SERVER_PORT = port
+    env.ACCESS_PROTOCOL = protocol
+    env.SERVER_UDP_PORT = udp.get_extra_info("sockname")[1]
+    sys.modules["env"] = env
+
+    os.chdir(tempfile.mkdtemp())  # the firmware writes its network cache to the cwd
+    import main
+
+    main.LED_TIME = 0.5
+    firmware = asyncio.create_task(main.main())
+    while not main.ip_address:
+        await asyncio.sleep(0.05)
+    await asyncio.sleep(0.2)
+
+    failures = []
+    reader = main.reader
+
+    reader.present([1, 2, 3, 4])
+    await asyncio.sleep(0.2)
+    reader.remove()
+    polls = reader.polls
+    reader.present([9, 9])
+    await asyncio.sleep(0.2)
+    reader.remove()
+    await asyncio.sleep(0.3)
+    if reader.polls - polls < 3:
+        failures.append("tag polling stalled during a slow request")
+    if main.oled.screen[2:3] != ["Checking..."]:
+        failures.append(f"display not updated during request: {main.oled.screen}")
+
+    shown = lambda text: any(text in screen for screen in main.oled.history)  # noqa: E731
+    if not await wait_until(lambda: shown("Access Denied"), 3 * SLOW_RESPONSE):
+        failures.append(f"denied decision not displayed: {main.oled.history}")
+    if not shown("Access Granted"):
+        failures.append(f"granted decision not displayed: {main.oled.history}")
+    if seen != ["1234", "99"]:
+        failures.append(f"server saw {seen}, expected both badges")
+    if main.redled.value() != 1:
+        failures.append("red LED not lit for the denied tag")
+
+    if not await wait_until(lambda: "Scan your tag" in main.oled.screen, main.LED_TIME + 0.5):
+        failures.append(f"idle message not restored: {main.oled.screen}")
+    if main.greenled.value() or main.redled.value():
+        failures.append("LEDs still on")
+
+    if not heartbeats or heartbeats[0].get("door_id") != 1 or "firmware" not in heartbeats[0]:
+        failures.append(f"no heartbeat on the health endpoint: {heartbeats}")
+
+    firmware.cancel()
+    server.close()
+    udp.close()
+    for failure in failures:
+        print("FAILED:", failure)
+    if not failures:
+        print("ok")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--protocol", choices=("http", "udp"), default="http")
+    args = parser.parse_args()
+    return asyncio.run(run(args.protocol))
+
+
+if __name__ == "__main__":
+    sys.exit(main())